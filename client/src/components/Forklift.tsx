@@ -1,6 +1,4 @@
-import { useState, useEffect } from "react";
-import useWebSocket from "../hooks/useWebSocket";
-import { WS_BASE_URL } from "../config";
+import { useTopic, sendCommand as sendChannelCommand } from "../hooks/useChannel";
 
 
 interface ForkliftState {
@@ -18,29 +16,16 @@ interface ForkliftCommand {
 
 const Forklift = () => {
 
-  const { message, sendMessage } = useWebSocket(`${WS_BASE_URL}/forklift`);
-  
-  const [state, setState] = useState<ForkliftState>({
+  const state = useTopic<ForkliftState>("forklift") ?? {
     command_up: false,
     command_down: false,
     status: "",
     zero: false
-  });
-
-  useEffect(() => {
-    if (message) {
-      try {
-        const parsedMessage = typeof message === 'string' ? JSON.parse(message) : message;
-        setState(parsedMessage);
-      } catch (error) {
-        console.error('Failed to parse message:', error);
-      }
-    }
-  }, [message]);
+  };
 
   const sendCommand = (command: ForkliftCommand) => {
     
-      sendMessage(JSON.stringify(command));
+      sendChannelCommand("forklift", command);
   };
 
   const forkliftUp = () => {
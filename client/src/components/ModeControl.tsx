@@ -1,33 +1,15 @@
-import { useState, useEffect } from "react";
-import useWebSocket from "../hooks/useWebSocket";
-import { WS_BASE_URL } from "../config";
+import { useTopic, sendCommand } from "../hooks/useChannel";
 
 const ModeControl = () => {
 
-  const {message, sendMessage} = useWebSocket(`${WS_BASE_URL}/mode`)
-  const [mode, setMode] = useState<string|null>(null); 
-
-  useEffect(() => {
-    if (message) {
-        const parsedMessage = JSON.parse(message); 
-        setMode(parsedMessage.mode); 
-    
-  }}, [message]);
+  const mode = useTopic<{ mode: string }>("mode")?.mode;
 
   const modeSetupAuto = () =>{
-      sendMessage(
-        JSON.stringify({
-          mode: 'auto',
-        })
-      )
+      sendCommand("set_mode", { mode: 'auto' })
   }
 
   const modeSetupManual = () =>{
-      sendMessage(
-        JSON.stringify({
-          mode:'manual'
-        })
-      )
+      sendCommand("set_mode", { mode: 'manual' })
   }
 
   return (
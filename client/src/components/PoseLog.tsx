@@ -1,6 +1,4 @@
-import { useEffect, useState } from "react";
-import useWebSocket from "../hooks/useWebSocket";
-import { WS_BASE_URL } from "../config";
+import { useTopic } from "../hooks/useChannel";
 
 interface Marker {
     id: number;
@@ -10,29 +8,14 @@ interface Marker {
 }
 
 const PoseLog = () => {
-    const { message } = useWebSocket(`${WS_BASE_URL}/pose`);
-    const [markers, setMarkers] = useState<{ [key: number]: Marker | null }>({ 0: null, 1: null });
+    const pose = useTopic<{ markers: Marker[] }>("pose");
+    const markers: { [key: number]: Marker | null } = { 0: null, 1: null };
 
-    useEffect(() => {
-        if (message) {
-            try {
-                const parsedMarkers: Marker[] = JSON.parse(message);
-                const newMarkers: { [key: number]: Marker | null } = { 0: null, 1: null };
-
-                if (Array.isArray(parsedMarkers)) {
-                    parsedMarkers.forEach((marker) => {
-                        if (marker.id === 0 || marker.id === 1) {
-                            newMarkers[marker.id] = marker;
-                        }
-                    });
-                }
-
-                setMarkers(newMarkers);
-            } catch (error) {
-                console.error("Failed to parse pose data:", error);
-            }
+    pose?.markers.forEach((marker) => {
+        if (marker.id === 0 || marker.id === 1) {
+            markers[marker.id] = marker;
         }
-    }, [message]);
+    });
 
     return (
         <div>
@@ -2,13 +2,31 @@ import { useEffect, useState } from "react";
 import useWebSocket from "../hooks/useWebSocket";
 import { WS_BASE_URL } from "../config";
 
+const VIDEO_FPS = 10;
+const VIDEO_WIDTH = 640;
+const VIDEO_QUALITY = 75;
+
 
 const VideoStream = () => {
-  const { message } = useWebSocket(`${WS_BASE_URL}/video`);
+  // binary mode - raw JPEG bytes, no base64 overhead; the server lowers the quality
+  // (down from these limits) when the link cannot keep up
+  const { message } = useWebSocket(
+    `${WS_BASE_URL}/video?mode=binary&fps=${VIDEO_FPS}&width=${VIDEO_WIDTH}&quality=${VIDEO_QUALITY}&adaptive=1`
+  );
   const [currentFrame, setCurrentFrame] = useState("");
 
   useEffect(() => {
-      setCurrentFrame(message);
+      if (!(message instanceof Blob)) {
+        setCurrentFrame(message);
+        return;
+      }
+
+      const url = URL.createObjectURL(message);
+      setCurrentFrame(url);
+
+      return () => {
+        URL.revokeObjectURL(url);
+      };
   }, [message]);
 
   return (
@@ -16,11 +34,10 @@ const VideoStream = () => {
       <img
         src={currentFrame || ""}
         alt="Video Stream"
-        width="640"
-        height="360"
+        width={VIDEO_WIDTH}
       />
     </div>
   );
 };
 
-export default VideoStream;
\ No newline at end of file
+export default VideoStream;
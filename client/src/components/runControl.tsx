@@ -1,43 +1,24 @@
-import { useState, useEffect } from "react";
-import useWebSocket from "../hooks/useWebSocket";
-import { WS_BASE_URL } from "../config";
-
-const RunControl = () => {
-
-  const {message, sendMessage} = useWebSocket(`${WS_BASE_URL}/runPick`)
-  const [status, setStatus] = useState<string|null>(null); 
-  const [startPickingProcess, setPickingProcess] = useState<boolean|null>(null);
+import { useTopic, sendCommand } from "../hooks/useChannel";
 
+interface PickingState {
+  status: string;
+  start_picking_process: boolean;
+}
 
+const RunControl = () => {
 
-  useEffect(() => {
-    if (message) {
-      try {
-        const parsedMessage = typeof message === 'string' ? JSON.parse(message) : message;
-        setStatus(parsedMessage.status);
-        setPickingProcess(parsedMessage.start_picking_process) 
-          } catch (error) {
-        console.error('Failed to parse message:', error);
-      }
-    }
-  }, [message]);
+  const picking = useTopic<PickingState>("picking");
+  const status = picking?.status;
+  const startPickingProcess = picking?.start_picking_process;
 
   const startPickingProcessFun = () =>{
 
-      sendMessage(
-        JSON.stringify({
-          start_picking_process: true,
-        })
-      )
+      sendCommand("picking", { start: true })
   }
 
   const stopPickingProcessFun = () =>{
     
-      sendMessage(
-        JSON.stringify({
-          start_picking_process: false
-        })
-      )
+      sendCommand("picking", { start: false })
   }
 
   return (
@@ -0,0 +1,147 @@
+import { useEffect, useState } from "react";
+import { WS_BASE_URL } from "../config";
+
+type Listener = (data: any) => void;
+
+interface PendingCommand {
+    resolve: () => void;
+    reject: (error: Error) => void;
+}
+
+const RECONNECT_DELAY_MS = 1000;
+
+// Single /ws connection shared by every component. Components subscribe to topics,
+// the server sends a snapshot of a topic first and only the changed fields afterwards,
+// commands are acknowledged by their id.
+class RobotChannel {
+    private url: string;
+    private ws: WebSocket | null = null;
+    private listeners = new Map<string, Set<Listener>>();
+    private state = new Map<string, any>();
+    private pending = new Map<number, PendingCommand>();
+    private nextId = 1;
+
+    constructor(url: string) {
+        this.url = url;
+    }
+
+    private connect() {
+        const ws = new WebSocket(this.url);
+        this.ws = ws;
+
+        ws.onopen = () => {
+            console.log(`WebSocket connected to ${this.url}`);
+            ws.send(JSON.stringify({ type: "subscribe", topics: [...this.listeners.keys()] }));
+        };
+
+        ws.onmessage = (event) => {
+            let message;
+            try {
+                message = JSON.parse(event.data);
+            } catch (error) {
+                console.error("Failed to parse channel message:", error);
+                return;
+            }
+
+            if (message.type === "snapshot" || message.type === "patch") {
+                const previous = message.type === "patch" ? this.state.get(message.topic) : undefined;
+                const data = { ...previous, ...message.data };
+                this.state.set(message.topic, data);
+                this.listeners.get(message.topic)?.forEach((listener) => listener(data));
+            } else if (message.type === "ack") {
+                const command = this.pending.get(message.id);
+                this.pending.delete(message.id);
+                if (message.ok) {
+                    command?.resolve();
+                } else {
+                    command?.reject(new Error(message.error));
+                }
+            } else if (message.type === "error") {
+                console.error("Channel error:", message.error);
+            }
+        };
+
+        ws.onclose = () => {
+            console.log(`WebSocket disconnected from ${this.url}`);
+            this.pending.forEach((command) => command.reject(new Error("Connection closed")));
+            this.pending.clear();
+            this.ws = null;
+
+            // reconnect while anything still listens, the subscriptions are renewed on open
+            if (this.listeners.size > 0) {
+                setTimeout(() => {
+                    if (this.ws === null && this.listeners.size > 0) {
+                        this.connect();
+                    }
+                }, RECONNECT_DELAY_MS);
+            }
+        };
+
+        ws.onerror = (error) => {
+            console.error(`WebSocket error on ${this.url}:`, error);
+        };
+    }
+
+    private send(message: object) {
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            this.ws.send(JSON.stringify(message));
+            return true;
+        }
+        return false;
+    }
+
+    // calls "listener" with the whole topic state on every change, returns the unsubscribe function
+    subscribe(topic: string, listener: Listener) {
+        let topicListeners = this.listeners.get(topic);
+        if (!topicListeners) {
+            topicListeners = new Set();
+            this.listeners.set(topic, topicListeners);
+            this.send({ type: "subscribe", topics: [topic] });
+        }
+        topicListeners.add(listener);
+
+        if (this.ws === null) {
+            this.connect();
+        } else if (this.state.has(topic)) {
+            listener(this.state.get(topic));
+        }
+
+        return () => {
+            topicListeners.delete(listener);
+            if (topicListeners.size === 0) {
+                this.listeners.delete(topic);
+                this.state.delete(topic);
+                this.send({ type: "unsubscribe", topics: [topic] });
+            }
+            if (this.listeners.size === 0) {
+                this.ws?.close();
+            }
+        };
+    }
+
+    // resolves when the server has acknowledged the command, rejects with its error otherwise
+    command(name: string, args: object = {}) {
+        const id = this.nextId++;
+        return new Promise<void>((resolve, reject) => {
+            if (!this.send({ type: "command", id, name, args })) {
+                reject(new Error("WebSocket is not open"));
+                return;
+            }
+            this.pending.set(id, { resolve, reject });
+        });
+    }
+}
+
+export const channel = new RobotChannel(`${WS_BASE_URL}/ws`);
+
+// latest state of "topic", null until its snapshot arrives
+export const useTopic = <T,>(topic: string): T | null => {
+    const [data, setData] = useState<T | null>(null);
+
+    useEffect(() => channel.subscribe(topic, setData), [topic]);
+
+    return data;
+};
+
+export const sendCommand = (name: string, args: object = {}) =>
+    channel.command(name, args).catch((error: Error) => console.warn(`Command ${name} failed:`, error.message));
@@ -32,9 +32,9 @@ def draw_tags(frame, corners, ids, pose_data):
         
         for i, marker_id in enumerate(ids.flatten()):
             
-            z_cm = pose_data[i]["z_cm"]
-            x_cm = pose_data[i]["x_cm"]
-            roll_deg = pose_data[i]["Roll"]
+            z_cm = pose_data['z_cm'][i]
+            x_cm = pose_data['x_cm'][i]
+            roll_deg = pose_data['roll'][i]
             text = f"ID:{marker_id} Y:{z_cm:.1f}cm X:{x_cm:.1f}cm Roll:{roll_deg:.1f}"
             position = (10, 30 + i * 30)
             put_text_with_outline(frame, text, position)
@@ -5,10 +5,26 @@ class ArucoConfig:
                  dictionary=cv2.aruco.DICT_4X4_50, 
                  parameters=None, 
                  tag_size=0.08, 
-                 correction_factor=1.36):
+                 correction_factor=1.36,
+                 tracking=True,
+                 roi_padding=0.6,
+                 roi_min_padding=24,
+                 full_scan_interval=15,
+                 corner_epsilon=0.5):
         
         
         self.tag_size = tag_size
         self.correction_factor = correction_factor
         self.dictionary = cv2.aruco.getPredefinedDictionary(dictionary)
         self.parameters = parameters if parameters else cv2.aruco.DetectorParameters()
+        
+        # ROI tracking - after a marker is found, next frames are searched only around 
+        # the predicted corners, padded by "roi_padding" x marker size (at least "roi_min_padding" px),
+        # full frame is scanned every "full_scan_interval" frames or when tracking is lost
+        self.tracking = tracking
+        self.roi_padding = roi_padding
+        self.roi_min_padding = roi_min_padding
+        self.full_scan_interval = full_scan_interval
+        
+        # corners that moved less than "corner_epsilon" px reuse the previous pose
+        self.corner_epsilon = corner_epsilon
@@ -1,59 +1,242 @@
 import cv2
-import math
+import time
 from ArucoDetection.arucoConfig import ArucoConfig
+from ArucoDetection.poseData import POSE_DTYPE, empty_pose_records
+from clock import clock
+import metrics
 import numpy as np
 from .Utils import normalize_angle
 
+# ROI larger than this part of the frame is not worth cropping
+MAX_ROI_AREA_RATIO = 0.6
+
+IDENTITY = np.eye(3, dtype=np.float64)
+
+DETECT_SECONDS = metrics.histogram('vision_stage_seconds', "Time spent in a vision stage", labels={'stage': 'detect_tags'})
+POSE_SECONDS = metrics.histogram('vision_stage_seconds', "Time spent in a vision stage", labels={'stage': 'get_pose_data'})
+MARKERS = metrics.counter('vision_markers_total', "Markers detected")
+
+
+def to_gray(image):
+
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
 class ArucoDetector:
-    def __init__(self, camera_matrix):
-        
-        self.camera_matrix = camera_matrix
-        self.tag_config = ArucoConfig()
+    def __init__(self, camera_matrix, dist_coeffs=None, tag_config: ArucoConfig = None):
+
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = None if dist_coeffs is None else np.asarray(dist_coeffs, dtype=np.float64)
+        self.tag_config = tag_config if tag_config is not None else ArucoConfig()
         self.dictionary = self.tag_config.dictionary
         self.parameters = self.tag_config.parameters
         self.tag_size = self.tag_config.tag_size
         self.correction_factor = self.tag_config.correction_factor
-        
+
         self.detector = cv2.aruco.ArucoDetector(self.dictionary, self.parameters)
-    
+        self.object_points = self._marker_object_points()
+
+        # tracking state - corners of the last two detections per marker id
+        self._last_corners = {}
+        self._prev_corners = {}
+        self._frames_since_full_scan = 0
+
+        # marker id -> (corners, pose) of the last solved pose
+        self._pose_cache = {}
+
+        self.full_scans = 0
+        self.roi_scans = 0
+
+        # seconds spent in the last detect_tags call, per step
+        self.timings = {'gray': 0.0, 'detect': 0.0}
+
+    @metrics.timed(DETECT_SECONDS)
     def detect_tags(self, frame):
-        
+
         if frame is None:
             return [], None
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        self.timings['gray'] = 0.0
+        self.timings['detect'] = 0.0
+
+        roi = self._tracking_roi(frame.shape)
+        if roi is not None:
+            corners, ids = self._detect_in_roi(frame, roi)
+
+            # every tracked marker has to be found again, otherwise tracking is lost
+            if ids is not None and set(self._last_corners) <= set(ids.flatten().tolist()):
+                self.roi_scans += 1
+                self._frames_since_full_scan += 1
+                self._update_tracking(corners, ids)
+                return corners, ids
+
+        corners, ids = self._detect(frame)
+
+        self.full_scans += 1
+        self._frames_since_full_scan = 0
+        self._update_tracking(corners, ids)
+
+        return corners, ids
+
+    def _detect(self, image):
+
+        started = time.perf_counter()
+        gray = to_gray(image)
+        converted = time.perf_counter()
         corners, ids, _ = self.detector.detectMarkers(gray)
-        
+
+        self.timings['gray'] += converted - started
+        self.timings['detect'] += time.perf_counter() - converted
         return corners, ids
-    
-    def calculate_pose(self, tvec: np.ndarray, rvec: np.ndarray):
-        
-        x_cm = float(tvec[0][0] * 100)
-        z_cm = float(tvec[0][2] * 100 * self.correction_factor)
-        rot_mat, _ = cv2.Rodrigues(rvec)
-        roll_rad = math.atan2(rot_mat[0, 2], rot_mat[2, 2])
-        roll_deg = normalize_angle(math.degrees(roll_rad))
-        
-        
-        return z_cm , x_cm , roll_deg
-    
-    def get_pose_data(self, corners, ids):
-        
-        pose_data = []
-        if ids is not None:
-            
-            rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(corners, self.tag_size, self.camera_matrix, None)
-
-            for i, marker_id in enumerate(ids.flatten()):
-                
-                z_cm, x_cm, roll_deg = self.calculate_pose(tvecs[i], rvecs[i])
-                
-                pose_data.append({
-                    "id": int(marker_id),            
-                    "x_cm": float(x_cm),             
-                    "z_cm": float(z_cm),             
-                    "Roll": float(roll_deg),         
-                })
-                
-        return pose_data
-    
+
+    def _detect_in_roi(self, frame, roi):
+
+        x0, y0, x1, y1 = roi
+        corners, ids = self._detect(frame[y0:y1, x0:x1])
+
+        if ids is None:
+            return [], None
+
+        offset = np.array([x0, y0], dtype=np.float32)
+        return tuple(c + offset for c in corners), ids
+
+    # padded bounding box around predicted corners of all tracked markers,
+    # None when the full frame should be scanned
+    def _tracking_roi(self, shape):
+
+        config = self.tag_config
+        if not config.tracking or not self._last_corners:
+            return None
+        if self._frames_since_full_scan >= config.full_scan_interval:
+            return None
+
+        predicted = []
+        for marker_id, last in self._last_corners.items():
+            prev = self._prev_corners.get(marker_id)
+            # constant velocity prediction in image space
+            predicted.append(last if prev is None else 2 * last - prev)
+        points = np.concatenate(predicted).reshape(-1, 2)
+
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+        marker_size = max(np.ptp(p.reshape(-1, 2), axis=0).max() for p in predicted)
+        padding = max(config.roi_min_padding, config.roi_padding * marker_size)
+
+        height, width = shape[:2]
+        x0 = int(max(0, x_min - padding))
+        y0 = int(max(0, y_min - padding))
+        x1 = int(min(width, x_max + padding + 1))
+        y1 = int(min(height, y_max + padding + 1))
+
+        if x1 <= x0 or y1 <= y0:
+            return None
+        if (x1 - x0) * (y1 - y0) > MAX_ROI_AREA_RATIO * width * height:
+            return None
+        return x0, y0, x1, y1
+
+    def _update_tracking(self, corners, ids):
+
+        if ids is None:
+            self._last_corners = {}
+            self._prev_corners = {}
+            return
+
+        current = {int(marker_id): corners[i].reshape(4, 2) for i, marker_id in enumerate(ids.flatten())}
+        self._prev_corners = {marker_id: self._last_corners[marker_id]
+                              for marker_id in current if marker_id in self._last_corners}
+        self._last_corners = current
+
+    # marker corners in the marker frame, in the order expected by SOLVEPNP_IPPE_SQUARE
+    def _marker_object_points(self):
+
+        half = self.tag_size / 2
+        return np.array([[-half, half, 0],
+                         [half, half, 0],
+                         [half, -half, 0],
+                         [-half, -half, 0]], dtype=np.float32)
+
+    # solves pose of all given markers, undistortion of every corner is done in one call,
+    # returns (N, 3) rotation and translation vectors
+    def solve_poses(self, corners):
+
+        count = len(corners)
+        image_points = np.ascontiguousarray(np.asarray(corners, dtype=np.float32).reshape(count * 4, 1, 2))
+        normalized = cv2.undistortPoints(image_points, self.camera_matrix, self.dist_coeffs).reshape(count, 4, 2)
+
+        rvecs = np.empty((count, 3), dtype=np.float64)
+        tvecs = np.empty((count, 3), dtype=np.float64)
+        for i in range(count):
+            _, rvec, tvec = cv2.solvePnP(self.object_points, normalized[i], IDENTITY, None,
+                                         flags=cv2.SOLVEPNP_IPPE_SQUARE)
+            rvecs[i] = rvec.ravel()
+            tvecs[i] = tvec.ravel()
+
+        return rvecs, tvecs
+
+    # roll of every marker straight from the rotation vectors (no cv2.Rodrigues per marker),
+    # atan2(R[0, 2], R[2, 2]) with R expanded from the Rodrigues formula
+    def rolls_from_rvecs(self, rvecs):
+
+        theta = np.linalg.norm(rvecs, axis=1)
+        safe_theta = np.where(theta > 0, theta, 1.0)
+        kx, ky, kz = (rvecs / safe_theta[:, None]).T
+        cos, sin = np.cos(theta), np.sin(theta)
+
+        r02 = (1 - cos) * kx * kz + sin * ky
+        r22 = cos + (1 - cos) * kz * kz
+        return normalize_angle(np.degrees(np.arctan2(r02, r22)))
+
+    def calculate_poses(self, rvecs, tvecs):
+
+        x_cm = tvecs[:, 0] * 100
+        z_cm = tvecs[:, 2] * 100 * self.correction_factor
+        return z_cm, x_cm, self.rolls_from_rvecs(rvecs)
+
+    # pose of a marker whose corners did not move more than "corner_epsilon" is reused
+    def _cached_pose(self, marker_id, corners):
+
+        cached = self._pose_cache.get(marker_id)
+        if cached is None:
+            return None
+
+        cached_corners, pose = cached
+        if np.abs(corners - cached_corners).max() > self.tag_config.corner_epsilon:
+            return None
+        return pose
+
+    # pose of every detected marker as a structured array (see poseData.POSE_DTYPE)
+    @metrics.timed(POSE_SECONDS)
+    def get_pose_data(self, corners, ids, timestamp=None, sequence=None):
+
+        if ids is None or len(ids) == 0:
+            return empty_pose_records()
+
+        MARKERS.inc(len(ids))
+
+        marker_ids = ids.ravel()
+        records = np.empty(len(marker_ids), dtype=POSE_DTYPE)
+        records['id'] = marker_ids
+        records['timestamp'] = clock.monotonic() if timestamp is None else timestamp
+        records['seq'] = 0 if sequence is None else sequence
+
+        to_solve = []
+        for i, marker_id in enumerate(marker_ids):
+            pose = self._cached_pose(int(marker_id), corners[i])
+            if pose is None:
+                to_solve.append(i)
+            else:
+                records['x_cm'][i], records['z_cm'][i], records['roll'][i] = pose
+
+        if to_solve:
+            rvecs, tvecs = self.solve_poses([corners[i] for i in to_solve])
+            z_cm, x_cm, roll = self.calculate_poses(rvecs, tvecs)
+            records['x_cm'][to_solve] = x_cm
+            records['z_cm'][to_solve] = z_cm
+            records['roll'][to_solve] = roll
+
+            for j, i in enumerate(to_solve):
+                self._pose_cache[int(marker_ids[i])] = (corners[i].copy(), (x_cm[j], z_cm[j], roll[j]))
+
+        return records
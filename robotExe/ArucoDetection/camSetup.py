@@ -1,47 +1,104 @@
 import numpy as np
 import depthai as dai
+import metrics
+from ArucoDetection.capture import CaptureSource, CapturedFrame
 
-class DepthAICamera:
+GET_FRAME_SECONDS = metrics.histogram('camera_get_frame_seconds', "Time spent waiting for and converting a camera frame")
+FRAMES = metrics.counter('camera_frames_total', "Frames read from the camera")
+
+# "video" - NV12 frames, the detector reads the Y plane straight away without any conversion
+# "preview" - planar BGR frames converted on the host
+OUTPUT_VIDEO = 'video'
+OUTPUT_PREVIEW = 'preview'
+# the video output crops the ISP frame to the video size, so the ISP scales the whole
+# 1920x1080 frame down first: 1/3 gives 640x360 with the full field of view
+VIDEO_ISP_SCALE = (1, 3)
+
+
+# NV12 planes of "data" as a (height * 3/2, width) array, rows may be padded to a wider
+# stride, None when the size does not match any stride
+def nv12_planes(data, width, height):
+
+    rows = height * 3 // 2
+    if len(data) % rows:
+        return None
+    stride = len(data) // rows
+    if stride < width:
+        return None
+    return np.asarray(data, dtype=np.uint8).reshape(rows, stride)[:, :width]
+
+
+class DepthAICamera(CaptureSource):
     def __init__(self, preview_size = (640, 480),
-                 resolution = "THE_1080_P", 
-                 fps = 30):
-        
+                 resolution = "THE_1080_P",
+                 fps = 30,
+                 output = OUTPUT_VIDEO,
+                 isp_scale = VIDEO_ISP_SCALE):
+        CaptureSource.__init__(self)
+
+        # "preview_size" is the size of the preview output, the video output is the scaled ISP frame
         self.preview_size = preview_size
+        self.isp_scale = isp_scale
+        self.frame_size = preview_size
         self.resolution = resolution
         self.fps = fps
+        self.output = output
         self.pipeline = dai.Pipeline()
         self.device = None
         self.video_queue = None
-        self.camera_matrix = None
         self._setup_pipeline()
 
     def _setup_pipeline(self):
-        
+
         cam_rgb = self.pipeline.createColorCamera()
         xout_video = self.pipeline.createXLinkOut()
         xout_video.setStreamName("video")
 
-        cam_rgb.setPreviewSize(*self.preview_size)
         cam_rgb.setResolution(getattr(dai.ColorCameraProperties.SensorResolution, self.resolution))
-        cam_rgb.setInterleaved(False)
         cam_rgb.setFps(self.fps)
-        cam_rgb.preview.link(xout_video.input)
 
-    def start(self):
+        if self.output == OUTPUT_VIDEO:
+            cam_rgb.setIspScale(*self.isp_scale)
+            self.frame_size = cam_rgb.getIspSize()
+            cam_rgb.setVideoSize(*self.frame_size)
+            cam_rgb.video.link(xout_video.input)
+        else:
+            cam_rgb.setPreviewSize(*self.preview_size)
+            cam_rgb.setInterleaved(False)
+            cam_rgb.preview.link(xout_video.input)
+
+    def open(self):
         self.device = dai.Device(self.pipeline)
         self.video_queue = self.device.getOutputQueue(name="video", maxSize=1, blocking=False)
         calib_data = self.device.readCalibration()
-        
+
         self.camera_matrix = np.array(
-            calib_data.getCameraIntrinsics(dai.CameraBoardSocket.RGB, *self.preview_size)
+            calib_data.getCameraIntrinsics(dai.CameraBoardSocket.RGB, *self.frame_size)
         )
+        self.dist_coeffs = np.array(calib_data.getDistortionCoefficients(dai.CameraBoardSocket.RGB))
+
+    # device timestamp (host monotonic clock, seconds) and sequence number come with every frame
+    @metrics.timed(GET_FRAME_SECONDS)
+    def read(self):
 
-    def get_frame(self):
-        
         if self.video_queue is None:
             return None
         frame_data = self.video_queue.get()
-        if frame_data is not None:
-            return frame_data.getCvFrame()
-        return None
+        if frame_data is None:
+            return None
+
+        FRAMES.inc()
+        timestamp = frame_data.getTimestamp().total_seconds()
+        sequence = frame_data.getSequenceNum()
+
+        if self.output == OUTPUT_VIDEO:
+            nv12 = nv12_planes(frame_data.getData(), frame_data.getWidth(), frame_data.getHeight())
+            if nv12 is not None:
+                return CapturedFrame(sequence, timestamp, nv12=nv12)
+        return CapturedFrame(sequence, timestamp, color=frame_data.getCvFrame())
 
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+            self.device = None
+            self.video_queue = None
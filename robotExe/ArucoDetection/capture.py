@@ -0,0 +1,392 @@
+# capture.py
+#
+# Frame sources of the vision pipeline. Every source runs its blocking reads on its own
+# thread and hands out CapturedFrame objects carrying the capture timestamp and sequence
+# number, so consumers never block on a device:
+#
+#   camera = OpenCVCapture('/dev/video0')
+#   camera.start()
+#   frame = camera.try_get()      # None when no new frame arrived since the last call
+#   frame = camera.get(0.5)       # waits at most 0.5 s
+#
+# Sources that get a grayscale plane from the device (the Y plane of NV12, a synthetic
+# render) deliver it as is, colour is only converted when somebody asks for it.
+
+import math
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from ArucoDetection.arucoConfig import ArucoConfig
+from ArucoDetection.pipeline import LatestQueue
+from clock import clock
+
+DEFAULT_FOV_DEG = 70.0
+# how long stop() waits for the reader thread
+STOP_TIMEOUT = 1.0
+
+
+# pinhole camera matrix of a "width" x "height" camera with horizontal field of view "fov_deg",
+# for devices without a calibration
+def default_camera_matrix(width, height, fov_deg=DEFAULT_FOV_DEG):
+
+    focal = width / (2 * math.tan(math.radians(fov_deg) / 2))
+    return np.array([[focal, 0, width / 2],
+                     [0, focal, height / 2],
+                     [0, 0, 1]], dtype=np.float64)
+
+
+# One captured frame. A source fills in the planes it has, the others are converted
+# on first use and kept, e.g. the detector reads "gray" and only the annotation stage
+# (when somebody watches the video) pays for "color".
+# "timestamp" is on the host clock, like the odometry and the pose filters. Files and
+# recordings keep their own time of the frame in "source_time".
+class CapturedFrame:
+
+    def __init__(self, seq, timestamp, color=None, gray=None, nv12=None, source_time=None):
+
+        self.seq = seq
+        self.timestamp = timestamp
+        self.source_time = timestamp if source_time is None else source_time
+        self._color = color
+        self._gray = gray
+        self._nv12 = nv12
+
+    @property
+    def color(self):
+
+        if self._color is None:
+            if self._nv12 is not None:
+                self._color = cv2.cvtColor(self._nv12, cv2.COLOR_YUV2BGR_NV12)
+            else:
+                self._color = cv2.cvtColor(self._gray, cv2.COLOR_GRAY2BGR)
+        return self._color
+
+    @property
+    def gray(self):
+
+        if self._gray is None:
+            if self._nv12 is not None:
+                # the Y plane is the first two thirds of NV12, no conversion at all
+                self._gray = self._nv12[:self._nv12.shape[0] * 2 // 3]
+            else:
+                self._gray = cv2.cvtColor(self._color, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def shape(self):
+        return (self._color if self._color is not None else self.gray).shape[:2]
+
+
+# Base of the frame sources. Subclasses open the device in "open", return the next frame
+# from the blocking "read" (None at the end of a file) and release the device in "close".
+# With "lossless" every frame is kept until it is taken (recordings replayed as fast as
+# possible), otherwise a frame not taken in time is replaced by the newer one.
+class CaptureSource:
+
+    def __init__(self, lossless=False):
+
+        self.camera_matrix = None
+        self.dist_coeffs = None
+        self.running = False
+        self.finished = False
+        self.frames = 0
+
+        # timestamp and sequence number of the last frame returned by "get_frame"
+        self.last_timestamp = None
+        self.last_sequence = None
+
+        self._lossless = lossless
+        self._queue = queue.Queue(maxsize=1) if lossless else LatestQueue()
+        self._thread = None
+
+    def open(self):
+        pass
+
+    def read(self) -> CapturedFrame:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def start(self):
+
+        self.open()
+        self.running = True
+        self._thread = threading.Thread(target=self._read_loop, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+
+        self.running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(STOP_TIMEOUT)
+        self.close()
+
+    def _read_loop(self):
+
+        while self.running:
+            try:
+                frame = self.read()
+            except Exception as e:
+                print(f"{type(self).__name__} read error: {e}")
+                time.sleep(0.1)
+                continue
+
+            if frame is None:
+                self.finished = True
+                break
+            self.frames += 1
+
+            if not self._lossless:
+                self._queue.put(frame)
+                continue
+            while self.running:
+                try:
+                    self._queue.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    # newest frame not taken yet, None right away when there is none
+    def try_get(self) -> CapturedFrame:
+        return self.get(0)
+
+    # newest frame not taken yet, waits up to "timeout" (None = until one arrives or the source ends)
+    def get(self, timeout=None) -> CapturedFrame:
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = 0.1 if deadline is None else min(0.1, max(0.0, deadline - time.monotonic()))
+            frame = self._take(remaining)
+            if frame is not None:
+                return frame
+            if self.finished:
+                # the last frame may have come in just before the end
+                return self._take(0)
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def _take(self, timeout):
+
+        if not self._lossless:
+            return self._queue.get(timeout)
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # colour image of the next frame, the interface of the old camera classes
+    def get_frame(self):
+
+        frame = self.get()
+        if frame is None:
+            return None
+        self.last_timestamp = frame.timestamp
+        self.last_sequence = frame.seq
+        return frame.color
+
+
+# cv2.VideoCapture devices: USB / V4L2 cameras by index or path, or network streams.
+# Frames are stamped with the host clock when they are read.
+class OpenCVCapture(CaptureSource):
+
+    def __init__(self, device=0, width=640, height=480, fps=30,
+                 camera_matrix=None, dist_coeffs=None, api=cv2.CAP_ANY, lossless=False):
+        CaptureSource.__init__(self, lossless)
+
+        self.device = device
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.api = api
+        self._camera_matrix = camera_matrix
+        self._dist_coeffs = dist_coeffs
+        self._capture = None
+        self._seq = 0
+
+    def open(self):
+
+        self._capture = cv2.VideoCapture(self.device, self.api)
+        if not self._capture.isOpened():
+            raise RuntimeError(f"Capture device {self.device} could not be opened")
+        self._configure()
+
+        width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or self.width
+        height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or self.height
+        self.camera_matrix = (np.asarray(self._camera_matrix, dtype=np.float64) if self._camera_matrix is not None
+                              else default_camera_matrix(width, height))
+        self.dist_coeffs = None if self._dist_coeffs is None else np.asarray(self._dist_coeffs, dtype=np.float64)
+
+    def _configure(self):
+
+        self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        self._capture.set(cv2.CAP_PROP_FPS, self.fps)
+        # keep only the newest frame in the driver, older ones are latency
+        self._capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def read(self):
+
+        ok, image = self._capture.read()
+        if not ok:
+            return None
+        self._seq += 1
+        if image.ndim == 2:
+            return CapturedFrame(self._seq, clock.monotonic(), gray=image)
+        return CapturedFrame(self._seq, clock.monotonic(), color=image)
+
+    def close(self):
+
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+# Video files through cv2.VideoCapture. With "realtime" frames are paced at the file rate,
+# otherwise they are read as fast as they are taken. Frames are stamped on the host clock
+# when they are delivered, the position in the file is their "source_time".
+class VideoFileCapture(OpenCVCapture):
+
+    def __init__(self, path, realtime=True, loop=False, camera_matrix=None, dist_coeffs=None):
+        OpenCVCapture.__init__(self, path, camera_matrix=camera_matrix, dist_coeffs=dist_coeffs,
+                               lossless=not realtime)
+
+        self.realtime = realtime
+        self.loop = loop
+        self._started = None
+
+    def _configure(self):
+        pass
+
+    def read(self):
+
+        frame = OpenCVCapture.read(self)
+        if frame is None and self.loop:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._started = None
+            frame = OpenCVCapture.read(self)
+        if frame is None:
+            return None
+        frame.source_time = self._capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+        if self.realtime:
+            if self._started is None:
+                self._started = time.monotonic() - frame.source_time
+            delay = self._started + frame.source_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame.timestamp = clock.monotonic()
+        return frame
+
+
+# Renders the markers of "poses" into grayscale frames with a pinhole camera, for running
+# the whole pipeline without a camera. "poses" maps marker id -> (x_cm, z_cm, roll_deg)
+# in the camera frame (x to the right, z forward, roll about the vertical axis), or is
+# a callable returning such a map, e.g. following a simulated robot.
+class SyntheticCapture(CaptureSource):
+
+    def __init__(self, poses, width=640, height=480, fps=30, fov_deg=DEFAULT_FOV_DEG,
+                 tag_config: ArucoConfig = None, noise=2.0, marker_pixels=120):
+        CaptureSource.__init__(self)
+
+        self.poses = poses
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / fps
+        self.noise = noise
+        self.tag_config = tag_config if tag_config is not None else ArucoConfig()
+        self.camera_matrix = default_camera_matrix(width, height, fov_deg)
+        self.dist_coeffs = np.zeros(5)
+
+        self._marker_pixels = marker_pixels
+        self._markers = {}
+        self._seq = 0
+        self._next = None
+        self._rng = np.random.default_rng()
+
+    def _marker_image(self, marker_id):
+
+        image = self._markers.get(marker_id)
+        if image is None:
+            # white quiet zone of one cell around the marker
+            inner = cv2.aruco.generateImageMarker(self.tag_config.dictionary, marker_id, self._marker_pixels)
+            border = self._marker_pixels // 6
+            image = cv2.copyMakeBorder(inner, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+            self._markers[marker_id] = image
+        return image
+
+    # marker corners in the image, top left first, clockwise
+    def project(self, x_cm, z_cm, roll_deg, size=None):
+
+        half = (self.tag_config.tag_size if size is None else size) / 2
+        roll = math.radians(roll_deg)
+        center = np.array([x_cm / 100, 0.0, z_cm / 100])
+        # marker plane turned by "roll" about the vertical (y) axis
+        right = np.array([math.cos(roll), 0.0, -math.sin(roll)]) * half
+        down = np.array([0.0, half, 0.0])
+        corners = np.array([center - right - down, center + right - down, center + right + down, center - right + down])
+
+        projected = corners @ self.camera_matrix.T
+        return (projected[:, :2] / projected[:, 2:3]).astype(np.float32)
+
+    def render(self, poses):
+
+        frame = np.full((self.height, self.width), 96, dtype=np.uint8)
+        for marker_id, (x_cm, z_cm, roll_deg) in sorted(poses.items(), key=lambda item: -item[1][1]):
+            if z_cm <= 0:
+                continue
+            image = self._marker_image(marker_id)
+            size = image.shape[0]
+            # the quiet zone makes the rendered square larger than the marker itself
+            scale = size / self._marker_pixels
+            corners = self.project(x_cm, z_cm, roll_deg, self.tag_config.tag_size * scale)
+
+            source = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32)
+            warp = cv2.getPerspectiveTransform(source, corners)
+            mask = cv2.warpPerspective(np.full_like(image, 255), warp, (self.width, self.height))
+            warped = cv2.warpPerspective(image, warp, (self.width, self.height))
+            np.copyto(frame, warped, where=mask > 0)
+
+        if self.noise > 0:
+            noise = self._rng.normal(0, self.noise, frame.shape)
+            frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+        return frame
+
+    def read(self):
+
+        now = clock.monotonic()
+        if self._next is None:
+            self._next = now
+        remaining = self._next - now
+        if remaining > 0:
+            clock.sleep(remaining)
+        self._next += self.interval
+
+        poses = self.poses() if callable(self.poses) else self.poses
+        self._seq += 1
+        return CapturedFrame(self._seq, clock.monotonic(), gray=self.render(poses))
+
+
+# frame source from a short description, e.g. from the ROBOT_CAPTURE environment variable:
+#   depthai | opencv:0 | opencv:/dev/video2 | file:run.mp4 | replay:run.rbrec | synthetic
+def create_capture(spec='depthai'):
+
+    kind, _, argument = spec.partition(':')
+
+    if kind == 'depthai':
+        from ArucoDetection.camSetup import DepthAICamera
+        return DepthAICamera()
+    if kind == 'opencv':
+        device = int(argument) if argument.isdigit() else (argument or 0)
+        return OpenCVCapture(device, api=cv2.CAP_V4L2 if str(device).startswith('/dev/') else cv2.CAP_ANY)
+    if kind == 'file':
+        return VideoFileCapture(argument, loop=True)
+    if kind == 'replay':
+        from ArucoDetection.recording import ReplayCamera
+        return ReplayCamera(argument, loop=True)
+    if kind == 'synthetic':
+        # two markers in front of the camera, as at the pick up station
+        return SyntheticCapture({0: (-10.0, 80.0, 10.0), 1: (25.0, 140.0, -5.0)})
+    raise ValueError(f"Unknown capture source: {spec}")
@@ -0,0 +1,70 @@
+# pipeline.py
+
+import threading
+import time
+
+
+# Depth-1 "latest wins" queue connecting pipeline stages.
+# A producer never waits for a slow consumer, an unconsumed item is simply replaced.
+class LatestQueue:
+
+    def __init__(self):
+
+        self._item = None
+        self._has_item = False
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+
+        with self._cond:
+            if self._has_item:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self._cond.notify()
+
+    # returns the newest item or None on timeout
+    def get(self, timeout=None):
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_item, timeout):
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+
+# Throughput and busy time of a single pipeline stage, averaged over "window" seconds
+class StageStats:
+
+    def __init__(self, name, window=1.0):
+
+        self.name = name
+        self.window = window
+        self.fps = 0.0
+        self.busy_ms = 0.0
+        self.total = 0
+
+        self._count = 0
+        self._busy = 0.0
+        self._window_start = time.monotonic()
+
+    def record(self, busy_seconds):
+
+        self.total += 1
+        self._count += 1
+        self._busy += busy_seconds
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self.window:
+            self.fps = self._count / elapsed
+            self.busy_ms = self._busy * 1000 / self._count
+            self._count = 0
+            self._busy = 0.0
+            self._window_start = now
+
+    def __str__(self):
+        return f"{self.name}: {self.fps:.1f} fps, {self.busy_ms:.1f} ms"
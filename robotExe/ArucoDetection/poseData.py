@@ -0,0 +1,172 @@
+# poseData.py
+
+import struct
+import threading
+import numpy as np
+
+# compact pose record produced by ArucoDetector, one row per detected marker
+POSE_DTYPE = np.dtype([
+    ('id', np.int16),
+    ('x_cm', np.float32),
+    ('z_cm', np.float32),
+    ('roll', np.float32),
+    ('timestamp', np.float64),  # capture time of the frame, host monotonic clock [s]
+    ('seq', np.uint32),         # sequence number of the frame
+])
+
+
+# one slot per marker of the DICT_4X4_50 dictionary
+MARKER_SLOTS = 50
+
+# pose table slot, pose fields are NaN while the marker is not visible,
+# timestamp / seq are the ones of the last frame it was seen in (NaN / 0 if never)
+POSE_SLOT_DTYPE = np.dtype([
+    ('x_cm', np.float32),
+    ('z_cm', np.float32),
+    ('roll', np.float32),
+    ('timestamp', np.float64),
+    ('seq', np.uint32),
+    ('visible', np.bool_),
+])
+
+POSE_FIELDS = ('x_cm', 'z_cm', 'roll')
+
+# wire form of the pose records for binary clients: a header with the update number and
+# the record count, then the records little endian without padding (26 bytes each)
+POSE_WIRE_HEADER = struct.Struct('<IH')
+POSE_WIRE_DTYPE = np.dtype([
+    ('id', '<i2'),
+    ('x_cm', '<f4'),
+    ('z_cm', '<f4'),
+    ('roll', '<f4'),
+    ('timestamp', '<f8'),
+    ('seq', '<u4'),
+])
+
+# pose updates a client gets at most per second by default
+POSE_MAX_RATE = 30.0
+# movements below these are sensor jitter and not sent again
+POSE_THRESHOLD_CM = 0.1
+POSE_THRESHOLD_DEG = 0.1
+
+
+def empty_pose_records():
+    return np.zeros(0, dtype=POSE_DTYPE)
+
+
+# JSON friendly form of the pose records, built only for the WebSocket layer
+def pose_records_to_dicts(records):
+
+    return [
+        {"id": int(marker_id), "x_cm": float(x_cm), "z_cm": float(z_cm), "Roll": float(roll)}
+        for marker_id, x_cm, z_cm, roll, _, _ in np.asarray(records, dtype=POSE_DTYPE).tolist()
+    ]
+
+
+def pose_records_to_bytes(records, update=0):
+
+    records = np.asarray(records, dtype=POSE_DTYPE)
+    return POSE_WIRE_HEADER.pack(update & 0xFFFFFFFF, len(records)) + records.astype(POSE_WIRE_DTYPE).tobytes()
+
+
+def pose_records_from_bytes(data):
+
+    update, count = POSE_WIRE_HEADER.unpack_from(data)
+    records = np.frombuffer(data, dtype=POSE_WIRE_DTYPE, count=count, offset=POSE_WIRE_HEADER.size)
+    return update, records.astype(POSE_DTYPE)
+
+
+# Decides which pose updates a single client gets: at most "max_rate" per second, and only
+# when a marker appeared, disappeared or moved more than the thresholds since the last update
+# the client was sent. A suppressed update is never lost, the newest one is sent when the
+# rate allows it again.
+class PoseThrottle:
+
+    def __init__(self, max_rate=POSE_MAX_RATE, threshold_cm=POSE_THRESHOLD_CM, threshold_deg=POSE_THRESHOLD_DEG):
+
+        self.min_interval = 1.0 / max_rate
+        self.threshold_cm = threshold_cm
+        self.threshold_deg = threshold_deg
+        self._last = None
+        self._last_sent = None
+
+    def changed(self, records):
+
+        if self._last is None:
+            return True
+        records = np.sort(np.asarray(records, dtype=POSE_DTYPE), order='id')
+        if len(records) != len(self._last) or (records['id'] != self._last['id']).any():
+            return True
+        if len(records) == 0:
+            return False
+
+        moved = np.abs(records['x_cm'] - self._last['x_cm']) > self.threshold_cm
+        moved |= np.abs(records['z_cm'] - self._last['z_cm']) > self.threshold_cm
+        moved |= np.abs(records['roll'] - self._last['roll']) > self.threshold_deg
+        return bool(moved.any())
+
+    # seconds to wait before "records" can be sent, 0 to send them now, None when nothing changed
+    def delay(self, records, now):
+
+        if not self.changed(records):
+            return None
+        if self._last_sent is None:
+            return 0.0
+        return max(0.0, self._last_sent + self.min_interval - now)
+
+    def sent(self, records, now):
+
+        # sorted by id, so the next comparison goes row by row
+        self._last = np.sort(np.asarray(records, dtype=POSE_DTYPE), order='id')
+        self._last_sent = now
+
+
+# Fixed size pose table indexed by marker id. Updated in place from the pose records of every
+# frame, so lookups are O(1), any number of targets can be followed and nothing is allocated per frame.
+class PoseTable:
+
+    def __init__(self, slots=MARKER_SLOTS):
+
+        self.slots = np.zeros(slots, dtype=POSE_SLOT_DTYPE)
+        for field in POSE_FIELDS + ('timestamp',):
+            self.slots[field] = np.nan
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def update(self, records):
+
+        ids = records['id']
+        known = (ids >= 0) & (ids < len(self.slots))
+        if not known.all():
+            records, ids = records[known], ids[known]
+
+        with self._lock:
+            for field in POSE_FIELDS:
+                self.slots[field] = np.nan
+            self.slots['visible'] = False
+
+            for field in POSE_FIELDS + ('timestamp', 'seq'):
+                self.slots[field][ids] = records[field]
+            self.slots['visible'][ids] = True
+            self.version += 1
+
+    # copy of the slot of "marker_id", None for ids outside of the dictionary
+    def get(self, marker_id):
+
+        if not 0 <= marker_id < len(self.slots):
+            return None
+        with self._lock:
+            return self.slots[marker_id].copy()
+
+    def is_visible(self, marker_id):
+        return 0 <= marker_id < len(self.slots) and bool(self.slots['visible'][marker_id])
+
+    def visible_ids(self):
+        with self._lock:
+            return np.flatnonzero(self.slots['visible'])
+
+    # copies the whole table into "out" (an array of POSE_SLOT_DTYPE) without allocating
+    def copy_to(self, out):
+        with self._lock:
+            out[:] = self.slots
+            return self.version
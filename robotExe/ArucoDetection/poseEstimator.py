@@ -1,49 +1,138 @@
 # poseEstimator.py
 
 import cv2
+import os
 import threading
-from ArucoDetection.camSetup import DepthAICamera
+import time
 from ArucoDetection.arucoDetector import ArucoDetector
+from ArucoDetection.pipeline import LatestQueue, StageStats
+from ArucoDetection.capture import create_capture
 from .Utils import draw_coordinate_system, draw_tags
 from sharedData import shared_data
+from frameHub import frame_hub
 
+VIEW_SIZE = (640, 360)
+QUEUE_TIMEOUT = 0.5
+STATS_INTERVAL = 10.0
+# frame source of the robot, see capture.create_capture
+CAPTURE_ENV = 'ROBOT_CAPTURE'
+
+
+# Vision pipeline split into three stages connected by "latest wins" queues:
+#   capture (this thread) -> detect + pose -> annotate + resize for viewers
+# Pose is published as soon as it is solved, the cosmetic work runs only
+# when somebody is watching the video stream.
+# Any capture source works (see capture.py), e.g. recording.ReplayCamera off the robot.
+# The detector reads the gray plane of a frame, colour is only produced for the annotation.
+# Poses and view frames go to shared_data unless other "publish" callables are given,
+# visionProcess.py runs the estimator in a process of its own that way.
 class PoseEstimator(threading.Thread):
-    def __init__(self):
+    def __init__(self, camera=None, publish_pose=None, publish_frame=None, has_viewers=None):
         threading.Thread.__init__(self)
-        
+
+        if camera is None:
+            camera = create_capture(os.environ.get(CAPTURE_ENV, 'depthai'))
+
+        self.publish_pose = publish_pose or shared_data.set_pose_data
+        self.publish_frame = publish_frame or shared_data.set_frame
+        self.has_viewers = has_viewers or (lambda: frame_hub.subscriber_count() > 0)
+
         self.running = False
-        self.camera = DepthAICamera()
+        self.camera = camera
         self.camera.start()
-        
-        self.aruco_detector = ArucoDetector(self.camera.camera_matrix)
-    
+
+        self.aruco_detector = ArucoDetector(self.camera.camera_matrix, self.camera.dist_coeffs)
+
+        self.detect_queue = LatestQueue()
+        self.annotate_queue = LatestQueue()
+
+        self.stats = {
+            'capture': StageStats('capture'),
+            'detect': StageStats('detect'),
+            'annotate': StageStats('annotate'),
+        }
+
+        self._stage_threads = [
+            threading.Thread(target=self._detect_stage, daemon=True),
+            threading.Thread(target=self._annotate_stage, daemon=True),
+        ]
+
     def run(self):
         self.running = True
-        
+
+        for thread in self._stage_threads:
+            thread.start()
+
+        last_report = time.monotonic()
+
+        while self.running:
+            try:
+                started = time.monotonic()
+                frame = self.camera.get(QUEUE_TIMEOUT)
+                if frame is None:
+                    continue
+
+                self.detect_queue.put(frame)
+                self.stats['capture'].record(time.monotonic() - started)
+
+                if started - last_report >= STATS_INTERVAL:
+                    print(f"PoseEstimator {self.stage_report()}")
+                    last_report = started
+
+            except Exception as e:
+                print(f"PoseEstimator capture error: {e}")
+                continue
+
+    def _detect_stage(self):
+
+        while self.running:
+            try:
+                item = self.detect_queue.get(QUEUE_TIMEOUT)
+                if item is None:
+                    continue
+
+                started = time.monotonic()
+                frame = item
+                corners, ids = self.aruco_detector.detect_tags(frame.gray)
+                pose_data = self.aruco_detector.get_pose_data(corners, ids, frame.timestamp, frame.seq)
+                self.publish_pose(pose_data)
+                self.stats['detect'].record(time.monotonic() - started)
+
+                if self.has_viewers():
+                    self.annotate_queue.put((frame, corners, ids, pose_data))
+
+            except Exception as e:
+                print(f"PoseEstimator detect error: {e}")
+                continue
+
+    def _annotate_stage(self):
+
         while self.running:
             try:
-                frame = self.camera.get_frame()
-                if frame is None or frame.size == 0:
+                item = self.annotate_queue.get(QUEUE_TIMEOUT)
+                if item is None:
                     continue
-                
-                corners, ids = self.aruco_detector.detect_tags(frame)
-                
-                pose_data = self.aruco_detector.get_pose_data(corners, ids)
-                
+
+                started = time.monotonic()
+                captured, corners, ids, pose_data = item
+                frame = captured.color
+
                 if ids is not None and len(pose_data) > 0:
                     draw_tags(frame, corners, ids, pose_data)
-                    
+
                 draw_coordinate_system(frame, (frame.shape[1] // 2, frame.shape[0] // 2))
-                
-                resized_frame = cv2.resize(frame, (640, 360))
-                shared_data.set_frame(resized_frame)
-                shared_data.set_pose_data(pose_data)
-                
-                
+
+                resized_frame = cv2.resize(frame, VIEW_SIZE)
+                self.publish_frame(resized_frame)
+                self.stats['annotate'].record(time.monotonic() - started)
+
             except Exception as e:
-                print(f"PoseEstimator error: {e}")
+                print(f"PoseEstimator annotate error: {e}")
                 continue
-    
+
+    def stage_report(self):
+        return ", ".join(str(stats) for stats in self.stats.values())
+
     def stop(self):
         self.running = False
         if self.camera:
@@ -0,0 +1,185 @@
+# recording.py
+
+import argparse
+import json
+import struct
+import time
+import cv2
+import numpy as np
+from ArucoDetection.capture import CaptureSource, CapturedFrame
+from clock import clock
+
+MAGIC = b'RBREC1\n'
+HEADER_LENGTH = struct.Struct('<I')
+
+# timestamp, sequence number, height, width, channels, payload length
+RECORD = struct.Struct('<dQHHBI')
+
+ENCODINGS = ('png', 'jpg', 'raw')
+
+
+# Writes camera frames together with their device timestamps to a single file:
+#   MAGIC | header length | JSON header (calibration, encoding) | records...
+# "png" is lossless and compact, "raw" is the fastest to write, "jpg" the smallest.
+class FrameRecorder:
+
+    def __init__(self, path, camera_matrix, dist_coeffs=None, encoding='png', jpeg_quality=95):
+
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+
+        self.path = path
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.frames = 0
+
+        header = json.dumps({
+            'camera_matrix': np.asarray(camera_matrix).tolist(),
+            'dist_coeffs': None if dist_coeffs is None else np.asarray(dist_coeffs).ravel().tolist(),
+            'encoding': encoding,
+        }).encode('utf-8')
+
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(HEADER_LENGTH.pack(len(header)))
+        self._file.write(header)
+
+    def record(self, frame, timestamp=None, sequence=None):
+
+        if self.encoding == 'raw':
+            payload = np.ascontiguousarray(frame).tobytes()
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality] if self.encoding == 'jpg' else []
+            ok, buffer = cv2.imencode(f'.{self.encoding}', frame, params)
+            if not ok:
+                raise ValueError("Frame could not be encoded")
+            payload = buffer.tobytes()
+
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        self._file.write(RECORD.pack(time.monotonic() if timestamp is None else timestamp,
+                                     self.frames if sequence is None else sequence,
+                                     frame.shape[0], frame.shape[1], channels, len(payload)))
+        self._file.write(payload)
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+
+# Capture source that plays a recording back like DepthAICamera. With "realtime" the original
+# frame spacing is kept, otherwise every frame is returned, as fast as they are taken.
+# Frames are stamped on the host clock when they are delivered, the recorded timestamp is
+# their "source_time" and starts over when the recording loops.
+class ReplayCamera(CaptureSource):
+
+    def __init__(self, path, realtime=True, loop=False):
+        CaptureSource.__init__(self, lossless=not realtime)
+
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+
+        self.encoding = None
+
+        self._file = None
+        self._data_start = 0
+        self._first_timestamp = None
+        self._replay_start = None
+
+    def open(self):
+
+        self._file = open(self.path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a frame recording")
+
+        (length,) = HEADER_LENGTH.unpack(self._file.read(HEADER_LENGTH.size))
+        header = json.loads(self._file.read(length))
+
+        self.camera_matrix = np.array(header['camera_matrix'], dtype=np.float64)
+        if header['dist_coeffs'] is not None:
+            self.dist_coeffs = np.array(header['dist_coeffs'], dtype=np.float64)
+        self.encoding = header['encoding']
+        self._data_start = self._file.tell()
+
+    def _read_record(self):
+
+        raw = self._file.read(RECORD.size)
+        if len(raw) < RECORD.size:
+            return None
+        timestamp, sequence, height, width, channels, length = RECORD.unpack(raw)
+        payload = self._file.read(length)
+
+        if self.encoding == 'raw':
+            shape = (height, width) if channels == 1 else (height, width, channels)
+            frame = np.frombuffer(payload, dtype=np.uint8).reshape(shape)
+        else:
+            flags = cv2.IMREAD_GRAYSCALE if channels == 1 else cv2.IMREAD_COLOR
+            frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), flags)
+
+        return timestamp, sequence, frame
+
+    def read(self):
+
+        if self._file is None:
+            return None
+
+        record = self._read_record()
+        if record is None and self.loop:
+            self._file.seek(self._data_start)
+            self._first_timestamp = None
+            record = self._read_record()
+        if record is None:
+            return None
+
+        timestamp, sequence, frame = record
+
+        if self.realtime:
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._replay_start = time.monotonic()
+            delay = (timestamp - self._first_timestamp) - (time.monotonic() - self._replay_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        if frame.ndim == 2:
+            return CapturedFrame(sequence, clock.monotonic(), gray=frame, source_time=timestamp)
+        return CapturedFrame(sequence, clock.monotonic(), color=frame, source_time=timestamp)
+
+    def close(self):
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# records frames from the OAK camera on the robot:
+#   python -m ArucoDetection.recording out.rbrec --frames 300
+def main():
+
+    parser = argparse.ArgumentParser(description="Record camera frames for offline replay")
+    parser.add_argument('path')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--encoding', choices=ENCODINGS, default='png')
+    args = parser.parse_args()
+
+    from ArucoDetection.camSetup import DepthAICamera
+
+    camera = DepthAICamera()
+    camera.start()
+    recorder = FrameRecorder(args.path, camera.camera_matrix, camera.dist_coeffs, args.encoding)
+
+    try:
+        while recorder.frames < args.frames:
+            frame = camera.get_frame()
+            if frame is None or frame.size == 0:
+                continue
+            recorder.record(frame, camera.last_timestamp, camera.last_sequence)
+    finally:
+        recorder.close()
+        camera.stop()
+
+    print(f"Recorded {recorder.frames} frames to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# replayBench.py
+#
+# Runs a recording through the vision pipeline and prints per stage latency percentiles,
+# works on any machine with OpenCV, no OAK device needed:
+#   python -m ArucoDetection.replayBench recording.rbrec --unthrottled
+
+import argparse
+import time
+import cv2
+import numpy as np
+from ArucoDetection.recording import ReplayCamera
+from ArucoDetection.arucoDetector import ArucoDetector
+from ArucoDetection.arucoConfig import ArucoConfig
+from ArucoDetection.Utils import draw_coordinate_system, draw_tags
+
+STAGES = ('capture', 'gray', 'detect', 'pose', 'annotate', 'resize')
+PERCENTILES = (50, 90, 99)
+VIEW_SIZE = (640, 360)
+
+
+def run_bench(camera, detector: ArucoDetector, annotate=True, max_frames=None):
+
+    samples = {stage: [] for stage in STAGES}
+    frames = 0
+    started = time.perf_counter()
+
+    while max_frames is None or frames < max_frames:
+
+        t0 = time.perf_counter()
+        captured = camera.get()
+        if captured is None:
+            break
+        t1 = time.perf_counter()
+
+        # colour recordings are converted when the gray plane is first read
+        gray = captured.gray
+        converted = time.perf_counter()
+        corners, ids = detector.detect_tags(gray)
+        t2 = time.perf_counter()
+        pose_data = detector.get_pose_data(corners, ids, captured.timestamp, captured.seq)
+        t3 = time.perf_counter()
+
+        samples['capture'].append(t1 - t0)
+        samples['gray'].append(converted - t1 + detector.timings['gray'])
+        samples['detect'].append(detector.timings['detect'])
+        samples['pose'].append(t3 - t2)
+
+        if annotate:
+            frame = captured.color
+            if ids is not None and len(pose_data) > 0:
+                draw_tags(frame, corners, ids, pose_data)
+            draw_coordinate_system(frame, (frame.shape[1] // 2, frame.shape[0] // 2))
+            t4 = time.perf_counter()
+            cv2.resize(frame, VIEW_SIZE)
+            t5 = time.perf_counter()
+
+            samples['annotate'].append(t4 - t3)
+            samples['resize'].append(t5 - t4)
+
+        frames += 1
+
+    return samples, frames, time.perf_counter() - started
+
+
+def print_report(samples, frames, elapsed):
+
+    print(f"{'stage':<10}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    for stage in STAGES:
+        values = np.array(samples[stage]) * 1000
+        if len(values) == 0:
+            continue
+        row = "".join(f"{v:>10.2f}" for v in np.percentile(values, PERCENTILES))
+        print(f"{stage:<10}{row}{values.max():>10.2f}")
+
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"{frames} frames in {elapsed:.2f} s, sustained {fps:.1f} fps")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Replay a recording through the ArUco pipeline")
+    parser.add_argument('path')
+    parser.add_argument('--unthrottled', action='store_true', help="ignore recorded frame timing")
+    parser.add_argument('--no-annotate', action='store_true')
+    parser.add_argument('--no-tracking', action='store_true', help="always scan the full frame")
+    parser.add_argument('--frames', type=int, default=None)
+    args = parser.parse_args()
+
+    camera = ReplayCamera(args.path, realtime=not args.unthrottled)
+    camera.start()
+    detector = ArucoDetector(camera.camera_matrix, camera.dist_coeffs,
+                             ArucoConfig(tracking=not args.no_tracking))
+
+    try:
+        samples, frames, elapsed = run_bench(camera, detector, not args.no_annotate, args.frames)
+    finally:
+        camera.stop()
+
+    print_report(samples, frames, elapsed)
+    print(f"full scans: {detector.full_scans}, ROI scans: {detector.roi_scans}")
+
+
+if __name__ == "__main__":
+    main()
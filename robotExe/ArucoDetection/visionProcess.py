@@ -0,0 +1,265 @@
+# visionProcess.py
+#
+# Runs the vision pipeline in a process of its own, so detection, annotation, the robot
+# control loop and the uvicorn event loop stop contending for one GIL. Enabled with
+#   ROBOT_VISION_PROCESS=1 uvicorn backend:app --host 0.0.0.0 --port 8000
+#
+# The processes exchange data through shared memory only, nothing is pickled per frame:
+#   PoseBlock - pose records of the newest frame behind a seqlock
+#   FrameRing - ring of preallocated slots for the annotated view frames
+# A byte on a pipe wakes the main process up for every new pose, VisionBridge publishes
+# it in shared_data, so the controller and the backend work the same in both modes.
+
+import multiprocessing
+import os
+import select
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from ArucoDetection.poseData import POSE_DTYPE, MARKER_SLOTS
+
+VISION_PROCESS_ENV = 'ROBOT_VISION_PROCESS'
+
+VIEW_SHAPE = (360, 640, 3)
+RING_SLOTS = 4
+# how long the bridge waits for a wake up byte before checking whether to stop
+WAKE_TIMEOUT = 0.5
+# a sequence number odd for longer than this is a writer that died in the middle of a write
+READ_TIMEOUT = 0.1
+STOP_TIMEOUT = 2.0
+
+# An uncontended lock is taken between the payload and the sequence number: acquiring and
+# releasing a mutex is a full memory barrier, so on the weakly ordered ARM cores of the Pi
+# the other process can not see the new sequence number before the data it covers.
+_barrier_lock = threading.Lock()
+
+
+def _barrier():
+    with _barrier_lock:
+        pass
+
+
+def vision_process_enabled():
+    return os.environ.get(VISION_PROCESS_ENV, '') not in ('', '0')
+
+
+# Pose records of the newest frame. The writer makes the sequence number odd while it
+# writes, the reader copies the records and retries when the sequence number was odd or
+# changed in the meantime, so the writer never waits for a reader. A reader that can not get
+# a consistent copy within "timeout" keeps the last one it got.
+class PoseBlock:
+
+    HEADER_DTYPE = np.dtype([('sequence', np.uint64), ('count', np.uint32), ('viewers', np.uint32)])
+
+    def __init__(self, name=None, slots=MARKER_SLOTS):
+
+        size = self.HEADER_DTYPE.itemsize + slots * POSE_DTYPE.itemsize
+        self.shm = _shared_memory(name, size)
+        self.name = self.shm.name
+
+        self.header = np.ndarray((), dtype=self.HEADER_DTYPE, buffer=self.shm.buf)
+        self.records = np.ndarray((slots,), dtype=POSE_DTYPE, buffer=self.shm.buf, offset=self.HEADER_DTYPE.itemsize)
+        self._last_read = (self.records[:0].copy(), 0)
+
+    def write(self, records):
+
+        count = min(len(records), len(self.records))
+        self.header['sequence'] += 1
+        _barrier()
+        self.records[:count] = records[:count]
+        self.header['count'] = count
+        _barrier()
+        self.header['sequence'] += 1
+
+    # (records, update number) of the newest write, update 0 before the first one
+    def read(self, timeout=READ_TIMEOUT):
+
+        deadline = time.monotonic() + timeout
+        while True:
+            before = int(self.header['sequence'])
+            if not before % 2:
+                _barrier()
+                records = self.records[:int(self.header['count'])].copy()
+                _barrier()
+                if int(self.header['sequence']) == before:
+                    self._last_read = (records, before // 2)
+                    return self._last_read
+
+            if time.monotonic() >= deadline:
+                return self._last_read
+            time.sleep(0)
+
+    # whether somebody watches the video, set by the main process, read by the vision one
+    @property
+    def viewers(self):
+        return bool(self.header['viewers'])
+
+    @viewers.setter
+    def viewers(self, value):
+        self.header['viewers'] = bool(value)
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+
+
+# Annotated view frames in a ring of preallocated slots. A frame is copied into its slot,
+# readers get a view of the slot. A slot is only written again RING_SLOTS - 1 frames later,
+# a reader copies the view out and keeps the copy only when "is_current" confirms the slot
+# was not being written again meanwhile.
+class FrameRing:
+
+    META_DTYPE = np.dtype([('height', np.uint32), ('width', np.uint32)])
+
+    def __init__(self, name=None, slots=RING_SLOTS, shape=VIEW_SHAPE):
+
+        self.slots = slots
+        self.shape = shape
+        frame_bytes = int(np.prod(shape))
+        meta_bytes = slots * self.META_DTYPE.itemsize
+        self.shm = _shared_memory(name, 8 + meta_bytes + slots * frame_bytes)
+        self.name = self.shm.name
+
+        self.published = np.ndarray((), dtype=np.uint64, buffer=self.shm.buf)
+        self.meta = np.ndarray((slots,), dtype=self.META_DTYPE, buffer=self.shm.buf, offset=8)
+        self.frames = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=self.shm.buf, offset=8 + meta_bytes)
+
+    def write(self, frame):
+
+        published = int(self.published)
+        slot = published % self.slots
+        height, width = frame.shape[:2]
+
+        self.frames[slot, :height, :width] = frame.reshape(height, width, -1)
+        self.meta[slot] = (height, width)
+        _barrier()
+        self.published[...] = published + 1
+
+    # (view of the newest frame, its publication number), None before the first frame
+    def latest(self):
+
+        published = int(self.published)
+        if published == 0:
+            return None
+        _barrier()
+        slot = (published - 1) % self.slots
+        height, width = self.meta[slot].tolist()
+        return self.frames[slot, :height, :width], published
+
+    # whether the slot of "publication" has not been written again since, the writer starts
+    # on it once RING_SLOTS - 1 newer frames are out
+    def is_current(self, publication):
+        _barrier()
+        return int(self.published) - publication < self.slots - 1
+
+    def close(self):
+        del self.published, self.meta, self.frames
+        self.shm.close()
+
+
+def _shared_memory(name, size):
+
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shm.buf[:size] = bytes(size)
+        return shm
+    return shared_memory.SharedMemory(name=name)
+
+
+# entry point of the vision process: the usual PoseEstimator, publishing into shared memory
+def _vision_main(pose_name, ring_name, wake, capture_spec):
+
+    from ArucoDetection.capture import create_capture
+    from ArucoDetection.poseEstimator import PoseEstimator
+
+    poses = PoseBlock(pose_name)
+    ring = FrameRing(ring_name)
+    wake_fd = wake.fileno()
+    os.set_blocking(wake_fd, False)
+
+    def publish_pose(records):
+        poses.write(records)
+        try:
+            os.write(wake_fd, b'p')
+        except BlockingIOError:
+            # the main process has not read the earlier ones, it reads the newest poses anyway
+            pass
+
+    estimator = PoseEstimator(create_capture(capture_spec), publish_pose=publish_pose,
+                              publish_frame=ring.write, has_viewers=lambda: poses.viewers)
+    estimator.start()
+    estimator.join()
+
+
+# Main process side of the vision process: starts it, wakes up on every new pose and puts
+# poses and view frames into shared_data, tells the vision process whether anybody watches.
+class VisionBridge(threading.Thread):
+
+    def __init__(self, capture_spec=None):
+        threading.Thread.__init__(self, daemon=True)
+
+        from ArucoDetection.poseEstimator import CAPTURE_ENV
+        self.capture_spec = capture_spec or os.environ.get(CAPTURE_ENV, 'depthai')
+        self.running = False
+
+        self.poses = PoseBlock()
+        self.ring = FrameRing()
+        # spawn, not fork: the parent already runs threads (uvicorn, frame hub) and device handles
+        context = multiprocessing.get_context('spawn')
+        # only the raw descriptors are used, one byte per pose, no pickling
+        self._wake_read, self._wake_write = context.Pipe(duplex=False)
+        self.process = context.Process(target=_vision_main, name='vision', daemon=True,
+                                       args=(self.poses.name, self.ring.name, self._wake_write, self.capture_spec))
+
+    def start(self):
+
+        self.process.start()
+        threading.Thread.start(self)
+
+    def run(self):
+
+        from sharedData import shared_data
+        from frameHub import frame_hub
+
+        self.running = True
+        last_update = 0
+        last_publication = 0
+
+        while self.running:
+            if not self.process.is_alive():
+                if self.running:
+                    print(f"Vision process exited with code {self.process.exitcode}")
+                break
+            self.poses.viewers = frame_hub.subscriber_count() > 0
+
+            ready, _, _ = select.select([self._wake_read.fileno()], [], [], WAKE_TIMEOUT)
+            if not ready:
+                continue
+            os.read(self._wake_read.fileno(), 4096)
+
+            records, update = self.poses.read()
+            if update != last_update:
+                last_update = update
+                shared_data.set_pose_data(records)
+
+            latest = self.ring.latest()
+            if latest is not None and latest[1] != last_publication:
+                view, last_publication = latest
+                # shared_data keeps the frame, so it gets its own copy, not the slot
+                frame = view.copy()
+                if self.ring.is_current(last_publication):
+                    shared_data.set_frame(frame)
+
+    def stop(self):
+
+        self.running = False
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(STOP_TIMEOUT)
+        self.join(STOP_TIMEOUT)
+
+        self.poses.shm.unlink()
+        self.ring.shm.unlink()
+        self._wake_read.close()
+        self._wake_write.close()
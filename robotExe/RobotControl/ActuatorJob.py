@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import threading
+from RobotControl.MotionScheduler import PENDING, RUNNING, DONE, CANCELLED
+
+logger = logging.getLogger(__name__)
+
+FAILED = 'failed'
+
+
+# Handle of an actuator move running in the background. The caller can poll its progress,
+# cancel it, block on it from a thread or await it from asyncio code.
+#
+#   job = forklift.lift_up()
+#   ...              # the robot keeps doing other things meanwhile
+#   job.wait()
+class ActuatorJob:
+
+    def __init__(self, name, progress=None):
+
+        self.name = name
+        self.state = PENDING
+        self.error = None
+
+        # callable returning the completed fraction of the move (0..1)
+        self._progress = progress
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    @property
+    def progress(self):
+
+        if self.state == DONE:
+            return 1.0
+        if self._progress is None or self.state == PENDING:
+            return 0.0
+        return min(1.0, max(0.0, self._progress()))
+
+    def done(self):
+        return self._finished.is_set()
+
+    # asks the move to stop at its next step, the job ends as "cancelled"
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    # asyncio equivalent of "wait", never blocks the event loop
+    async def wait_async(self, timeout=None):
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.done():
+                return True
+            self._waiters.append((loop, future))
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.done()
+
+    # runs "work(job)" on a daemon thread, "work" checks "job.cancelled" as it goes
+    def start(self, work):
+
+        def run():
+            self.state = RUNNING
+            try:
+                work(self)
+            except Exception as e:
+                logger.error("Actuator job %s failed: %s", self.name, e)
+                self.error = e
+                self._finish(FAILED)
+            else:
+                self._finish(CANCELLED if self.cancelled() else DONE)
+
+        threading.Thread(target=run, name=f"job-{self.name}", daemon=True).start()
+        return self
+
+    def _finish(self, state):
+
+        with self._lock:
+            self.state = state
+            self._finished.set()
+            waiters, self._waiters = self._waiters, []
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            except RuntimeError:
+                # event loop already closed
+                pass
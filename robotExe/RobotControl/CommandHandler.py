@@ -1,62 +1,165 @@
+import logging
+import os
+import struct
+import threading
 import serial
+import metrics
+from telemetryLog import telemetry_log
+from RobotControl.SerialTransport import SerialTransport
+
+
+logger = logging.getLogger(__name__)
+
+MOTOR_COUNT = 4
+
+SENT_FRAMES = metrics.counter('serial_sent_frames_total', "Frames handed to the serial transport")
+SENT_BYTES = metrics.counter('serial_sent_bytes_total', "Bytes handed to the serial transport")
+
+# 'legacy' - one SET_SPEED_MOTOR_n line per changed wheel
+# 'text'   - one SET_SPEED_ALL line for all four wheels
+# 'binary' - compact SET_SPEED_ALL frame with checksum
+FRAMING_LEGACY = 'legacy'
+FRAMING_TEXT = 'text'
+FRAMING_BINARY = 'binary'
+FRAMINGS = (FRAMING_LEGACY, FRAMING_TEXT, FRAMING_BINARY)
+# the robot's firmware only parses the legacy lines until SET_SPEED_ALL ships, the other
+# framings are enabled per robot, e.g. ROBOT_SERIAL_FRAMING=binary
+FRAMING_ENV = 'ROBOT_SERIAL_FRAMING'
+
+# binary frame: start byte, command id, 4 x int16 RPM (little endian), xor checksum
+FRAME_START = 0xA5
+CMD_SET_SPEED_ALL = 0x01
+SPEED_FRAME = struct.Struct('<BB4h')
+RPM_LIMIT = 32767
+
+
+def checksum(data: bytes):
+
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def encode_speed_frame(speeds):
+
+    clamped = [max(-RPM_LIMIT, min(RPM_LIMIT, rpm)) for rpm in speeds]
+    body = SPEED_FRAME.pack(FRAME_START, CMD_SET_SPEED_ALL, *clamped)
+    return body + bytes((checksum(body),))
 
 
 class CommandHandler:
-    
-    def __init__(self, 
+
+    def __init__(self,
                  baudrate = 115200,
-                 port = '/dev/ttyACM1'):
-        
+                 port = '/dev/ttyACM1',
+                 framing = None,
+                 conn = None):
+
         self.baudrate = baudrate
         self.port = port
-        self.conn = serial.Serial(self.port, self.baudrate, timeout=1)
-        
-    def sendData(self, _data):
-        
-        data = f"{_data}"
-        self.conn.write(data.encode('utf-8'))
+        self.framing = framing or os.environ.get(FRAMING_ENV, FRAMING_LEGACY)
+        if self.framing not in FRAMINGS:
+            raise ValueError(f"Unknown serial framing: {self.framing}")
+        self.conn = conn if conn is not None else serial.Serial(self.port, self.baudrate, timeout=1)
+
+        # writes go through the transport queue, the control loop never waits for the port
+        self.transport = SerialTransport(self.conn)
+        self.transport.start()
+
+        # newest setpoint per wheel waiting to be flushed and the last one put on the wire,
+        # setpoints that did not change are never sent again
+        self._pending = [None] * MOTOR_COUNT
+        self._sent = [None] * MOTOR_COUNT
+        self._lock = threading.Lock()
+
+    def sendData(self, _data, key=None):
+
+        if isinstance(_data, (bytes, bytearray)):
+            data = bytes(_data)
+        else:
+            data = f"{_data}".encode('utf-8')
+
+        self.transport.send(data, key)
+        SENT_FRAMES.inc()
+        SENT_BYTES.inc(len(data))
+
+    # stores the newest setpoint of a single wheel, nothing is sent until "flush"
+    def stageSpeed(self, motor, rpm):
+
+        with self._lock:
+            self._pending[motor] = int(round(rpm))
+
+    # sends all staged setpoints in one go, returns False when nothing has changed
+    def flush(self, force=False):
+
+        with self._lock:
+            speeds = [pending if pending is not None else (sent or 0)
+                      for pending, sent in zip(self._pending, self._sent)]
+            self._pending = [None] * MOTOR_COUNT
+
+            if speeds == self._sent and not force:
+                return False
+
+            changed = [force or speed != sent for speed, sent in zip(speeds, self._sent)]
+            self._sent = speeds
+            self._write_speeds(speeds, changed)
+            telemetry_log.setpoint(speeds)
+
+        logger.debug("speeds have been set: %s", speeds)
+        return True
+
+    def _write_speeds(self, speeds, changed):
+
+        if self.framing == FRAMING_BINARY:
+            self.sendData(encode_speed_frame(speeds), key='speed')
+
+        elif self.framing == FRAMING_TEXT:
+            fl, fr, rl, rr = speeds
+            self.sendData(f'SET_SPEED_ALL:RPM:{fl},{fr},{rl},{rr};\n', key='speed')
+
+        else:
+            for motor, (speed, send) in enumerate(zip(speeds, changed)):
+                if send:
+                    self.sendData(f'SET_SPEED_MOTOR_{motor}:RPM:{speed};\n', key=f'speed_{motor}')
 
     def setFLSpeed(self, fl):
-        command = f'SET_SPEED_MOTOR_0:RPM:{fl};\n'
-        self.sendData(command)
-        print(command)
-        
-        
+        self.stageSpeed(0, fl)
+        self.flush()
+
+
     def setFRSpeed(self, fr):
-        command = f'SET_SPEED_MOTOR_1:RPM:{fr};\n'
-        self.sendData(command)
-        print(command)
-        
-        
+        self.stageSpeed(1, fr)
+        self.flush()
+
+
     def setRLSpeed(self, rl):
-        command = f'SET_SPEED_MOTOR_2:RPM:{rl};\n'
-        self.sendData(command)
-        print(command)
-        
-        
+        self.stageSpeed(2, rl)
+        self.flush()
+
+
     def setRRSpeed(self, rr):
-        command = f'SET_SPEED_MOTOR_3:RPM:{rr};\n'
-        self.sendData(command)
-        print(command)
-        
-        
+        self.stageSpeed(3, rr)
+        self.flush()
+
+
     def sendPIDCommand(self, motor, kp, ki, kd):
         command = f"SET_PID_MOTOR_{motor};Kp:{kp};Ki:{ki};Kd:{kd};\n"
         self.sendData(command)
-        
-        
-    def sendSpeedCommand(self, fl, fr, rl, rr):
-        
-        self.setFLSpeed(fl)
-        self.setFRSpeed(fr)
-        self.setRLSpeed(rl)
-        self.setRRSpeed(rr)
-        
-        print("speeds have been set")
-        
+
+
+    # sets all four wheels with a single frame, "force" resends even unchanged setpoints
+    def sendSpeedCommand(self, fl, fr, rl, rr, force=False):
+
+        with self._lock:
+            self._pending = [int(round(speed)) for speed in (fl, fr, rl, rr)]
+
+        return self.flush(force)
+
+    # blocking read of a single telemetry line, only MotorControlData reader thread should call it
     def readUART(self):
 
-        data = self.conn.readline()
-        decoded_data = data.decode('utf-8').strip()
-        print(decoded_data)
+        data = self.transport.readline()
+        decoded_data = data.decode('utf-8', errors='replace').strip()
+        logger.debug("received: %s", decoded_data)
         return decoded_data
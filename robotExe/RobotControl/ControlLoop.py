@@ -0,0 +1,106 @@
+import metrics
+from clock import clock
+
+
+CONTROL_RATE = 50.0
+
+
+# Fixed rate executor for control loops. Every iteration is scheduled on the monotonic
+# clock (no drift from the work done in between), the real dt is measured and
+# jitter, overruns and missed deadlines are counted to size the rate to the Pi's headroom.
+#
+#   loop = FixedRateLoop(50)
+#   loop.start()
+#   while ...:
+#       dt = loop.wait_next()
+#       ...
+class FixedRateLoop:
+
+    def __init__(self, rate_hz=CONTROL_RATE, name='control'):
+
+        self.period = 1.0 / rate_hz
+        # buckets around the nominal period
+        buckets = [self.period * f for f in (0.5, 0.9, 0.95, 0.99, 1.01, 1.05, 1.1, 1.5, 2.0, 5.0)]
+        self.period_histogram = metrics.histogram('loop_period_seconds', "Measured period of a fixed rate loop",
+                                                  buckets=buckets, labels={'loop': name})
+        self.work_histogram = metrics.histogram('loop_work_seconds', "Work done in one fixed rate loop iteration",
+                                                labels={'loop': name})
+        self.reset_stats()
+        self._next = None
+        self._last_wake = None
+
+    def reset_stats(self):
+
+        self.iterations = 0
+        self.overruns = 0           # work took longer than one period
+        self.deadline_misses = 0    # whole periods skipped because of it
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+        self.max_work = 0.0
+        self.last_dt = None
+
+    def start(self):
+
+        self._next = clock.monotonic()
+        self._last_wake = None
+
+    # sleeps until the next period starts, returns the measured time since the previous one
+    # (None on the first iteration)
+    def wait_next(self):
+
+        if self._next is None:
+            self.start()
+
+        self.end_iteration()
+        clock.sleep(self._next - clock.monotonic())
+        return self.begin_iteration()
+
+    # event driven users split "wait_next": "end_iteration" after the work, then wait for
+    # "next_deadline" (or anything else), then "begin_iteration" once the deadline has passed
+    def end_iteration(self):
+
+        called = clock.monotonic()
+        if self._last_wake is not None:
+            work = called - self._last_wake
+            self.max_work = max(self.max_work, work)
+            self.work_histogram.observe(work)
+            if work > self.period:
+                self.overruns += 1
+
+        # running behind - skip the missed periods instead of bursting to catch up
+        if called > self._next + self.period:
+            missed = int((called - self._next) / self.period)
+            self.deadline_misses += missed
+            self._next += missed * self.period
+
+    def next_deadline(self):
+        return self._next
+
+    def begin_iteration(self):
+
+        now = clock.monotonic()
+
+        jitter = max(0.0, now - self._next)
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_jitter += jitter
+        self.iterations += 1
+
+        self.last_dt = None if self._last_wake is None else now - self._last_wake
+        if self.last_dt is not None:
+            self.period_histogram.observe(self.last_dt)
+        self._last_wake = now
+        self._next += self.period
+
+        return self.last_dt
+
+    def stats(self):
+
+        return {
+            'rate_hz': 1.0 / self.period,
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'deadline_misses': self.deadline_misses,
+            'mean_jitter_ms': self.total_jitter * 1000 / self.iterations if self.iterations else 0.0,
+            'max_jitter_ms': self.max_jitter * 1000,
+            'max_work_ms': self.max_work * 1000,
+        }
@@ -68,33 +68,31 @@ from RobotControl.CommandHandler import CommandHandler
 class DirectDriveController():
     
     def __init__(self):
-        self.fl_prev = 0.0
-        self.fr_prev = 0.0
-        self.rl_prev = 0.0
-        self.rr_prev = 0.0
-        
  
         self.kp_x = 8.5
-        self.kd_x = 1
-        self.prev_error_x = 0.0
-        self.dt = 1  
+        # kd na sekundę - wcześniej 1 na iterację przy ~30 klatkach/s
+        self.kd_x = 1 / 30
+        self.prev_error_x = None
 
 
     
-    def ProportionalDerivative(self, current_value, desired_value, kp, kd, prev_error):
+    # dt - zmierzony czas od poprzedniego obliczenia [s], None gdy brak poprzedniej próbki
+    def ProportionalDerivative(self, current_value, desired_value, kp, kd, prev_error, dt):
 
         error = desired_value - current_value
 
         proportional = kp * error
 
-        derivative = kd * (error - prev_error) / self.dt
+        derivative = 0.0
+        if prev_error is not None and dt:
+            derivative = kd * (error - prev_error) / dt
 
         return proportional + derivative, error
     
-    def directDrive(self, commandHandler: CommandHandler, target: Target, desired_x):
-        if target.y != "Not Visible":
+    def directDrive(self, commandHandler: CommandHandler, target: Target, desired_x, dt=None):
+        if target.visible:
             x, self.prev_error_x = self.ProportionalDerivative(
-                target.x, desired_x, self.kp_x, self.kd_x, self.prev_error_x
+                target.x, desired_x, self.kp_x, self.kd_x, self.prev_error_x, dt
             )
 
             angle = target.angle
@@ -103,35 +101,12 @@ class DirectDriveController():
 
             fl, fr, rl, rr = kinematics(x, y, angle)
             
-            fl = round(fl)
-            fr = round(fr)
-            rl = round(rl)
-            rr = round(rr)
-            
-            # Wysyłanie prędkości tylko, jeśli uległy zmianie
-            if fl != self.fl_prev:
-                commandHandler.setFLSpeed(fl)
-                self.fl_prev = fl
-        
-            if fr != self.fr_prev:
-                commandHandler.setFRSpeed(fr)
-                self.fr_prev = fr
-            
-            if rl != self.rl_prev:
-                commandHandler.setRLSpeed(rl)
-                self.rl_prev = rl
-                
-            if rr != self.rr_prev:
-                commandHandler.setRRSpeed(rr)
-                self.rr_prev = rr    
+            # Jedna ramka dla wszystkich kół, CommandHandler pomija niezmienione prędkości
+            commandHandler.sendSpeedCommand(fl, fr, rl, rr)
                 
     def resetWheelsSpeed(self):
         """
-        Reset prędkości kół i błędów kontrolerów.
+        Reset błędów kontrolerów.
         """
-        self.fl_prev = 0
-        self.fr_prev = 0
-        self.rl_prev = 0
-        self.rr_prev = 0
-        self.prev_error_x = 0.0
+        self.prev_error_x = None
         self.prev_error_angle = 0.0
@@ -1,10 +1,69 @@
+import json
+import logging
+import os
+import threading
 from gpiozero import LED, Button
-import time
+from clock import clock
 from sharedData import shared_data
+from RobotControl.StepperEngine import StepperEngine
+from RobotControl.ActuatorJob import ActuatorJob
 
+logger = logging.getLogger(__name__)
+
+# lift positions in half steps above the limit switch, the top one is about what
+# the old 25 s lift covered at the nominal 0.7 ms per half step
+UP_POSITION = 35000
+DOWN_POSITION = 0
+# forks carry the pallet clear of the floor from here on
+PALLET_CLEARANCE = 10000
+# homing looks for the limit switch slowly and gives up after this many half steps
+HOMING_RATE = 800.0
+HOMING_TRAVEL = int(UP_POSITION * 1.2)
+# a homing that misses the switch is retried this many times in all, with a growing pause,
+# after that the lift is at fault until the operator zeroes it
+HOMING_ATTEMPTS = 3
+HOMING_RETRY_DELAY = 2.0
+FAULT_STATUS = 'Fault'
+
+POSITION_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'forklift_position.json')
+
+
+# Lift position kept on disk between restarts. It is marked untrusted while the lift moves,
+# so a crash or power cut in the middle of a move makes the next start home again.
+class LiftPositionStore:
+
+    def __init__(self, path=POSITION_FILE):
+        self.path = path
+
+    # stored position, None when there is none or it can not be trusted
+    def load(self):
+
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not stored.get('trusted'):
+            return None
+        return int(stored['position'])
+
+    def save(self, position, trusted):
+
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump({'position': int(position), 'trusted': trusted}, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning("Could not store the lift position: %s", e)
+
+
+# Forklift moves run in the background as ActuatorJobs, the caller gets the handle back
+# straight away. Only one move runs at a time, starting a new one cancels the previous.
 class ForkliftController:
     
-    def __init__(self):
+    def __init__(self, position_file=POSITION_FILE):
 
         self.in1 = LED(14)
         self.in2 = LED(15)
@@ -13,67 +72,150 @@ class ForkliftController:
 
         self.down_pin = Button(17)
 
-        self.step_sequence = [
-            [1, 0, 0, 0],
-            [1, 1, 0, 0],
-            [0, 1, 0, 0],
-            [0, 1, 1, 0],
-            [0, 0, 1, 0],
-            [0, 0, 1, 1],
-            [0, 0, 0, 1],
-            [1, 0, 0, 1]
-        ]
-
-        self.step_delay = 0.0007  
-        
-    def set_pins(self, step):
+        self.engine = StepperEngine([self.in1, self.in2, self.in3, self.in4])
+        self.store = LiftPositionStore(position_file) if position_file else None
 
-        self.in1.value = step[0]
-        self.in2.value = step[1]
-        self.in3.value = step[2]
-        self.in4.value = step[3]
+        self.job = None
+        self._job_lock = threading.Lock()
 
-    def move_forklift_up(self, duration=25):
+        # failed homings in a row and when the next automatic one may start
+        self.homing_failures = 0
+        self.retry_at = None
 
-        
-        shared_data.set_forklift_status('Going up')
-        
-        start_time = time.time()
+    def busy(self):
+        return self.job is not None and not self.job.done()
 
-        while (time.time() - start_time) < duration:
-            for step in self.step_sequence:
-                self.set_pins(step)
-                time.sleep(self.step_delay)
+    # unknown position ('-') is homed automatically, unless a retry is still pending
+    def needs_homing(self):
 
-        self.set_pins([0, 0, 0, 0])  
-        
-        shared_data.set_forklift_status('Steady up')
-        
-        shared_data.set_forklift_command_up(False)
+        if shared_data.get_forklift_status() != '-' or self.busy():
+            return False
+        return self.retry_at is None or clock.monotonic() >= self.retry_at
 
+    # takes over the position stored by the last run, False when the lift has to be homed
+    def restore_position(self):
 
-    def move_forklift_down(self, zero: bool):
+        position = self.store.load() if self.store is not None else None
+        if position is None:
+            return False
+
+        self.engine.position = position
+        status = 'Steady down' if position == DOWN_POSITION else 'Steady up'
+        shared_data.update(forklift_status=status, forklift_zero=False)
+        print(f"Forklift position {position} restored, homing skipped")
+        return True
+
+    def _save_position(self, trusted):
+        if self.store is not None:
+            self.store.save(self.engine.position, trusted)
+
+    def _start_job(self, name, status, goal, work):
 
-        shared_data.set_forklift_status('Going down')
+        with self._job_lock:
+            if self.busy():
+                self.job.cancel()
+                self.job.wait()
+
+            start = self.engine.position
+            def progress():
+                return 1.0 if goal == start else (self.engine.position - start) / (goal - start)
+
+            # a move that raised leaves the lift somewhere unknown: at fault until the operator
+            # zeroes it, the command that started it is dropped so it does not start again
+            def run(job):
+                try:
+                    work(job)
+                except Exception:
+                    shared_data.update(forklift_status=FAULT_STATUS, forklift_command_up=False,
+                                       forklift_command_down=False)
+                    raise
+
+            # status is set before returning, so the caller never sees the old one
+            shared_data.set_forklift_status(status)
+            self.job = ActuatorJob(name, progress)
+            return self.job.start(run)
+
+    # lift is commanded by position, the engine ramps up and down on the way
+    def lift_up(self, position=UP_POSITION):
+        return self._start_job('lift up', 'Going up', position, lambda job: self._lift_up(position, job))
+
+    def lift_down(self, zero=False):
+        return self._start_job('lift down', 'Going down', DOWN_POSITION, lambda job: self._lift_down(zero, job))
+
+    # looks for the limit switch, which defines the zero position. An explicit zero ("retry"
+    # False) starts the attempts over and clears a fault.
+    def home(self, retry=False):
+
+        if not retry:
+            self.homing_failures = 0
+            self.retry_at = None
+        shared_data.set_forklift_zero(False)
+        return self.lift_down(True)
+
+    def _lift_up(self, position, job: ActuatorJob):
+
+        self._save_position(False)
+        self.engine.move_to(position, stop=job.cancelled)
+        self.engine.release()
+        self._save_position(True)
+
+        if job.cancelled():
+            shared_data.set_forklift_status('Stopped')
+            return
+        shared_data.update(forklift_status='Steady up', forklift_command_up=False)
+
+
+    def _lift_down(self, zero: bool, job: ActuatorJob):
+
+        stop = lambda: job.cancelled() or self.down_pin.is_pressed
         
         if zero:
             print("Zero in progress")
+        else:
+            # known position - go down at full speed, the switch still has the last word
+            self._save_position(False)
+            self.engine.move_to(DOWN_POSITION, stop=stop)
         
-        while not self.down_pin.is_pressed:
-            for step in reversed(self.step_sequence):
-                self.set_pins(step)
-                time.sleep(self.step_delay)
+        # creep down until the limit switch, which defines the zero position
+        if not stop():
+            self._save_position(False)
+            self.engine.move(-HOMING_TRAVEL, stop=stop, max_rate=HOMING_RATE)
+
+        self.engine.release()
 
-        self.set_pins([0, 0, 0, 0])  
+        if self.down_pin.is_pressed:
+            self.engine.position = DOWN_POSITION
+            self._save_position(True)
+            self.homing_failures = 0
+            self.retry_at = None
+        elif job.cancelled():
+            self._save_position(not zero)
+            shared_data.set_forklift_status('Stopped')
+            return
+        else:
+            # travel exhausted without reaching the switch, the position is unknown
+            self.homing_failures += 1
+            if self.homing_failures >= HOMING_ATTEMPTS:
+                logger.error("Forklift limit switch not reached %d times, zero the lift to retry",
+                             self.homing_failures)
+                shared_data.set_forklift_status(FAULT_STATUS)
+                return
+            print("Forklift limit switch not reached")
+            self.retry_at = clock.monotonic() + HOMING_RETRY_DELAY * 2 ** (self.homing_failures - 1)
+            shared_data.set_forklift_status('-')
+            return
         
-        shared_data.set_forklift_status('Steady down')
-        shared_data.set_forklift_command_down(False)
+        shared_data.update(forklift_status='Steady down', forklift_command_down=False)
         
         if zero:
             print("Zero done")
+
+    # blocking versions of the moves
+    def move_forklift_up(self, position=UP_POSITION):
+        self.lift_up(position).wait()
+
+    def move_forklift_down(self, zero: bool):
+        self.lift_down(zero).wait()
             
     def forklift_zero(self):
-        
-        self.move_forklift_down(True)
-        shared_data.set_forklift_zero(False)
-        
\ No newline at end of file
+        self.home().wait()
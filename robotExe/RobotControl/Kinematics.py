@@ -0,0 +1,61 @@
+import numpy as np
+
+MIN_RPM = 20
+MAX_RPM = 150
+WHEEL_RADIUS = 0.04
+LXLY = 0.1748
+
+# wheel rim speed [m/s] -> wheel RPM
+RPM_PER_SPEED = 60 / (2 * np.pi * WHEEL_RADIUS)
+
+# Mecanum wheel layout of the robot, wheels ordered fl, fr, rl, rr.
+# Twist is (vx, vy, omega): vx to the left [m/s], vy forward [m/s], omega counter clockwise [rad/s]
+#   fl = vy - vx - omega*LXLY, fr = vy + vx + omega*LXLY,
+#   rl = vy + vx - omega*LXLY, rr = vy - vx + omega*LXLY
+INVERSE_JACOBIAN = RPM_PER_SPEED * np.array([
+    [-1.0, 1.0, -LXLY],
+    [ 1.0, 1.0,  LXLY],
+    [ 1.0, 1.0, -LXLY],
+    [-1.0, 1.0,  LXLY],
+])
+FORWARD_JACOBIAN = np.linalg.pinv(INVERSE_JACOBIAN)
+
+# a wheel slower than this fraction of the fastest one counts as standing still
+ZERO_FRACTION = 1e-6
+
+
+# wheel RPMs of a body twist, (3,) -> (4,) or a whole trajectory (N, 3) -> (N, 4)
+def wheel_rpms(twist):
+    return np.asarray(twist, dtype=float) @ INVERSE_JACOBIAN.T
+
+
+# body twist of the wheel RPMs, (4,) -> (3,) or (N, 4) -> (N, 3)
+def body_twist(rpms):
+    return np.asarray(rpms, dtype=float) @ FORWARD_JACOBIAN.T
+
+
+# scales every row down so no wheel is faster than "max_rpm", keeping the direction of motion
+def saturate(rpms, max_rpm=MAX_RPM):
+
+    rpms = np.asarray(rpms, dtype=float)
+    peak = np.abs(rpms).max(axis=-1, keepdims=True)
+    return rpms * (max_rpm / np.maximum(peak, max_rpm))
+
+
+# Scales every row so its slowest moving wheel turns at "min_rpm" (the slowest speed the
+# motors hold reliably) without letting any wheel go over "max_rpm". Wheels standing still
+# stay at zero and do not blow the scale up, so pure strafes and rotations are handled too.
+def scale_to_min_rpm(rpms, min_rpm=MIN_RPM, max_rpm=MAX_RPM):
+
+    rpms = np.asarray(rpms, dtype=float)
+    magnitude = np.abs(rpms)
+    peak = magnitude.max(axis=-1, keepdims=True)
+
+    moving = magnitude > peak * ZERO_FRACTION
+    slowest = np.where(moving, magnitude, np.inf).min(axis=-1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.minimum(min_rpm / slowest, max_rpm / peak)
+    scale = np.where(peak > 0, scale, 0.0)
+
+    return rpms * scale
@@ -0,0 +1,377 @@
+from dataclasses import dataclass
+from clock import clock
+from sharedData import shared_data
+from telemetryLog import telemetry_log
+from RobotControl.Target import Target
+from RobotControl.DirectDriveController import DirectDriveController
+from RobotControl.ForkLiftController import ForkliftController, PALLET_CLEARANCE
+from RobotControl.MotionScheduler import MotionScheduler, DONE
+from RobotControl.ControlLoop import FixedRateLoop
+from RobotControl.RobotUtils import (stopRobot, rotate, kinematics, startAlignAngle, startAlignBackward, StrafeVelocity,
+                                     X_THRESHOLD, Y_THRESHOLD, DESIRED_X, MIN_STRAFE_Y, BACKWARD_TIME)
+
+# states
+IDLE = 'idle'
+SEARCH = 'search'
+ALIGN_ANGLE = 'align angle'
+ALIGN_X = 'align x'
+DIRECT_DRIVE = 'direct drive'
+LIFT = 'lift'
+BACK_OFF = 'back off'
+DROP = 'drop'
+
+# events
+POSE = 'pose'           # new pose data was published
+TIMER = 'timer'         # the timer armed by the current state has expired
+COMMAND = 'command'     # operator or forklift state changed
+
+# the mission drives to the pick up marker first, then to the drop off one
+PICK_LEG = 'pick'
+DROP_LEG = 'drop'
+LEG_MARKERS = {PICK_LEG: 0, DROP_LEG: 1}
+
+# pause after the drop off marker is found, before the robot aligns with it
+SETTLE_TIME = 1.0
+# how often running wheel / forklift moves are checked
+POLL_INTERVAL = 0.05
+
+
+@dataclass
+class StateRecord:
+    state: str
+    leg: str
+    entered: float
+    exited: float = None
+
+    @property
+    def duration(self):
+        return None if self.exited is None else self.exited - self.entered
+
+
+# Pick and drop mission as a table driven state machine. Every state has the picking status
+# it publishes, an entry action and the handlers of the events it reacts to, a handler returns
+# the next state (or None to stay). The owner thread sleeps until an event arrives and feeds it
+# to "dispatch", nothing blocks in here. Entry and exit time of every state is recorded.
+class MissionStateMachine:
+
+    def __init__(self, target: Target, scheduler: MotionScheduler, directController: DirectDriveController,
+                 forklift: ForkliftController, control_loop: FixedRateLoop):
+
+        self.target = target
+        self.scheduler = scheduler
+        self.commandHandler = scheduler.commandHandler
+        self.directController = directController
+        self.forklift = forklift
+        self.control_loop = control_loop
+
+        self.state = IDLE
+        self.leg = None
+        self.marker = None
+        self.timer = None
+        self.history = []
+        self.started_at = None
+        # why the last mission was aborted, None when it completed
+        self.abort_reason = None
+
+        self.command = None     # wheel move of the current state
+        self.lift = None        # forklift move lifting the pallet
+        self.lowering = None    # forklift move putting it down
+        self.settling = False
+        self.approach = None    # (distance, heading) of the marker when the alignment started
+        self.strafe = None
+        self.last_compute = None
+
+        self._states = {
+            SEARCH: ("searching", self._enter_search,
+                     {POSE: self._search_pose, TIMER: self._search_timer}),
+            ALIGN_ANGLE: ("angle aligning", self._enter_align_angle,
+                          {TIMER: self._align_angle_timer}),
+            ALIGN_X: ("X axe aligning", self._enter_align_x,
+                      {POSE: self._update_target, TIMER: self._align_x_tick}),
+            DIRECT_DRIVE: ("Direct driving", self._enter_direct_drive,
+                           {POSE: self._update_target, TIMER: self._direct_drive_tick}),
+            LIFT: ("picking up", self._enter_lift,
+                   {TIMER: self._lift_timer}),
+            BACK_OFF: ("backing off", self._enter_back_off,
+                       {TIMER: self._back_off_timer}),
+            DROP: ("putting down", self._enter_drop,
+                   {COMMAND: self._drop_progress, TIMER: self._drop_progress}),
+        }
+
+    def active(self):
+        return self.state != IDLE
+
+    def start(self):
+
+        self.history = []
+        self.started_at = clock.monotonic()
+        self.abort_reason = None
+        self._set_leg(PICK_LEG)
+        self._transition(SEARCH)
+
+    # stops the wheels and ends the mission, a running forklift move is left to finish
+    def abort(self, reason):
+
+        if not self.active():
+            return
+        print(f"Mission aborted in state '{self.state}': {reason}")
+        self.abort_reason = reason
+        self.scheduler.cancel_all()
+        stopRobot(self.commandHandler)
+        self._finish()
+
+    def dispatch(self, event):
+
+        if not self.active():
+            return
+
+        handler = self._states[self.state][2].get(event)
+        if handler is None:
+            return
+        if event == TIMER:
+            self.timer = None
+
+        next_state = handler()
+        if next_state is not None:
+            self._transition(next_state)
+
+    # seconds until the armed timer expires, None without one
+    def time_to_timer(self, now=None):
+
+        if self.timer is None:
+            return None
+        return self.timer - (clock.monotonic() if now is None else now)
+
+    # total time spent in every state of the last mission, by leg
+    def durations(self):
+
+        totals = {}
+        for record in self.history:
+            if record.duration is not None:
+                key = f"{record.leg} {record.state}"
+                totals[key] = totals.get(key, 0.0) + record.duration
+        return totals
+
+    def _set_leg(self, leg):
+        self.leg = leg
+        self.marker = LEG_MARKERS[leg]
+
+    def _transition(self, state):
+
+        now = clock.monotonic()
+        previous_duration = None
+        if self.history and self.history[-1].exited is None:
+            self.history[-1].exited = now
+            previous_duration = self.history[-1].duration
+        telemetry_log.mission(state, self.leg, previous_duration)
+
+        self.state = state
+        self.timer = None
+        if state == IDLE:
+            return
+
+        self.history.append(StateRecord(state, self.leg, now))
+        status, enter, _ = self._states[state]
+        shared_data.set_picking_status(status)
+
+        next_state = enter()
+        if next_state is not None:
+            self._transition(next_state)
+
+    def _finish(self):
+
+        self._transition(IDLE)
+        shared_data.update(start_picking_process=False, picking_status='-')
+
+        total = clock.monotonic() - self.started_at
+        breakdown = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in self.durations().items())
+        print(f"Mission took {total:.2f} s: {breakdown}")
+
+    def _poll(self):
+        self.timer = clock.monotonic() + POLL_INTERVAL
+
+    def _update_target(self):
+        self.target.getPoseData(shared_data.pose_table, self.marker)
+
+    # search - the pick up marker is waited for, for the drop off one the robot turns around
+
+    def _enter_search(self):
+
+        self.settling = False
+        if self.leg == DROP_LEG:
+            rotate(self.commandHandler)
+        # the marker may be in view already
+        return self._search_pose()
+
+    def _search_pose(self):
+
+        if self.settling or not self.target.getPoseData(shared_data.pose_table, self.marker):
+            return None
+
+        if self.leg == PICK_LEG:
+            return ALIGN_ANGLE
+
+        stopRobot(self.commandHandler)
+        self.settling = True
+        self.timer = clock.monotonic() + SETTLE_TIME
+        return None
+
+    def _search_timer(self):
+        return ALIGN_ANGLE if self.settling else None
+
+    # align angle - timed rotation square to the marker
+
+    def _enter_align_angle(self):
+
+        if not self.target.getPoseData(shared_data.pose_table, self.marker):
+            return SEARCH
+
+        # distance and heading the X alignment works with
+        self.approach = (self.target.y, self.target.angle_rad)
+        self.command = startAlignAngle(self.target.angle, self.scheduler)
+        self.timer = clock.monotonic() + self.command.duration
+        return None
+
+    def _align_angle_timer(self):
+
+        if not self.command.done():
+            self._poll()
+            return None
+        if self.command.state != DONE:
+            return SEARCH
+
+        print(f"Rotating for {self.command.duration} completed, {self.command.lateness * 1000:.2f} ms late")
+        return ALIGN_X
+
+    # align X - strafe until the marker is in front, backing off first when too close
+
+    def _enter_align_x(self):
+
+        v, angle_rad = self.approach
+        v_x, v_y = StrafeVelocity(v, angle_rad)
+        self.strafe = kinematics(v_x, 0, 0)
+
+        self.command = None
+        if v_y < MIN_STRAFE_Y:
+            self.command = startAlignBackward(self.scheduler)
+        else:
+            self.scheduler.send_now(self.strafe)
+
+        self.control_loop.start()
+        self.timer = self.control_loop.next_deadline()
+        return None
+
+    def _align_x_tick(self):
+
+        self.control_loop.begin_iteration()
+        next_state = None
+
+        if self.command is not None:
+            if self.command.done():
+                self.command = None
+                self.scheduler.send_now(self.strafe)
+        # the strafe is stopped on the predicted pose, not only when a frame arrives
+        elif self.target.predict(self.marker):
+            if -X_THRESHOLD < self.target.x < X_THRESHOLD:
+                next_state = DIRECT_DRIVE
+
+        self.control_loop.end_iteration()
+        self.timer = self.control_loop.next_deadline()
+        return next_state
+
+    # direct drive - closed loop approach, every tick acts on the pose predicted for its time
+
+    def _enter_direct_drive(self):
+
+        self.directController.resetWheelsSpeed()
+        self.control_loop.reset_stats()
+        self.control_loop.start()
+        self.last_compute = None
+        self.timer = self.control_loop.next_deadline()
+        return None
+
+    def _direct_drive_tick(self):
+
+        self.control_loop.begin_iteration()
+        now = clock.monotonic()
+        next_state = None
+
+        if self.target.predict(self.marker, now):
+            if self.target.y < Y_THRESHOLD:
+                stopRobot(self.commandHandler)
+                print(f"Direct drive loop: {self.control_loop.stats()}")
+                next_state = LIFT if self.leg == PICK_LEG else DROP
+            else:
+                self.directController.directDrive(self.commandHandler, self.target, DESIRED_X,
+                                                  None if self.last_compute is None else now - self.last_compute)
+                self.last_compute = now
+
+        self.control_loop.end_iteration()
+        self.timer = self.control_loop.next_deadline()
+        return next_state
+
+    # lift - the robot backs off as soon as the pallet is off the floor, the lift keeps going
+
+    def _enter_lift(self):
+
+        self.lift = self.forklift.lift_up()
+        self._poll()
+        return None
+
+    def _lift_timer(self):
+
+        if self.lift.done() and self.lift.state != DONE:
+            self.abort(f"lift {self.lift.state}")
+            return None
+        if self.lift.done() or self.forklift.engine.position >= PALLET_CLEARANCE:
+            return BACK_OFF
+
+        self._poll()
+        return None
+
+    # back off - away from the pick up pallet, then on to the drop off marker
+
+    def _enter_back_off(self):
+
+        self.command = startAlignBackward(self.scheduler)
+        self.timer = clock.monotonic() + BACKWARD_TIME
+        return None
+
+    def _back_off_timer(self):
+
+        if not self.command.done():
+            self._poll()
+            return None
+
+        self._set_leg(DROP_LEG)
+        return SEARCH
+
+    # drop - waits for the lift to reach the top, then lowers the pallet
+
+    def _enter_drop(self):
+
+        self.lowering = None
+        return self._drop_progress()
+
+    def _drop_progress(self):
+
+        if self.lowering is None:
+            if not self.lift.done():
+                self._poll()
+                return None
+            # the lift may have failed after the robot backed off with the pallet
+            if self.lift.state != DONE:
+                self.abort(f"lift {self.lift.state}")
+                return None
+            self.lowering = self.forklift.lift_down()
+
+        if not self.lowering.done():
+            self._poll()
+            return None
+
+        if self.lowering.state != DONE:
+            self.abort(f"lowering {self.lowering.state}")
+            return None
+
+        self._finish()
+        return None
@@ -0,0 +1,178 @@
+import threading
+from collections import deque
+from clock import clock
+from RobotControl.CommandHandler import CommandHandler
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+# Timed wheel command - four RPMs held until a monotonic deadline, then the robot stops
+# (or the next queued command takes over). Works as a handle for the caller:
+# it can block on it, poll it or cancel it.
+class MotionCommand:
+
+    def __init__(self, rpms, duration=None, deadline=None):
+
+        self.rpms = tuple(rpms)
+        self.duration = duration
+        self.deadline = deadline
+
+        self.state = PENDING
+        self.started_at = None
+        self.fired_at = None
+        self.lateness = None
+
+        self._finished = threading.Event()
+        self._scheduler = None
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def cancel(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel(self)
+
+    def _finish(self, state):
+        self.state = state
+        self._finished.set()
+
+
+# Thread that executes timed wheel commands one after another. Instead of spinning
+# on time.time() it sleeps on a condition until the deadline of the running command,
+# so the core stays free for the vision thread. Lateness of each deadline is recorded.
+class MotionScheduler(threading.Thread):
+
+    def __init__(self, commandHandler: CommandHandler):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.commandHandler = commandHandler
+        self.running = False
+
+        self._queue = deque()
+        self._current = None
+        self._cond = threading.Condition()
+
+        self.fired_count = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    # hold "rpms" for "duration" seconds, counted from the moment the command starts
+    def run_for(self, rpms, duration):
+        return self.submit(MotionCommand(rpms, duration=duration))
+
+    # hold "rpms" until absolute clock.monotonic() deadline
+    def run_until(self, rpms, deadline):
+        return self.submit(MotionCommand(rpms, deadline=deadline))
+
+    def submit(self, command: MotionCommand):
+
+        command._scheduler = self
+        with self._cond:
+            self._queue.append(command)
+            self._cond.notify_all()
+        return command
+
+    # cancels everything that is queued or running and sends "rpms" right away,
+    # they are held until the next command
+    def send_now(self, rpms):
+
+        with self._cond:
+            self._cancel_all_locked()
+            self.commandHandler.sendSpeedCommand(*rpms)
+
+    def cancel(self, command: MotionCommand):
+
+        with self._cond:
+            if command in self._queue:
+                self._queue.remove(command)
+                command._finish(CANCELLED)
+            elif command is self._current:
+                self._current = None
+                command._finish(CANCELLED)
+                self.commandHandler.sendSpeedCommand(0, 0, 0, 0)
+            self._cond.notify_all()
+
+    def cancel_all(self):
+
+        with self._cond:
+            had_current = self._current is not None
+            self._cancel_all_locked()
+            if had_current:
+                self.commandHandler.sendSpeedCommand(0, 0, 0, 0)
+
+    def _cancel_all_locked(self):
+
+        while self._queue:
+            self._queue.popleft()._finish(CANCELLED)
+        if self._current is not None:
+            self._current._finish(CANCELLED)
+            self._current = None
+        self._cond.notify_all()
+
+    def mean_lateness(self):
+
+        if self.fired_count == 0:
+            return 0.0
+        return self.total_lateness / self.fired_count
+
+    def _start(self, command: MotionCommand):
+
+        command.started_at = clock.monotonic()
+        if command.deadline is None:
+            command.deadline = command.started_at + command.duration
+        command.state = RUNNING
+        self._current = command
+        self.commandHandler.sendSpeedCommand(*command.rpms)
+
+    def _fire(self, command: MotionCommand, now):
+
+        command.fired_at = now
+        command.lateness = now - command.deadline
+
+        self.fired_count += 1
+        self.total_lateness += command.lateness
+        self.max_lateness = max(self.max_lateness, command.lateness)
+
+        self._current = None
+
+        # next command takes over straight away, otherwise the robot stops
+        if self._queue:
+            self._start(self._queue.popleft())
+        else:
+            self.commandHandler.sendSpeedCommand(0, 0, 0, 0)
+
+        command._finish(DONE)
+
+    def run(self):
+
+        self.running = True
+
+        with self._cond:
+            while self.running:
+
+                if self._current is None:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    self._start(self._queue.popleft())
+
+                remaining = self._current.deadline - clock.monotonic()
+                if remaining > 0:
+                    # woken earlier by cancel / stop, otherwise right at the deadline
+                    self._cond.wait(clock.real_timeout(remaining))
+                    continue
+
+                self._fire(self._current, clock.monotonic())
+
+    def stop(self):
+
+        with self._cond:
+            self.running = False
+            self._cancel_all_locked()
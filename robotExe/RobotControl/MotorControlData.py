@@ -1,42 +1,182 @@
 from dataclasses import dataclass
+import logging
 import threading
 import time
-import CommandHandler
+import numpy as np
+from clock import clock
+from telemetryLog import telemetry_log
+from RobotControl.CommandHandler import CommandHandler, MOTOR_COUNT
+
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 1024
+
+SAMPLE_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('current_rpm', np.float32),
+    ('target_rpm', np.float32),
+    ('error_pid', np.float32),
+    ('pwm_value', np.float32),
+])
+
+# firmware telemetry keys mapped to MotorData fields
+TELEMETRY_KEYS = {
+    'RPM': 'current_rpm',
+    'TARGET': 'target_rpm',
+    'ERR': 'error_pid',
+    'PWM': 'pwm_value',
+    'Kp': 'kp',
+    'Ki': 'ki',
+    'Kd': 'kd',
+}
 
 @dataclass
 class MotorData:
-    
-    current_rpm = 0
-    target_rpm = 0
-    error_pid = 0
-    pwm_value = 0
-    
-    kp = 0
-    kd = 0
-    ki = 0
-    
-    
-def parse_data(line):
-    pass
-    
+
+    motor: int = 0
+    timestamp: float = 0.0
+
+    current_rpm: float = 0.0
+    target_rpm: float = 0.0
+    error_pid: float = 0.0
+    pwm_value: float = 0.0
+
+    kp: float = 0.0
+    kd: float = 0.0
+    ki: float = 0.0
+
+
+# parses a single firmware telemetry line, e.g.
+# "MOTOR_0:RPM:20.5;TARGET:21;ERR:0.5;PWM:130;"
+# returns MotorData or None if the line is not motor telemetry
+def parse_data(line, timestamp=None):
+
+    if not line.startswith('MOTOR_'):
+        return None
+
+    try:
+        header, _, rest = line.partition(':')
+        data = MotorData(motor=int(header[len('MOTOR_'):]),
+                         timestamp=clock.monotonic() if timestamp is None else timestamp)
+
+        for field in rest.split(';'):
+            key, _, value = field.partition(':')
+            attr = TELEMETRY_KEYS.get(key.strip())
+            if attr is not None and value:
+                setattr(data, attr, float(value))
+
+    except ValueError:
+        logger.debug("Malformed telemetry line: %s", line)
+        return None
+
+    if not 0 <= data.motor < MOTOR_COUNT:
+        return None
+    return data
+
+
+# Per motor fixed size ring buffers of telemetry samples.
+# Controllers and the backend read the latest sample or a time window without touching the port.
+class MotorTelemetry:
+
+    def __init__(self, motors=MOTOR_COUNT, size=BUFFER_SIZE):
+
+        self.size = size
+        self._samples = np.zeros((motors, size), dtype=SAMPLE_DTYPE)
+        self._count = [0] * motors
+        self._lock = threading.Lock()
+
+    def append(self, data: MotorData):
+
+        with self._lock:
+            index = self._count[data.motor] % self.size
+            self._samples[data.motor, index] = (data.timestamp, data.current_rpm, data.target_rpm,
+                                                data.error_pid, data.pwm_value)
+            self._count[data.motor] += 1
+
+    def sample_count(self, motor):
+        return self._count[motor]
+
+    def latest(self, motor):
+
+        with self._lock:
+            count = self._count[motor]
+            if count == 0:
+                return None
+            sample = self._samples[motor, (count - 1) % self.size].copy()
+
+        return MotorData(motor=motor, timestamp=float(sample['timestamp']),
+                         current_rpm=float(sample['current_rpm']), target_rpm=float(sample['target_rpm']),
+                         error_pid=float(sample['error_pid']), pwm_value=float(sample['pwm_value']))
+
+    # samples of the last "seconds", oldest first, as a structured numpy array
+    def window(self, motor, seconds, now=None):
+
+        now = clock.monotonic() if now is None else now
+        with self._lock:
+            count = self._count[motor]
+            if count <= self.size:
+                ordered = self._samples[motor, :count].copy()
+            else:
+                start = count % self.size
+                ordered = np.concatenate((self._samples[motor, start:], self._samples[motor, :start]))
+
+        return ordered[ordered['timestamp'] >= now - seconds]
+
+    # current RPM of all motors from the newest samples, NaN where no data arrived yet
+    # (or the newest sample is older than "max_age" seconds)
+    def latest_rpms(self, max_age=None, now=None):
+
+        rpms = np.full(len(self._count), np.nan)
+        if max_age is not None and now is None:
+            now = clock.monotonic()
+        with self._lock:
+            for motor, count in enumerate(self._count):
+                if count:
+                    sample = self._samples[motor, (count - 1) % self.size]
+                    if max_age is None or now - sample['timestamp'] <= max_age:
+                        rpms[motor] = sample['current_rpm']
+        return rpms
+
+
 class MotorControlData (threading.Thread):
-    
-    def __init__(self,commandHandler: CommandHandler):
+
+    def __init__(self, commandHandler: CommandHandler, telemetry: MotorTelemetry = None):
         self.commandHandler = commandHandler
+        self.telemetry = telemetry if telemetry is not None else motor_telemetry
         self.running = False
-        self.update_interval = 0.2
-        threading.Thread.__init__(self)
-        
+        self.parsed_lines = 0
+        self.skipped_lines = 0
+        threading.Thread.__init__(self, daemon=True)
+
     def run(self):
-        
+
         self.running = True
-        
-        
-        while self.running:              
-            
-
-            
-            data = self.commandHandler.readUART() 
-            print(data)
-            
-            time.sleep(0.1)
+
+        while self.running:
+
+            try:
+                line = self.commandHandler.readUART()
+            except Exception as e:
+                logger.error("Serial read error: %s", e)
+                time.sleep(0.1)
+                continue
+
+            if not line:
+                continue
+
+            data = parse_data(line)
+            if data is None:
+                self.skipped_lines += 1
+                continue
+
+            self.telemetry.append(data)
+            telemetry_log.motor(data)
+            self.parsed_lines += 1
+
+    def stop(self):
+        self.running = False
+
+
+# Create a singleton instance
+motor_telemetry = MotorTelemetry()
@@ -0,0 +1,183 @@
+import math
+import threading
+import numpy as np
+from clock import clock
+from RobotControl.ControlLoop import FixedRateLoop
+from RobotControl.Kinematics import body_twist
+from RobotControl.MotorControlData import MotorTelemetry, motor_telemetry
+
+ODOMETRY_RATE = 200.0
+# wheels without telemetry for this long are taken as standing still
+TELEMETRY_TIMEOUT = 0.2
+# seconds of odometry kept to place camera fixes at their capture time
+HISTORY_SECONDS = 2.0
+# weight of a new camera fix against the marker position odometry carried so far
+FIX_GAIN = 0.5
+# odometry alone is trusted this long after the last fix of a marker
+MAX_DEAD_RECKONING = 3.0
+# drift of the estimate per metre driven since the last fix, cm and deg
+DRIFT_PER_METRE = (5.0, 5.0, 3.0)
+# a pose after the newest integration step is extrapolated with the velocity over this
+# window, at most MAX_EXTRAPOLATION seconds ahead
+VELOCITY_WINDOW = 0.05
+MAX_EXTRAPOLATION = 0.2
+
+
+def wrap_angle(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+# marker position in the robot frame, in the units Target uses:
+# x [cm] to the right, y [cm] forward, angle [deg] the robot has to turn (counter clockwise)
+def relative_to_robot(robot_pose, marker_pose):
+
+    x, y, heading = robot_pose
+    marker_x, marker_y, approach = marker_pose
+
+    dx, dy = marker_x - x, marker_y - y
+    forward = dx * math.cos(heading) + dy * math.sin(heading)
+    left = -dx * math.sin(heading) + dy * math.cos(heading)
+
+    return -left * 100, forward * 100, math.degrees(wrap_angle(approach - heading))
+
+
+# inverse of "relative_to_robot", marker pose in the odometry frame
+def marker_from_relative(robot_pose, x_cm, y_cm, angle_deg):
+
+    x, y, heading = robot_pose
+    forward, left = y_cm / 100, -x_cm / 100
+
+    return (x + forward * math.cos(heading) - left * math.sin(heading),
+            y + forward * math.sin(heading) + left * math.cos(heading),
+            heading + math.radians(angle_deg))
+
+
+# Dead reckoning from the motor RPM telemetry through the forward mecanum kinematics,
+# fused with the camera fixes of the pallet markers. The robot pose is integrated in its own
+# odometry frame (metres, radians, heading not wrapped), every marker fix is placed in that
+# frame at the capture time of its frame and blended into the marker position. Between fixes,
+# or when the marker is out of view, the robot-to-marker pose follows the wheels.
+class Odometry(threading.Thread):
+
+    def __init__(self, telemetry: MotorTelemetry = None, rate_hz=ODOMETRY_RATE, history_seconds=HISTORY_SECONDS):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.telemetry = telemetry if telemetry is not None else motor_telemetry
+        self.loop = FixedRateLoop(rate_hz, name='odometry')
+        self.running = False
+
+        self.pose = (0.0, 0.0, 0.0)
+        self.distance = 0.0
+        # all wheels reported recently, without that the estimate stands still
+        self.wheels_live = False
+        self._last_time = None
+
+        # rows of (time, x, y, heading, distance)
+        self._history = np.zeros((int(history_seconds * rate_hz) + 1, 5))
+        self._history_count = 0
+
+        # marker id -> (marker pose, time of the last fix, odometry distance at that fix)
+        self.markers = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+
+        self.running = True
+        self.loop.start()
+
+        while self.running:
+            self.loop.wait_next()
+            self.step(clock.monotonic())
+
+    def stop(self):
+        self.running = False
+
+    # integrates the wheel speeds up to "now"
+    def step(self, now):
+
+        rpms = self.telemetry.latest_rpms(TELEMETRY_TIMEOUT, now)
+        self.wheels_live = not np.isnan(rpms).any()
+        vx, vy, omega = body_twist(np.nan_to_num(rpms)).tolist()
+
+        with self._lock:
+            dt = 0.0 if self._last_time is None else now - self._last_time
+            self._last_time = now
+
+            x, y, heading = self.pose
+            # integrate at the middle of the step heading
+            mid = heading + omega * dt / 2
+            x += (vy * math.cos(mid) - vx * math.sin(mid)) * dt
+            y += (vy * math.sin(mid) + vx * math.cos(mid)) * dt
+            heading += omega * dt
+            self.pose = (x, y, heading)
+            self.distance += math.hypot(vx, vy) * dt
+
+            self._history[self._history_count % len(self._history)] = (now, x, y, heading, self.distance)
+            self._history_count += 1
+
+    # odometry pose and distance at time "t", interpolated from the history, the oldest entry
+    # before it, extrapolated with the recent velocity after the newest one
+    def pose_at(self, t):
+
+        with self._lock:
+            count = self._history_count
+            size = len(self._history)
+            if count == 0:
+                return self.pose, self.distance
+            if count <= size:
+                history = self._history[:count].copy()
+            else:
+                start = count % size
+                history = np.concatenate((self._history[start:], self._history[:start]))
+
+        newest = history[-1]
+        if t > newest[0]:
+            before = history[np.searchsorted(history[:, 0], newest[0] - VELOCITY_WINDOW)]
+            span = newest[0] - before[0]
+            if span <= 0:
+                return tuple(newest[1:4].tolist()), float(newest[4])
+            ahead = min(t - newest[0], MAX_EXTRAPOLATION)
+            row = newest[1:] + (newest[1:] - before[1:]) * (ahead / span)
+            return tuple(row[:3].tolist()), float(row[3])
+
+        row = np.array([np.interp(t, history[:, 0], history[:, i]) for i in range(1, 5)])
+        return tuple(row[:3].tolist()), float(row[3])
+
+    # camera fix of marker "marker_id" captured at "timestamp", in Target units
+    def add_fix(self, marker_id, timestamp, x_cm, y_cm, angle_deg):
+
+        robot_pose, distance = self.pose_at(timestamp)
+        measured = marker_from_relative(robot_pose, x_cm, y_cm, angle_deg)
+
+        with self._lock:
+            known = self.markers.get(marker_id)
+            if known is not None and timestamp - known[1] <= MAX_DEAD_RECKONING:
+                (marker_x, marker_y, approach), _, _ = known
+                measured = (marker_x + FIX_GAIN * (measured[0] - marker_x),
+                            marker_y + FIX_GAIN * (measured[1] - marker_y),
+                            approach + FIX_GAIN * wrap_angle(measured[2] - approach))
+            self.markers[marker_id] = (measured, timestamp, distance)
+
+    def forget(self, marker_id):
+        with self._lock:
+            self.markers.pop(marker_id, None)
+
+    # (x, y, angle, age, uncertainty) of marker "marker_id" relative to the robot pose at time
+    # "t" (see "pose_at"), None when the marker has not been seen within MAX_DEAD_RECKONING
+    def relative_pose(self, marker_id, t=None):
+
+        t = clock.monotonic() if t is None else t
+        with self._lock:
+            known = self.markers.get(marker_id)
+        if known is None:
+            return None
+        robot_pose, distance = self.pose_at(t)
+
+        marker_pose, fixed_at, fix_distance = known
+        age = t - fixed_at
+        if age > MAX_DEAD_RECKONING:
+            return None
+
+        x, y, angle = relative_to_robot(robot_pose, marker_pose)
+        uncertainty = np.array(DRIFT_PER_METRE) * max(0.0, distance - fix_distance)
+        return x, y, angle, age, uncertainty
@@ -0,0 +1,91 @@
+import numpy as np
+
+# x [cm], y [cm], angle [deg] of a marker relative to the robot
+AXES = 3
+
+# process noise (white acceleration spectral density) per axis, cm^2/s^3 and deg^2/s^3
+ACCEL_NOISE = np.array([400.0, 400.0, 100.0])
+# measurement noise std per axis, cm and deg
+MEASUREMENT_STD = np.array([0.5, 1.0, 1.0])
+# a marker not seen for this long starts from scratch on its next detection
+MAX_GAP = 1.0
+
+
+# Constant velocity Kalman filter of one marker pose. The three axes are independent,
+# so the filter is kept as three 2x2 problems (position, velocity) solved side by side.
+class PoseFilter:
+
+    def __init__(self, accel_noise=ACCEL_NOISE, measurement_std=MEASUREMENT_STD, max_gap=MAX_GAP):
+
+        self.q = np.asarray(accel_noise, dtype=float)
+        self.r = np.asarray(measurement_std, dtype=float) ** 2
+        self.max_gap = max_gap
+        self.reset()
+
+    def reset(self):
+
+        self.state = np.zeros((AXES, 2))          # [axis, (position, velocity)]
+        self.cov = np.zeros((AXES, 2, 2))
+        self.timestamp = None
+        self.sequence = None
+
+    def initialized(self):
+        return self.timestamp is not None
+
+    # state and covariance propagated "dt" seconds forward
+    def _propagate(self, dt):
+
+        state = self.state.copy()
+        state[:, 0] += state[:, 1] * dt
+
+        p00, p01, p11 = self.cov[:, 0, 0], self.cov[:, 0, 1], self.cov[:, 1, 1]
+        cov = np.empty_like(self.cov)
+        cov[:, 0, 0] = p00 + 2 * dt * p01 + dt * dt * p11 + self.q * dt ** 3 / 3
+        cov[:, 0, 1] = cov[:, 1, 0] = p01 + dt * p11 + self.q * dt ** 2 / 2
+        cov[:, 1, 1] = p11 + self.q * dt
+        return state, cov
+
+    # fuses a measurement taken at "timestamp", out of order measurements are ignored
+    def update(self, timestamp, measurement, sequence=None):
+
+        measurement = np.asarray(measurement, dtype=float)
+
+        if self.timestamp is None or timestamp - self.timestamp > self.max_gap:
+            self.state[:, 0] = measurement
+            self.state[:, 1] = 0.0
+            self.cov[:] = 0.0
+            self.cov[:, 0, 0] = self.r
+            # unknown velocity, roughly what the robot can do in a second
+            self.cov[:, 1, 1] = self.q
+            self.timestamp = timestamp
+            self.sequence = sequence
+            return
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:
+            return
+
+        state, cov = self._propagate(dt)
+
+        innovation = measurement - state[:, 0]
+        s = cov[:, 0, 0] + self.r
+        k0 = cov[:, 0, 0] / s
+        k1 = cov[:, 1, 0] / s
+
+        state[:, 0] += k0 * innovation
+        state[:, 1] += k1 * innovation
+
+        p00, p01, p11 = cov[:, 0, 0].copy(), cov[:, 0, 1].copy(), cov[:, 1, 1].copy()
+        cov[:, 0, 0] = (1 - k0) * p00
+        cov[:, 0, 1] = cov[:, 1, 0] = (1 - k0) * p01
+        cov[:, 1, 1] = p11 - k1 * p01
+
+        self.state, self.cov = state, cov
+        self.timestamp = timestamp
+        self.sequence = sequence
+
+    # predicted (x, y, angle) and their standard deviations at time "t", the filter is not modified
+    def predict(self, t):
+
+        state, cov = self._propagate(max(0.0, t - self.timestamp))
+        return state[:, 0], np.sqrt(cov[:, 0, 0])
@@ -1,15 +1,13 @@
 
 import numpy as np
 from RobotControl.CommandHandler import CommandHandler
-import time
+from RobotControl.MotionScheduler import MotionScheduler, DONE
+from RobotControl.Kinematics import MIN_RPM, WHEEL_RADIUS, LXLY, wheel_rpms, scale_to_min_rpm
 import math
 
 
 
-MIN_RPM = 20
-WHEEL_RADIUS = 0.04
 PI = np.pi
-LXLY = 0.1748
 WHEEL_V_MIN = (MIN_RPM * 2 * PI * WHEEL_RADIUS)/60
 DESIRED_ANGLE = 0
 ANGLE_THRESHOLD = 2
@@ -18,6 +16,9 @@ X_THRESHOLD = 2
 DESIRED_Y = 35
 DESIRED_X = 0
 TIMEOUT = 5.0
+BACKWARD_TIME = 5.0
+# closer than this [cm] the robot backs off before strafing, to have room for the direct drive
+MIN_STRAFE_Y = 30
 
 
 
@@ -39,29 +40,43 @@ def CalculateRotationTime(angle):
         return (angle_rad / omega_z) + 1.5, omega_z
     
     
-# rotates the robot for a certain time, calculated in "CalculateRotatationTime", 
-# to align the robot with tag angle
-def AlignAngle(angle, commandHandler: CommandHandler):
+# non blocking versions of the alignment moves, they return the MotionCommand handle
+# and the motion scheduler stops the wheels at its deadline
+def startAlignAngle(angle, scheduler: MotionScheduler):
     
     rotationTime, omegaZ = CalculateRotationTime(angle)
     
     if angle < 0:
         omegaZ = -omegaZ
     
-    fl, fr, rl, rr = kinematics(0,0,omegaZ)
-    commandHandler.sendSpeedCommand(fl, fr, rl, rr)
+    return scheduler.run_for(kinematics(0,0,omegaZ), rotationTime)
+
+
+def startAlignBackward(scheduler: MotionScheduler):
+    return scheduler.run_for(kinematics(0,-1,0), BACKWARD_TIME)
+
+
+# splits the distance to the tag into the sideways and forward part, in the robot frame
+def StrafeVelocity(v, angle_rad):
     
-    startTime = time.time()
+    v_x = v * -np.sin(angle_rad)
+    v_y = v * np.cos(angle_rad)
     
-    while True:
-        elapsed_time = time.time() - startTime
-        if elapsed_time >= rotationTime:
-            print(f"Rotating for {rotationTime} completed")
+    print("V_x: ",v_x)
+    print("V_y:", v_y)
+    return v_x, v_y
 
-            break
+
+# rotates the robot for a certain time, calculated in "CalculateRotatationTime", 
+# to align the robot with tag angle, the motion scheduler stops the wheels at the deadline
+def AlignAngle(angle, scheduler: MotionScheduler):
     
-    commandHandler.sendSpeedCommand(0,0,0,0)
+    command = startAlignAngle(angle, scheduler)
+    command.wait()
+    if command.state != DONE:
+        return False
     
+    print(f"Rotating for {command.duration} completed, {command.lateness * 1000:.2f} ms late")
     return True
 
 
@@ -77,44 +92,29 @@ def rotate(command_handler: CommandHandler):
 # used in "AlignX" function to create a buffer for future real time 
 # aligments with pallet
 
-def AlignBackward(comandHandler: CommandHandler):
-        
-    startTime = time.time()
-        
-    fl, fr, rl, rr = kinematics(0,-1,0)
-    
-    comandHandler.sendSpeedCommand(fl, fr, rl, rr)
+def AlignBackward(scheduler: MotionScheduler):
     
+    command = startAlignBackward(scheduler)
+    command.wait()
+    if command.state != DONE:
+        return False
     
-    while True:
-        elapsed_time = time.time() - startTime
-        if elapsed_time >= 5:
-            print(f"Backward for {5} s completed")
-            break
-        
-    comandHandler.sendSpeedCommand(0, 0, 0, 0)
-        
+    print(f"Backward for {BACKWARD_TIME} s completed, {command.lateness * 1000:.2f} ms late")
     return True
         
 
 # function that aligns robot in x axe, also calls the "AlignBackward" funtion
 # to keep a buffer for direct alignment with the pallet 
 
-def AlignX(v, commandHandler: CommandHandler, angle_rad):
-    
-    v_x = v * -np.sin(angle_rad)
-    v_y = v * np.cos(angle_rad)
+def AlignX(v, scheduler: MotionScheduler, angle_rad):
     
-    print("V_x: ",v_x)
-    print("V_y:", v_y)
+    v_x, v_y = StrafeVelocity(v, angle_rad)
     
-    if v_y < 30:
-        if AlignBackward(commandHandler):
+    if v_y < MIN_STRAFE_Y:
+        if AlignBackward(scheduler):
             print("Robot has moved backward")
         
-    fl, fr, rl, rr = kinematics(v_x,0,0)
-    
-    commandHandler.sendSpeedCommand(fl, fr, rl, rr)
+    scheduler.send_now(kinematics(v_x,0,0))
     
 
 # Kinematics function calculates the speed and direction of each wheel 
@@ -124,24 +124,17 @@ def AlignX(v, commandHandler: CommandHandler, angle_rad):
 
 def kinematics(vx, vy, omega_z):
     
-    fl = 1/WHEEL_RADIUS*(vy - vx - (omega_z)) 
-    fr = 1/WHEEL_RADIUS*(vy + vx + (omega_z)) 
-    rl = 1/WHEEL_RADIUS*(vy + vx - (omega_z)) 
-    rr = 1/WHEEL_RADIUS*(vy - vx + (omega_z))   
-    
-    ratio = WHEEL_V_MIN / min(abs(fl), abs(fr), abs(rl), abs(rr))
-    
-    fl *= ratio
-    fr *= ratio
-    rl *= ratio
-    rr *= ratio
-    return linearToRPM(fl), linearToRPM(fr), linearToRPM(rl), linearToRPM(rr)
+    # only the direction of (vx, vy, omega_z) matters, omega_z is given as the rim speed of
+    # the rotation (omega * LXLY) so it weighs the same as the translation, the slowest wheel
+    # turns at MIN_RPM (see Kinematics.scale_to_min_rpm)
+    fl, fr, rl, rr = scale_to_min_rpm(wheel_rpms((vx, vy, omega_z / LXLY))).tolist()
+    return fl, fr, rl, rr
 
 
 #stops the robot
 def stopRobot(commandHandler: CommandHandler):
     
-    commandHandler.sendSpeedCommand(0,0,0,0)
+    commandHandler.sendSpeedCommand(0,0,0,0, force=True)
     
     
     
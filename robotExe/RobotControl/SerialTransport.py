@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+from collections import deque
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = 256
+
+WRITE_SECONDS = metrics.histogram('serial_write_seconds', "Time of a single write to the serial port")
+COALESCED = metrics.counter('serial_coalesced_frames_total', "Pending frames replaced by a newer one with the same key")
+DROPPED = metrics.counter('serial_dropped_frames_total', "Frames dropped because the queue was full")
+
+
+# Outbound side of the serial link. Callers only put data on a queue, the writer thread
+# is the only one that blocks on the port. Frames sent with a key (e.g. wheel setpoints)
+# replace the still pending frame with the same key, so only the newest one goes on the wire.
+class SerialTransport(threading.Thread):
+
+    def __init__(self, conn, max_pending=MAX_PENDING):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.conn = conn
+        self.max_pending = max_pending
+        self.running = False
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+
+        self.written_frames = 0
+        self.coalesced_frames = 0
+        self.dropped_frames = 0
+
+    def send(self, data: bytes, key=None):
+
+        with self._cond:
+            if key is not None:
+                for entry in self._pending:
+                    if entry[0] == key:
+                        entry[1] = data
+                        self.coalesced_frames += 1
+                        COALESCED.inc()
+                        return
+
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                self.dropped_frames += 1
+                DROPPED.inc()
+
+            self._pending.append([key, data])
+            self._cond.notify()
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def readline(self):
+        return self.conn.readline()
+
+    def run(self):
+
+        self.running = True
+
+        while self.running:
+            with self._cond:
+                while self.running and not self._pending:
+                    self._cond.wait()
+                if not self.running:
+                    break
+                _, data = self._pending.popleft()
+
+            try:
+                started = time.perf_counter()
+                self.conn.write(data)
+                WRITE_SECONDS.observe(time.perf_counter() - started)
+                self.written_frames += 1
+            except Exception as e:
+                logger.error("Serial write error: %s", e)
+
+    def stop(self):
+
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
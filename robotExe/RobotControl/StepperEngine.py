@@ -0,0 +1,150 @@
+import logging
+import numpy as np
+from clock import clock
+
+logger = logging.getLogger(__name__)
+
+# half step coil pattern of the 4 wire stepper (in1, in2, in3, in4)
+HALF_STEP_SEQUENCE = (
+    (1, 0, 0, 0),
+    (1, 1, 0, 0),
+    (0, 1, 0, 0),
+    (0, 1, 1, 0),
+    (0, 0, 1, 0),
+    (0, 0, 1, 1),
+    (0, 0, 0, 1),
+    (1, 0, 0, 1),
+)
+
+# half steps per second
+MAX_RATE = 1 / 0.0007
+START_RATE = 300.0
+# half steps per second^2
+ACCELERATION = 4000.0
+# falling this far behind the schedule restarts it instead of bursting steps to catch up
+MAX_LAG = 0.005
+
+
+# delay before every step of a "steps" long move with a trapezoidal speed profile:
+# accelerates from "start_rate" to "max_rate" and brakes back symmetrically
+def trapezoid_delays(steps, max_rate=MAX_RATE, start_rate=START_RATE, acceleration=ACCELERATION):
+
+    if steps <= 0:
+        return np.zeros(0)
+
+    n = np.arange(steps, dtype=float)
+    accelerating = np.sqrt(start_rate ** 2 + 2 * acceleration * n)
+    braking = np.sqrt(start_rate ** 2 + 2 * acceleration * (steps - 1 - n))
+    rate = np.minimum(max_rate, np.minimum(accelerating, braking))
+    return 1.0 / rate
+
+
+# Drives a 4 wire stepper through gpiozero output devices. The pin writes of every
+# transition are precomputed (a half step changes exactly one coil), steps are timed against
+# absolute deadlines on the shared clock so sleep jitter does not add up, moves follow a
+# trapezoidal ramp and the position is counted in absolute half steps.
+class StepperEngine:
+
+    def __init__(self, devices, sequence=HALF_STEP_SEQUENCE,
+                 max_rate=MAX_RATE, start_rate=START_RATE, acceleration=ACCELERATION):
+
+        self.pins = [device.pin for device in devices]
+        self.sequence = sequence
+        self.max_rate = max_rate
+        self.start_rate = start_rate
+        self.acceleration = acceleration
+
+        self.position = 0
+        self.phase = 0
+        self.energized = False
+        # called after every step, e.g. by the simulator to follow the coils
+        self.on_step = None
+        self.last_move = None
+
+        # writes of the transition into phase i, moving forward / backward
+        count = len(sequence)
+        self._writes = {
+            direction: [self._diff(sequence[(i - direction) % count], sequence[i]) for i in range(count)]
+            for direction in (1, -1)
+        }
+
+    def _diff(self, previous, current):
+        return tuple((pin, state) for pin, previous_state, state in zip(self.pins, previous, current)
+                     if state != previous_state)
+
+    def _energize(self):
+
+        for pin, state in zip(self.pins, self.sequence[self.phase]):
+            pin.state = state
+        self.energized = True
+        if self.on_step is not None:
+            self.on_step()
+
+    # switches every coil off, the position is kept
+    def release(self):
+
+        for pin in self.pins:
+            pin.state = 0
+        self.energized = False
+
+    # moves "steps" half steps (negative down), returns the number of steps made,
+    # "stop" is checked before every step, e.g. a limit switch or a cancel request
+    def move(self, steps, stop=None, max_rate=None):
+
+        direction = 1 if steps > 0 else -1
+        delays = trapezoid_delays(abs(int(steps)), max_rate or self.max_rate, self.start_rate, self.acceleration)
+        writes = self._writes[direction]
+        count = len(self.sequence)
+
+        if not self.energized:
+            self._energize()
+
+        started = clock.monotonic()
+        deadline = started
+        done = 0
+
+        for delay in delays:
+            if stop is not None and stop():
+                break
+
+            self.phase = (self.phase + direction) % count
+            for pin, state in writes[self.phase]:
+                pin.state = state
+            self.position += direction
+            done += 1
+
+            if self.on_step is not None:
+                self.on_step()
+
+            deadline += delay
+            remaining = deadline - clock.monotonic()
+            if remaining > 0:
+                clock.sleep(remaining)
+            elif remaining < -MAX_LAG:
+                deadline = clock.monotonic()
+
+        elapsed = clock.monotonic() - started
+        requested = float(delays[:done].sum())
+        self.last_move = {
+            'steps': done,
+            'elapsed': elapsed,
+            'requested_rate': done / requested if requested > 0 else 0.0,
+            'achieved_rate': done / elapsed if elapsed > 0 else 0.0,
+        }
+        if done:
+            logger.info("Stepper moved %d steps in %.2f s, %.0f/%.0f steps/s achieved/requested",
+                        done, elapsed, self.last_move['achieved_rate'], self.last_move['requested_rate'])
+        return done
+
+    # moves to the absolute "position" in half steps
+    def move_to(self, position, stop=None, max_rate=None):
+
+        steps = int(position) - self.position
+        if steps == 0:
+            return 0
+        return self.move(steps, stop, max_rate)
+
+    # time a move of "steps" half steps takes on the ramp
+    def move_time(self, steps, max_rate=None):
+        return float(trapezoid_delays(abs(int(steps)), max_rate or self.max_rate,
+                                      self.start_rate, self.acceleration).sum())
@@ -1,43 +1,113 @@
 import numpy as np
+from clock import clock
+from RobotControl.PoseFilter import PoseFilter
+from RobotControl.Odometry import Odometry
+from ArucoDetection.poseData import PoseTable
+
+# a prediction further than this from the last detection is not trusted
+MAX_PREDICTION_AGE = 0.3
 
 # class responsible for exrtacting the target information, that robot should focus on
 class Target:
     
-    def __init__(self):
+    # with "odometry" the pose keeps following the wheels between frames and out of view
+    def __init__(self, odometry: Odometry = None):
         
         self.x = 0
         self.y = 0
         self.angle = 0
         self.angle_rad = 0
+        self.visible = False
+
+        # capture time and frame sequence number of the pose the values come from
+        self.timestamp = None
+        self.sequence = None
+        # seconds between the capture and the time the values are valid for,
+        # std of (x, y, angle) at that time
+        self.age = None
+        self.uncertainty = None
+
+        self.filters = {}
+        self.odometry = odometry
     
-    def getPoseData(self, pose, id):
+    # "pose_table" is the marker indexed PoseTable kept by shared_data (poseData.PoseTable)
+    def getPoseData(self, pose_table: PoseTable, id):
     
-        if len(pose) > 0:
-            for x in pose:
-                if x.get("id") == id:
-                    
-                    self.angle, self.x, self.y = self.getPoseValues(x)
-                    self.angle_rad = np.radians(self.angle)
-                    
-                    return True
-                    
-                else:
-                    self.angle, self.x, self.y = self.getPoseValues(None)
-        else:
-            self.angle, self.x, self.y = self.getPoseValues(None)
+        slot = pose_table.get(id)
+        if slot is not None and slot['visible']:
+                
+            self.angle, self.x, self.y = self.getPoseValues(slot)
+            self.angle_rad = np.radians(self.angle)
+            self.timestamp = float(slot['timestamp'])
+            self.sequence = int(slot['seq'])
+            self.age = None
+            self.uncertainty = None
+
+            pose_filter = self.filters.get(id)
+            if pose_filter is None:
+                pose_filter = self.filters[id] = PoseFilter()
+            if pose_filter.timestamp != self.timestamp:
+                pose_filter.update(self.timestamp, (self.x, self.y, self.angle), self.sequence)
+                if self.odometry is not None:
+                    self.odometry.add_fix(id, self.timestamp, self.x, self.y, self.angle)
+            
+            return True
+                
+        self.angle, self.x, self.y = self.getPoseValues(None)
+        return False
             
             
+    # replaces the values with the pose of marker "id" predicted at time "t" (command time,
+    # now by default) - from odometry when the wheels report, from the marker filter otherwise,
+    # False when the marker was not seen recently enough
+    def predict(self, id, t=None):
+
+        if t is None:
+            t = clock.monotonic()
+
+        if self.odometry is not None and self.odometry.wheels_live:
+            estimate = self.odometry.relative_pose(id, t)
+            if estimate is not None:
+                self.x, self.y, self.angle, self.age, self.uncertainty = estimate
+                self.angle_rad = np.radians(self.angle)
+                self.visible = True
+                return True
+
+        pose_filter = self.filters.get(id)
+        if pose_filter is None or not pose_filter.initialized():
+            self.angle, self.x, self.y = self.getPoseValues(None)
+            return False
+
+        age = t - pose_filter.timestamp
+        if age > MAX_PREDICTION_AGE:
+            self.angle, self.x, self.y = self.getPoseValues(None)
+            return False
+
+        values, std = pose_filter.predict(t)
+        self.x, self.y, self.angle = (float(v) for v in values)
+        self.angle_rad = np.radians(self.angle)
+        self.visible = True
+        self.timestamp = pose_filter.timestamp
+        self.sequence = pose_filter.sequence
+        self.age = age
+        self.uncertainty = std
+
+        return True
+
     def getPoseValues(self, target):
         
-        target_x = "Not Visible"
-        target_y = "Not Visible"
-        target_angle = "Not Visible"    
+        # NaN and "visible" False while the marker is not visible
+        target_x = np.nan
+        target_y = np.nan
+        target_angle = np.nan
+        self.visible = False
         
-        if target != None :
+        if target is not None :
             
-            target_angle = -target.get('Roll')
-            target_x = target.get('x_cm')
-            target_y = target.get('z_cm')
+            self.visible = True
+            target_angle = -float(target['roll'])
+            target_x = float(target['x_cm'])
+            target_y = float(target['z_cm'])
 
            
         return target_angle, target_x, target_y
@@ -1,119 +1,76 @@
 import threading
-import time
 from sharedData import shared_data  
+from clock import clock
 from RobotControl.CommandHandler import CommandHandler
 from RobotControl.Target import Target
 from RobotControl.DirectDriveController import DirectDriveController
 from RobotControl.ForkLiftController import ForkliftController
-from RobotControl.RobotUtils import stopRobot, AlignAngle, AlignX, X_THRESHOLD, Y_THRESHOLD, DESIRED_X, AlignBackward, rotate
+from RobotControl.MotionScheduler import MotionScheduler
+from RobotControl.MotorControlData import MotorControlData
+from RobotControl.Odometry import Odometry
+from RobotControl.ControlLoop import FixedRateLoop, CONTROL_RATE
+from RobotControl.MissionStateMachine import MissionStateMachine, POSE, TIMER, COMMAND
+from RobotControl.RobotUtils import stopRobot
 
 
-def put_off_pallet(id, target: Target, commandHandler: CommandHandler, x_align, angle_align, directController: DirectDriveController ):
-    
-    rotate(commandHandler)
-    while True:
-        pose_data = shared_data.get_pose_data()
-        if target.getPoseData(pose_data, id):
-            break
-    stopRobot(commandHandler)
-    time.sleep(1)
-    picking_sequence(id, target, commandHandler, x_align, angle_align, directController)
-    return True
+IDLE_TIMEOUT = 1.0
+
+# fields that can wake the control thread up when it is idle
+CONTROL_FIELDS = ('mode', 'start_picking_process', 'forklift_zero', 
+                  'forklift_command_up', 'forklift_command_down', 'forklift_status')
+ALL_FIELDS = CONTROL_FIELDS + ('pose_data',)
 
-def picking_sequence(id, target: Target, commandHandler: CommandHandler, x_align, angle_align, directController: DirectDriveController):
-    
-    pose_data = shared_data.get_pose_data()
-    target.getPoseData(pose_data, id)
-    
-    if x_align == False and angle_align == False and shared_data.get_start_picking_process() == True  and target.x != "Not Visible":
-        
-        shared_data.set_picking_status("angle aligning")
-        if AlignAngle(target.angle, commandHandler):
-            
-            angle_align = False
-            x_align = True
-            shared_data.set_picking_status("X axe aligning")
-            AlignX(target.y, commandHandler, target.angle_rad)
-            
-            while x_align:
-                
-                pose_data = shared_data.get_pose_data()
-                target.getPoseData(pose_data, id=id)
-                if target.x != "Not Visible":
-                    if target.x < X_THRESHOLD and target.x > -X_THRESHOLD:
-                        x_align = False
-            
-            while True:
-            
-                if target.x != "Not Visible" and target.y < Y_THRESHOLD:
-                    break
-                
-                pose_data = shared_data.get_pose_data()
-                target.getPoseData(pose_data, id=id)
-                shared_data.set_picking_status("Direct driving")
-                directController.directDrive(commandHandler, target, DESIRED_X)
-                
-            stopRobot(commandHandler)
-            return True
 
 # Thread class responsible for combining all robots movement functionalties.
 class ExeRobotControl(threading.Thread):
     
-    def __init__(self):
+    # hardware can be swapped, e.g. for the simulator's pseudo serial port and mock pin forklift
+    def __init__(self, commandHandler: CommandHandler = None, forklift: ForkliftController = None):
 
         self.running = False
-        self.angle_align_pick = False
-        self.x_align_pick = False
-        self.angle_align_drop = False
-        self.x_align_drop = False
         
-        self.commandHandler = CommandHandler()
-        self.target = Target()
+        self.commandHandler = commandHandler if commandHandler is not None else CommandHandler()
+        self.scheduler = MotionScheduler(self.commandHandler)
+        self.motorData = MotorControlData(self.commandHandler)
+        self.odometry = Odometry(self.motorData.telemetry)
+        self.target = Target(self.odometry)
         self.directController = DirectDriveController()
-        self.forklift = ForkliftController()
+        self.controlLoop = FixedRateLoop(CONTROL_RATE)
+        self.forklift = forklift if forklift is not None else ForkliftController()
+        self.mission = MissionStateMachine(self.target, self.scheduler, self.directController,
+                                           self.forklift, self.controlLoop)
 
         threading.Thread.__init__(self)
         
     def run(self):
         
             self.running = True
+            self.scheduler.start()
+            self.motorData.start()
+            self.odometry.start()
             stopRobot(self.commandHandler)
+            # with a trusted stored lift position the homing below is skipped
+            self.forklift.restore_position()
+
+            versions = shared_data.get_versions(ALL_FIELDS)
 
             while self.running:
 
-                if shared_data.get_forklift_status() == '-':
-                    self.forklift.forklift_zero()
-                    shared_data.set_forklift_zero(False)
+                # forklift moves run in the background, the loop is woken up when they finish
+                if self.forklift.needs_homing():
+                    self.forklift.home(retry=True)
                 
                 
                 # Handling autonomus drive, 
                 # thanks to this part of code the robot is able to navigate to the marked pick up point 
-                # after completing picking task, the drop off task is started
+                # after completing picking task, the drop off task is started (see MissionStateMachine)
                 if shared_data.get_mode() == 'auto':
                     
-                    if shared_data.get_forklift_zero():
-                        self.forklift.forklift_zero()
+                    if shared_data.get_forklift_zero() and not self.forklift.busy():
+                        self.forklift.home()
                 
-                    if shared_data.get_start_picking_process():
-                        if picking_sequence(0, self.target, self.commandHandler, 
-                                            self.x_align_pick, self.angle_align_pick, 
-                                            self.directController):
-                    
-
-                            shared_data.set_picking_status("picking up")
-                            self.forklift.move_forklift_up()
-                            
-                            AlignBackward(self.commandHandler)
-                            
-                            if put_off_pallet(1, self.target, self.commandHandler, 
-                                            self.x_align_drop, self.angle_align_drop, 
-                                            self.directController):
-                                
-                                shared_data.set_picking_status("putting down")
-                                self.forklift.move_forklift_down(False)
-                                
-                                shared_data.set_start_picking_process(False)
-                                shared_data.set_picking_status("-")
+                    if not self.mission.active() and shared_data.get_start_picking_process() and not self.forklift.busy():
+                        self.mission.start()
                             
                                 
 
@@ -121,18 +78,43 @@ class ExeRobotControl(threading.Thread):
                 # For now its only responsible for forklift control
                 elif shared_data.get_mode() == 'manual':
                     
-                    shared_data.set_picking_status('-')
+                    self.mission.abort("manual mode")
                     
-                    if shared_data.get_forklift_zero():
-                        self.forklift.forklift_zero()
+                    if shared_data.get_picking_status() != '-':
+                        shared_data.set_picking_status('-')
+                    
+                    if shared_data.get_forklift_zero() and not self.forklift.busy():
+                        self.forklift.home()
                                         
-                    if shared_data.get_forklift_status() == 'Steady up' and shared_data.get_forklift_command_down():
-                        self.forklift.move_forklift_down(False)
-                        
-                    if shared_data.get_forklift_status() == 'Steady down' and shared_data.get_forklift_command_up():
-                        self.forklift.move_forklift_up()
+                    # a cancelled move ('Stopped') can be continued either way
+                    if shared_data.get_forklift_status() in ('Steady up', 'Stopped') and shared_data.get_forklift_command_down():
+                        self.forklift.lift_down()
                         
-
+                    if shared_data.get_forklift_status() in ('Steady down', 'Stopped') and shared_data.get_forklift_command_up():
+                        self.forklift.lift_up()
                 
-
-        
+                # sleep until the operator, the forklift, the vision thread (while a mission runs)
+                # or the mission timer has something new
+                wake_fields = ALL_FIELDS if self.mission.active() else CONTROL_FIELDS
+                timeout = IDLE_TIMEOUT
+                if self.mission.time_to_timer() is not None:
+                    timeout = clock.real_timeout(max(0.0, self.mission.time_to_timer()))
+                
+                current = shared_data.wait_for_change(wake_fields, timeout=timeout,
+                                                      since={name: versions[name] for name in wake_fields})
+                changed = {name for name in wake_fields if current[name] != versions[name]}
+                versions.update(current)
+                
+                if not self.mission.active():
+                    continue
+                
+                if shared_data.get_mode() != 'auto' or not shared_data.get_start_picking_process():
+                    self.mission.abort("stopped by the operator")
+                    continue
+                
+                if 'pose_data' in changed:
+                    self.mission.dispatch(POSE)
+                if changed - {'pose_data'}:
+                    self.mission.dispatch(COMMAND)
+                if self.mission.time_to_timer() is not None and self.mission.time_to_timer() <= 0:
+                    self.mission.dispatch(TIMER)
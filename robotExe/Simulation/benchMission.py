@@ -0,0 +1,182 @@
+# benchMission.py
+#
+# Runs the pick-and-drop mission against the simulator from randomized start poses
+# and reports cycle time and alignment error, e.g. (from robotExe/):
+#   python -m Simulation.benchMission --runs 200 --scale 20
+
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import sys
+import numpy as np
+from clock import clock
+from sharedData import shared_data, PICKING_FIELDS
+from RobotControl.CommandHandler import CommandHandler
+from RobotControl.exeRobotControl import ExeRobotControl
+from Simulation.mecanumBody import MecanumBody
+from Simulation.pseudoSerial import PseudoSerial
+from Simulation.simForklift import SimForkliftController
+from Simulation.simWorld import SimWorld
+from Simulation.syntheticPose import SyntheticPoseSource, PALLETS, wrap_angle
+
+MISSION_TIMEOUT = 300.0
+HOMING_TIMEOUT = 60.0
+
+
+# random start in front of the pick up pallet, with the marker in view
+def random_start(rng: random.Random):
+
+    marker_x, marker_y, approach = PALLETS[0]
+    distance = rng.uniform(0.7, 1.4)
+    lateral = rng.uniform(-0.25, 0.25)
+    heading_error = math.radians(rng.uniform(-20, 20))
+
+    x = marker_x - distance * math.cos(approach) - lateral * math.sin(approach)
+    y = marker_y - distance * math.sin(approach) + lateral * math.cos(approach)
+    return x, y, approach - heading_error
+
+
+# robot pose expressed in the pallet approach frame
+def alignment_error(body: MecanumBody, marker_id):
+
+    x, y, heading = body.pose()
+    marker_x, marker_y, approach = PALLETS[marker_id]
+    dx, dy = x - marker_x, y - marker_y
+
+    return {
+        'distance_cm': -(dx * math.cos(approach) + dy * math.sin(approach)) * 100,
+        'lateral_cm': (-dx * math.sin(approach) + dy * math.cos(approach)) * 100,
+        'heading_deg': math.degrees(wrap_angle(heading - approach)),
+    }
+
+
+def wait_for(predicate, timeout):
+
+    deadline = clock.monotonic() + timeout
+    versions = shared_data.get_versions(PICKING_FIELDS + ('forklift_status',))
+    while not predicate():
+        if clock.monotonic() > deadline:
+            return False
+        versions = shared_data.wait_for_change(PICKING_FIELDS + ('forklift_status',),
+                                               timeout=clock.real_timeout(1.0), since=versions)
+    return True
+
+
+# single mission, runs in its own process so a stuck mission thread dies with it
+def run_trial(seed, scale=20.0, timeout=MISSION_TIMEOUT, verbose=False):
+
+    if not verbose:
+        # mission code prints a lot, keep the report readable
+        sys.stdout = open(os.devnull, 'w')
+
+    rng = random.Random(seed)
+    clock.set_scale(scale)
+
+    x, y, heading = random_start(rng)
+    body = MecanumBody(x, y, heading)
+    world = SimWorld(body, SyntheticPoseSource(body, rng=rng))
+    robot = ExeRobotControl(CommandHandler(conn=PseudoSerial(body)), SimForkliftController())
+    robot.daemon = True
+
+    world.start()
+    robot.start()
+
+    result = {'seed': seed, 'success': False, 'phases': {}}
+
+    if not wait_for(lambda: shared_data.get_forklift_status() == 'Steady down', HOMING_TIMEOUT):
+        result['failure'] = 'homing'
+        return result
+
+    shared_data.set_mode('auto')
+    shared_data.set_start_picking_process(True)
+
+    started = clock.monotonic()
+    status = shared_data.get_picking_status()
+
+    # pallet alignment is measured when the lift starts moving
+    def track():
+        nonlocal status
+        current = shared_data.get_picking_status()
+        if current != status:
+            if current == 'picking up':
+                result['pick_error'] = alignment_error(body, 0)
+            elif current == 'putting down':
+                result['drop_error'] = alignment_error(body, 1)
+            status = current
+        return not shared_data.get_start_picking_process()
+
+    if not wait_for(track, timeout):
+        result['failure'] = f"{robot.mission.leg} {robot.mission.state}"
+    elif robot.mission.abort_reason is not None:
+        result['failure'] = f"aborted: {robot.mission.abort_reason}"
+    else:
+        result['success'] = True
+        result['cycle_time'] = clock.monotonic() - started
+        result['phases'] = robot.mission.durations()
+
+    return result
+
+
+def _run_trial(args):
+    return run_trial(*args)
+
+
+def summarize(values, unit):
+
+    values = np.abs(np.array(values))
+    if len(values) == 0:
+        return "-"
+    return (f"mean {values.mean():.2f} {unit}, p50 {np.percentile(values, 50):.2f}, "
+            f"p90 {np.percentile(values, 90):.2f}, max {values.max():.2f}")
+
+
+def print_report(results):
+
+    successes = [r for r in results if r['success']]
+    print(f"{len(successes)}/{len(results)} missions completed")
+
+    failures = {}
+    for r in results:
+        if not r['success']:
+            failures[r.get('failure')] = failures.get(r.get('failure'), 0) + 1
+    if failures:
+        print("failures by phase:", failures)
+
+    print("cycle time:", summarize([r['cycle_time'] for r in successes], 's'))
+
+    phases = {}
+    for r in successes:
+        for name, duration in r['phases'].items():
+            phases.setdefault(name, []).append(duration)
+    for name, durations in phases.items():
+        print(f"  {name:<18} {summarize(durations, 's')}")
+
+    for key, label in (('pick_error', 'pick'), ('drop_error', 'drop')):
+        errors = [r[key] for r in results if key in r]
+        for field in ('lateral_cm', 'heading_deg', 'distance_cm'):
+            print(f"{label} {field:<12} {summarize([e[field] for e in errors], field.split('_')[1])}")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the pick-and-drop mission in simulation")
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--scale', type=float, default=20.0, help="simulated seconds per real second")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=MISSION_TIMEOUT, help="simulated seconds per mission")
+    # trials side by side share the CPU, each one needs a core of its own to keep up with --scale
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show mission output")
+    args = parser.parse_args()
+
+    trials = [(args.seed + i, args.scale, args.timeout, args.verbose) for i in range(args.runs)]
+    with multiprocessing.Pool(args.processes, maxtasksperchild=1) as pool:
+        results = pool.map(_run_trial, trials, chunksize=1)
+
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# mecanumBody.py
+
+import math
+import threading
+from RobotControl.Kinematics import body_twist
+
+
+# Rigid mecanum body driven by the commanded wheel RPMs.
+# Wheels follow their setpoints with a first order lag (motor + PID response),
+# the body twist comes from the forward kinematics of RobotControl.Kinematics
+# (vy forward, vx to the left, omega counter clockwise).
+class MecanumBody:
+
+    def __init__(self, x=0.0, y=0.0, heading=0.0, motor_tau=0.15):
+
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.motor_tau = motor_tau
+
+        self.target_rpms = [0.0] * 4
+        self.rpms = [0.0] * 4
+        self.distance = 0.0
+
+        self._lock = threading.Lock()
+
+    def set_target_rpms(self, rpms):
+        with self._lock:
+            self.target_rpms = [float(rpm) for rpm in rpms]
+
+    def set_target_rpm(self, motor, rpm):
+        with self._lock:
+            self.target_rpms[motor] = float(rpm)
+
+    def wheel_state(self):
+        with self._lock:
+            return list(self.rpms), list(self.target_rpms)
+
+    def pose(self):
+        with self._lock:
+            return self.x, self.y, self.heading
+
+    def twist(self):
+
+        vx, vy, omega = body_twist(self.rpms).tolist()
+        return vx, vy, omega
+
+    def step(self, dt):
+
+        with self._lock:
+            alpha = 1.0 - math.exp(-dt / self.motor_tau) if self.motor_tau > 0 else 1.0
+            self.rpms = [rpm + (target - rpm) * alpha for rpm, target in zip(self.rpms, self.target_rpms)]
+
+            vx, vy, omega = self.twist()
+            # integrate at the middle of the step heading
+            heading = self.heading + omega * dt / 2
+            self.x += (vy * math.cos(heading) - vx * math.sin(heading)) * dt
+            self.y += (vy * math.sin(heading) + vx * math.cos(heading)) * dt
+            self.heading += omega * dt
+            self.distance += math.hypot(vx, vy) * dt
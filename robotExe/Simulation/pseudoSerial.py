@@ -0,0 +1,101 @@
+# pseudoSerial.py
+
+import threading
+from collections import deque
+from clock import clock
+from RobotControl.CommandHandler import FRAME_START, CMD_SET_SPEED_ALL, SPEED_FRAME, checksum
+from Simulation.mecanumBody import MecanumBody
+
+BINARY_FRAME_SIZE = SPEED_FRAME.size + 1
+PWM_PER_RPM = 1.5
+
+
+# Stands in for serial.Serial of the motor controller. Understands every CommandHandler
+# framing (legacy, SET_SPEED_ALL text and binary) and answers with firmware style telemetry
+# lines generated from the simulated wheels.
+class PseudoSerial:
+
+    def __init__(self, body: MecanumBody, telemetry_interval=0.02):
+
+        self.body = body
+        self.telemetry_interval = telemetry_interval
+
+        self.frames = 0
+        self.bad_frames = 0
+
+        self._buffer = bytearray()
+        self._lines = deque()
+        self._lock = threading.Lock()
+
+    def write(self, data):
+
+        with self._lock:
+            self._buffer.extend(data)
+            self._parse()
+        return len(data)
+
+    def _parse(self):
+
+        while self._buffer:
+            if self._buffer[0] == FRAME_START:
+                if len(self._buffer) < BINARY_FRAME_SIZE:
+                    return
+                frame = bytes(self._buffer[:BINARY_FRAME_SIZE])
+                del self._buffer[:BINARY_FRAME_SIZE]
+
+                _, command, *rpms = SPEED_FRAME.unpack(frame[:-1])
+                if checksum(frame[:-1]) != frame[-1] or command != CMD_SET_SPEED_ALL:
+                    self.bad_frames += 1
+                    continue
+                self.body.set_target_rpms(rpms)
+                self.frames += 1
+                continue
+
+            end = self._buffer.find(b'\n')
+            if end < 0:
+                return
+            line = self._buffer[:end].decode('utf-8', errors='replace').strip()
+            del self._buffer[:end + 1]
+            self._handle_line(line)
+
+    def _handle_line(self, line):
+
+        try:
+            if line.startswith('SET_SPEED_ALL:RPM:'):
+                rpms = line[len('SET_SPEED_ALL:RPM:'):].rstrip(';').split(',')
+                self.body.set_target_rpms(float(rpm) for rpm in rpms)
+
+            elif line.startswith('SET_SPEED_MOTOR_'):
+                header, _, rpm = line.rstrip(';').partition(':RPM:')
+                self.body.set_target_rpm(int(header[len('SET_SPEED_MOTOR_'):]), float(rpm))
+
+            elif not line.startswith('SET_PID_MOTOR_'):
+                self.bad_frames += 1
+                return
+
+        except (ValueError, IndexError):
+            self.bad_frames += 1
+            return
+
+        self.frames += 1
+
+    # one telemetry line per motor every "telemetry_interval" of clock time
+    def readline(self):
+
+        with self._lock:
+            if self._lines:
+                return self._lines.popleft()
+
+        clock.sleep(self.telemetry_interval)
+        rpms, targets = self.body.wheel_state()
+
+        lines = [f"MOTOR_{motor}:RPM:{rpm:.2f};TARGET:{target:.0f};ERR:{target - rpm:.2f};"
+                 f"PWM:{min(255.0, abs(target) * PWM_PER_RPM):.0f};\n".encode('utf-8')
+                 for motor, (rpm, target) in enumerate(zip(rpms, targets))]
+
+        with self._lock:
+            self._lines.extend(lines[1:])
+        return lines[0]
+
+    def close(self):
+        pass
@@ -0,0 +1,105 @@
+# simForklift.py
+
+import numpy as np
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+from clock import clock
+from RobotControl.ForkLiftController import ForkliftController
+from RobotControl.StepperEngine import StepperEngine, trapezoid_delays
+
+# simulated seconds between two batches of steps
+STEP_TICK = 0.01
+
+
+# StepperEngine that keeps the ramp timing on the clock instead of sleeping before every
+# step. All steps due by a tick are made at once, without pin writes, so a move takes the
+# same simulated time however much real time the Python steps cost on a loaded machine.
+class VirtualStepperEngine(StepperEngine):
+
+    def __init__(self, devices, **kwargs):
+        StepperEngine.__init__(self, devices, **kwargs)
+        # direction of the step "on_step" is called for
+        self.direction = 0
+
+    # coils hold the current phase, no step is made
+    def _energize(self):
+
+        for pin, state in zip(self.pins, self.sequence[self.phase]):
+            pin.state = state
+        self.energized = True
+
+    def move(self, steps, stop=None, max_rate=None):
+
+        direction = 1 if steps > 0 else -1
+        due = np.cumsum(trapezoid_delays(abs(int(steps)), max_rate or self.max_rate,
+                                         self.start_rate, self.acceleration))
+        count = len(self.sequence)
+        self.direction = direction
+
+        if not self.energized:
+            self._energize()
+
+        started = clock.monotonic()
+        done = 0
+        stopped = False
+
+        while done < len(due) and not stopped:
+            elapsed = clock.monotonic() - started
+            for _ in range(done, int(np.searchsorted(due, elapsed, side='right'))):
+                if stop is not None and stop():
+                    stopped = True
+                    break
+                self.phase = (self.phase + direction) % count
+                self.position += direction
+                done += 1
+                if self.on_step is not None:
+                    self.on_step()
+
+            if done < len(due) and not stopped:
+                clock.sleep(max(STEP_TICK, due[done] - elapsed))
+
+        for pin, state in zip(self.pins, self.sequence[self.phase]):
+            pin.state = state
+
+        elapsed = clock.monotonic() - started
+        requested = float(due[done - 1]) if done else 0.0
+        self.last_move = {
+            'steps': done,
+            'elapsed': elapsed,
+            'requested_rate': done / requested if requested > 0 else 0.0,
+            'achieved_rate': done / elapsed if elapsed > 0 else 0.0,
+        }
+        return done
+
+
+# Real ForkliftController on gpiozero mock pins, driven by a VirtualStepperEngine. The lift
+# position follows the steps of the engine, the limit switch is pressed at the bottom.
+class SimForkliftController(ForkliftController):
+
+    def __init__(self):
+
+        Device.pin_factory = MockFactory()
+        self.position = 0
+        self._pressed = None
+        # no stored lift position, every trial homes
+        super().__init__(position_file=None)
+        self.engine = VirtualStepperEngine([self.in1, self.in2, self.in3, self.in4])
+        self.engine.on_step = self._follow_engine
+        self._update_limit_switch()
+
+    def _follow_engine(self):
+
+        self.position = max(0, self.position + self.engine.direction)
+        self._update_limit_switch()
+
+    def _update_limit_switch(self):
+
+        pressed = self.position <= 0
+        if pressed == self._pressed:
+            return
+
+        self._pressed = pressed
+        if pressed:
+            self.down_pin.pin.drive_low()
+        else:
+            self.down_pin.pin.drive_high()
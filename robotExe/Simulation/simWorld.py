@@ -0,0 +1,56 @@
+# simWorld.py
+
+import threading
+from collections import deque
+from clock import clock
+from sharedData import shared_data
+from Simulation.mecanumBody import MecanumBody
+from Simulation.syntheticPose import SyntheticPoseSource
+
+
+# Advances the simulated robot body on the shared clock and publishes synthetic
+# pose data the way PoseEstimator does, "camera_latency" after the frame was captured.
+class SimWorld(threading.Thread):
+
+    def __init__(self, body: MecanumBody, pose_source: SyntheticPoseSource,
+                 physics_dt=0.002, camera_fps=30.0, camera_latency=0.07):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.body = body
+        self.pose_source = pose_source
+        self.physics_dt = physics_dt
+        self.frame_interval = 1.0 / camera_fps
+        self.camera_latency = camera_latency
+        self.running = False
+
+        self._in_flight = deque()
+        self._sequence = 0
+
+    def run(self):
+
+        self.running = True
+        last = clock.monotonic()
+        next_frame = last
+
+        while self.running:
+            clock.sleep(self.physics_dt)
+            now = clock.monotonic()
+
+            # the thread may wake up late, integrate in steps no longer than physics_dt
+            elapsed = now - last
+            while elapsed > 0:
+                dt = min(elapsed, self.physics_dt)
+                self.body.step(dt)
+                elapsed -= dt
+            last = now
+
+            if now >= next_frame:
+                self._in_flight.append((now + self.camera_latency, self.pose_source.poses(now, self._sequence)))
+                self._sequence += 1
+                next_frame = max(next_frame + self.frame_interval, now)
+
+            while self._in_flight and self._in_flight[0][0] <= now:
+                shared_data.set_pose_data(self._in_flight.popleft()[1])
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,76 @@
+# syntheticPose.py
+
+import math
+import random
+import numpy as np
+from ArucoDetection.poseData import POSE_DTYPE
+from Simulation.mecanumBody import MecanumBody
+
+# marker id -> (x, y, approach heading) in world metres / radians,
+# approach heading is the robot heading when it is square to the pallet
+PALLETS = {
+    0: (0.0, 0.0, math.pi / 2),
+    1: (1.2, -0.8, 0.0),
+}
+
+
+def wrap_angle(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+# Produces the pose records PoseEstimator would publish for the pallet markers,
+# computed from the simulated robot position, with the camera field of view and noise.
+class SyntheticPoseSource:
+
+    def __init__(self, body: MecanumBody, pallets=PALLETS,
+                 fov_deg=70.0, max_range=3.0, max_marker_angle_deg=60.0,
+                 noise_cm=0.3, noise_deg=0.5, rng: random.Random = None):
+
+        self.body = body
+        self.pallets = pallets
+        self.half_fov = math.radians(fov_deg) / 2
+        self.max_range = max_range
+        self.max_marker_angle = math.radians(max_marker_angle_deg)
+        self.noise_cm = noise_cm
+        self.noise_deg = noise_deg
+        self.rng = rng if rng is not None else random.Random()
+
+    # marker position in the camera frame (x to the right, z forward) and heading error,
+    # None when the marker is not visible
+    def relative_pose(self, marker_id, robot_pose=None):
+
+        x, y, heading = self.body.pose() if robot_pose is None else robot_pose
+        marker_x, marker_y, approach = self.pallets[marker_id]
+
+        dx, dy = marker_x - x, marker_y - y
+        forward = dx * math.cos(heading) + dy * math.sin(heading)
+        left = -dx * math.sin(heading) + dy * math.cos(heading)
+        heading_error = wrap_angle(approach - heading)
+
+        if forward <= 0.05 or math.hypot(forward, left) > self.max_range:
+            return None
+        if abs(math.atan2(left, forward)) > self.half_fov or abs(heading_error) > self.max_marker_angle:
+            return None
+
+        return -left * 100, forward * 100, heading_error
+
+    def poses(self, timestamp, sequence=0):
+
+        rows = []
+        robot_pose = self.body.pose()
+        for marker_id in self.pallets:
+            relative = self.relative_pose(marker_id, robot_pose)
+            if relative is None:
+                continue
+
+            x_cm, z_cm, heading_error = relative
+            # Target turns -roll into the angle the robot has to rotate by (counter clockwise)
+            roll = -math.degrees(heading_error)
+            rows.append((marker_id,
+                         x_cm + self.rng.gauss(0, self.noise_cm),
+                         z_cm + self.rng.gauss(0, self.noise_cm),
+                         roll + self.rng.gauss(0, self.noise_deg),
+                         timestamp,
+                         sequence))
+
+        return np.array(rows, dtype=POSE_DTYPE)
@@ -2,19 +2,53 @@
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-import cv2
-import base64
 import asyncio
+import json
+import logging
+import time
 from sharedData import shared_data
+from frameHub import frame_hub
+from ArucoDetection.poseData import (pose_records_to_dicts, pose_records_to_bytes, PoseThrottle,
+                                     POSE_MAX_RATE, POSE_THRESHOLD_CM, POSE_THRESHOLD_DEG)
 from initialization import initialize_all
+from wsChannel import Channel, CODEC_JSON, CODEC_MSGPACK
+import metrics
+
+logger = logging.getLogger(__name__)
 
 
 # uvicorn backend:app --host 0.0.0.0 --port 8000
 
 class PickingProcessRequest(BaseModel):
     picking_process: bool
+
+
+# time spent sending one message, per websocket endpoint
+def send_histogram(endpoint):
+    return metrics.histogram('websocket_send_seconds', "Time to send one websocket message",
+                             labels={'endpoint': endpoint})
+
+CHANNEL_SEND = send_histogram('ws')
+VIDEO_SEND = send_histogram('video')
+POSE_SEND = send_histogram('pose')
+    
+
+# runs handler coroutines side by side and cancels the rest as soon as one of them ends,
+# so an idle sender waiting for data changes does not outlive a disconnected client
+async def run_until_first_done(*coroutines):
+    
+    tasks = [asyncio.create_task(c) for c in coroutines]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
     
+    for task in done:
+        task.result()
+
 
 async def app_lifespan(app: FastAPI):
     initialize_all()
@@ -31,183 +65,160 @@ app.add_middleware(
 )
 
 
-    
-@app.websocket("/runPick")
-async def handle_picking(ws: WebSocket):
-    await ws.accept()
-    print("Picking Handler WebSocket connected")
-
-    async def send_updates():
-        """Send updates to the frontend at regular intervals."""
-        last_status = None
-        last_start_picking_process = None
-        while True:
-            
-            current_status = shared_data.get_picking_status()
-            current_start_picking_process = shared_data.get_start_picking_process()
-
-            if (current_status != last_status) or (current_start_picking_process != last_start_picking_process):
-                
-                data_to_send = {
-                    'status': current_status,
-                    'start_picking_process': current_start_picking_process
-                }
-                await ws.send_json(data_to_send)
-                print("Sent to frontend:", data_to_send)
+# Prometheus scrape endpoint
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
-                last_status = current_status
-                last_start_picking_process = current_start_picking_process
-
-            await asyncio.sleep(0.5) 
-
-    async def receive_messages():
-
-        while True:
-            try:
-                new_data = await ws.receive_json()
-                if "start_picking_process" in new_data:
-                    shared_data.set_start_picking_process(new_data["start_picking_process"])
-                    print("Received from frontend:", new_data)
-                    
-            except WebSocketDisconnect:
-                print("Picking Handler disconnected")
-                break
-            
-            except Exception as e:
-                print(f"Picking Handler Error: {e}")
-                break
 
+    
+# single socket for every control topic, see wsChannel for the protocol
+@app.websocket("/ws")
+async def channel(ws: WebSocket):
+    
+    codec = ws.query_params.get("codec", CODEC_JSON)
+    binary = codec == CODEC_MSGPACK
+    
+    async def send(data):
+        with CHANNEL_SEND.time():
+            if binary:
+                await ws.send_bytes(data)
+            else:
+                await ws.send_text(data)
+    
+    async def receive():
+        return await ws.receive_bytes() if binary else await ws.receive_text()
+    
     try:
-        await asyncio.gather(send_updates(), receive_messages())
-    except WebSocketDisconnect:
-        print("Picking Handler WebSocket disconnected")
-
-        
-@app.websocket("/mode")
-async def handle_mode_selection(ws: WebSocket):
+        connection = Channel(send, receive, codec)
+    except ValueError as e:
+        await ws.close(code=1003, reason=str(e))
+        return
     
     await ws.accept()
-    print("Mode Handler Websocket connected")
+    print("Channel client connected")
     
     try:
-        while True:
-            
-            current_mode = shared_data.get_mode()
-                
-            await ws.send_json({
-                'mode': current_mode
-            })
-            
-            new_mode = await ws.receive_json()
-            shared_data.set_mode(new_mode.get("mode"))
-            
+        await run_until_first_done(connection.push_updates(), connection.handle_messages())
     except WebSocketDisconnect:
-        print("Mode Handler disconnected")
+        print("Channel client disconnected")
     except Exception as e:
-        print(f"Mode Handler Error: {e}")
-        
-        
-@app.websocket("/forklift")
-async def forklift_control(ws: WebSocket):
-    await ws.accept()
-    print("Forklift WebSocket connected")
-
-    async def send_updates():
-        """Send updates to the frontend at regular intervals."""
-        last_state = None
-        while True:
-            current_state = {
-                'command_up': shared_data.get_forklift_command_up(),
-                'command_down': shared_data.get_forklift_command_down(),
-                'status': shared_data.get_forklift_status(),
-                'zero': shared_data.get_forklift_zero()
-            }
-
-            if current_state != last_state:
-                await ws.send_json(current_state)
-                print("Sent to frontend:", current_state)
-                last_state = current_state
-
-            await asyncio.sleep(0.5)  
-            
-    async def receive_commands():
-        """Receive and process commands from the frontend."""
-        while True:
-            try:
-                new_command = await asyncio.wait_for(ws.receive_json(), timeout=1.0)
-                print("Received from frontend:", new_command)
-
-                new_command_up = new_command.get('command_up')
-                new_command_down = new_command.get('command_down')
-                new_command_zero = new_command.get('zero')
+        print(f"Channel error: {e}")
 
-                current_status = shared_data.get_forklift_status()
-                current_mode = shared_data.get_mode()
-
-                if current_status == 'Steady up' and current_mode == 'manual':
-                    shared_data.set_forklift_command_down(new_command_down)
-
-                elif current_status == 'Steady down' and current_mode == 'manual':
-                    shared_data.set_forklift_command_up(new_command_up)
-
-                if new_command_zero:
-                    shared_data.set_forklift_zero(new_command_zero)
-
-            except asyncio.TimeoutError:
-                pass
-            except WebSocketDisconnect:
-                print("Forklift WebSocket disconnected")
-                break
-            except Exception as e:
-                print(f"Forklift WebSocket Error (receive): {e}")
-                break
-
-    try:
-        await asyncio.gather(send_updates(), receive_commands())
-    except WebSocketDisconnect:
-        print("Forklift WebSocket disconnected")
-    except Exception as e:
-        print(f"Forklift WebSocket Error: {e}")
-        
 
 @app.websocket("/video")
 async def video_stream(ws: WebSocket):
     
+    # ?mode=binary sends raw JPEG bytes, default text mode keeps the base64 data URL,
+    # fps, width, quality and adaptive negotiate the stream (see frameHub.StreamSettings)
+    try:
+        settings = frame_hub.default_settings.updated(ws.query_params)
+    except ValueError as e:
+        await ws.close(code=1003, reason=f"Invalid stream settings: {e}")
+        return
+    
     await ws.accept()
     print("Video client connected")
     
-    try:
+    session = frame_hub.subscribe(settings)
+    
+    async def send_frames():
+        
         while True:
-            frame = shared_data.get_frame()
+            encoded = await session.next_frame()
+            if encoded is None:
+                continue
             
-            if frame is not None:
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 60])
-                data = f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
-                await ws.send_text(data)
-                
-            await asyncio.sleep(0.2)
+            data = encoded.jpeg if session.settings.binary else encoded.data_url()
+            started = time.perf_counter()
+            with VIDEO_SEND.time():
+                if session.settings.binary:
+                    await ws.send_bytes(data)
+                else:
+                    await ws.send_text(data)
+            session.frame_sent(encoded, len(data), time.perf_counter() - started)
+    
+    # the client may renegotiate at any time with a JSON message like {"fps": 10, "quality": 75}
+    async def receive_settings():
+        
+        while True:
+            message = await ws.receive_text()
+            try:
+                settings = json.loads(message)
+                if not isinstance(settings, dict):
+                    raise TypeError("settings must be an object")
+                session.configure(session.settings.updated(settings))
+            except (TypeError, ValueError) as e:
+                logger.debug("Invalid stream settings %s: %s", message, e)
+    
+    try:
+        await run_until_first_done(send_frames(), receive_settings())
             
     except WebSocketDisconnect:
-        print("Video client disconnected")
+        print(f"Video client disconnected {session.stats()}")
         
     except Exception as e:
         print(f"Video error: {e}")
         
+    finally:
+        frame_hub.unsubscribe(session)
+        
         
 
 
 @app.websocket("/pose")
 async def pose_stream(ws: WebSocket):
     
+    # pushed on every new detection that moved a marker, e.g.
+    # /pose?rate=10&threshold_cm=0.5&threshold_deg=0.5&format=binary
+    # binary frames follow poseData.POSE_WIRE_HEADER / POSE_WIRE_DTYPE
+    params = ws.query_params
+    binary = params.get("format") == "binary"
+    try:
+        throttle = PoseThrottle(max_rate=float(params.get("rate", POSE_MAX_RATE)),
+                                threshold_cm=float(params.get("threshold_cm", POSE_THRESHOLD_CM)),
+                                threshold_deg=float(params.get("threshold_deg", POSE_THRESHOLD_DEG)))
+    except (ValueError, ZeroDivisionError) as e:
+        await ws.close(code=1003, reason=f"Invalid pose stream settings: {e}")
+        return
+    
     await ws.accept()
     print("Pose client connected")
     
-    try:
+    async def send_poses():
+        
         while True:
-            data = shared_data.get_pose_data()
+            values, versions = shared_data.snapshot(('pose_data',))
+            records = values['pose_data']
+            
+            now = time.monotonic()
+            delay = throttle.delay(records, now)
+            if delay:
+                # over the rate cap, the newest pose is sent once it allows
+                await asyncio.sleep(delay)
+                continue
             
-            await ws.send_json(data)
-            await asyncio.sleep(0.5)
+            if delay is not None:
+                with POSE_SEND.time():
+                    if binary:
+                        await ws.send_bytes(pose_records_to_bytes(records, versions['pose_data']))
+                    else:
+                        await ws.send_json(pose_records_to_dicts(records))
+                throttle.sent(records, now)
+            
+            await shared_data.wait_for_change_async(('pose_data',), since=versions)
+    
+    # nothing is expected from the client, reading only notices it going away while
+    # the throttle holds the poses back
+    async def watch_disconnect():
+        
+        while True:
+            message = await ws.receive()
+            if message['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(message.get('code', 1000))
+    
+    try:
+        await run_until_first_done(send_poses(), watch_disconnect())
             
     except WebSocketDisconnect:
         print("Pose client disconnected")
@@ -0,0 +1,41 @@
+# clock.py
+
+import threading
+import time
+
+
+# Monotonic clock used by everything that schedules robot motion.
+# On the robot it is plain time.monotonic(). The simulator speeds it up with
+# "set_scale", so the same control code runs faster than real time.
+class Clock:
+    def __init__(self):
+
+        self.scale = 1.0
+        self._real_origin = time.monotonic()
+        self._origin = self._real_origin
+        self._lock = threading.Lock()
+
+    def set_scale(self, scale):
+
+        with self._lock:
+            now = self.monotonic()
+            self._real_origin = time.monotonic()
+            self._origin = now
+            self.scale = float(scale)
+
+    def monotonic(self):
+        return self._origin + (time.monotonic() - self._real_origin) * self.scale
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.scale)
+
+    # converts a timeout in clock seconds to the real seconds expected by threading primitives
+    def real_timeout(self, seconds):
+        if seconds is None:
+            return None
+        return max(0.0, seconds / self.scale)
+
+
+# Create a singleton instance
+clock = Clock()
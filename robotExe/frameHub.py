@@ -0,0 +1,322 @@
+# frameHub.py
+
+import asyncio
+import base64
+import threading
+import time
+from dataclasses import dataclass
+import cv2
+import metrics
+from sharedData import shared_data
+
+
+JPEG_QUALITY = 60
+MAX_FPS = 5
+# no session can ask for more than this
+HUB_MAX_FPS = 30
+MAX_WIDTH = 640
+
+# sessions adapt in these steps, so clients on similar links share the same encoding
+QUALITY_STEPS = (25, 35, 45, 60, 75, 90)
+WIDTH_STEPS = (320, 480, 640)
+# a send taking this fraction of the frame interval means the link is not keeping up
+CONGESTED_SEND = 0.5
+# sends faster than this fraction of the interval, UPGRADE_AFTER times in a row, step quality up
+FAST_SEND = 0.1
+UPGRADE_AFTER = 10
+
+ENCODE_SECONDS = metrics.histogram('video_encode_seconds', "JPEG encoding time of a video frame")
+ENCODED_BYTES = metrics.counter('video_encoded_bytes_total', "Bytes of encoded video frames")
+SENT_FRAMES = metrics.counter('video_sent_frames_total', "Video frames sent to clients")
+SKIPPED_FRAMES = metrics.counter('video_skipped_frames_total', "Video frames a client session skipped")
+
+
+# Single JPEG encoded frame, shared by every subscriber.
+# The base64 "data:" URL used by text clients is built lazily, once per frame.
+class EncodedFrame:
+
+    def __init__(self, seq, jpeg: bytes, width=None, quality=None):
+
+        self.seq = seq
+        self.jpeg = jpeg
+        self.width = width
+        self.quality = quality
+        # number of the hub publication the frame belongs to
+        self.index = None
+        self._data_url = None
+
+    def data_url(self):
+
+        if self._data_url is None:
+            self._data_url = f"data:image/jpeg;base64,{base64.b64encode(self.jpeg).decode('ascii')}"
+        return self._data_url
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+# What a client asked for, from the /video query string or a later JSON message, e.g.
+# /video?mode=binary&fps=10&width=480&quality=75&adaptive=0
+@dataclass
+class StreamSettings:
+    fps: float = MAX_FPS
+    width: int = MAX_WIDTH
+    quality: int = JPEG_QUALITY
+    adaptive: bool = True
+    binary: bool = False
+
+    # settings changed by "values" (strings or numbers), unknown keys are ignored
+    def updated(self, values):
+
+        def flag(value):
+            return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+        settings = StreamSettings(**vars(self))
+        if 'fps' in values:
+            settings.fps = _clamp(float(values['fps']), 1.0, HUB_MAX_FPS)
+        if 'width' in values:
+            settings.width = _clamp(int(values['width']), WIDTH_STEPS[0], MAX_WIDTH)
+        if 'quality' in values:
+            settings.quality = _clamp(int(values['quality']), QUALITY_STEPS[0], 100)
+        if 'adaptive' in values:
+            settings.adaptive = flag(values['adaptive'])
+        if 'mode' in values:
+            settings.binary = values['mode'] == 'binary'
+        return settings
+
+
+# (width, quality) variants from the cheapest to the requested one
+def quality_ladder(settings: StreamSettings):
+
+    widths = [width for width in WIDTH_STEPS if width < settings.width] + [settings.width]
+    qualities = [quality for quality in QUALITY_STEPS if quality < settings.quality] + [settings.quality]
+    variants = {(width, quality) for width in widths for quality in qualities}
+    # encoded size grows roughly with the pixel count and the quality
+    return sorted(variants, key=lambda variant: (variant[0] ** 2 * variant[1], variant))
+
+
+# Handle of a single /video connection, lives on the asyncio event loop.
+# Only the newest frame is kept, so a client whose previous send has not drained yet simply
+# skips frames. The session keeps its own frame rate and, when adaptive, walks the quality
+# ladder: down as soon as a send takes a large part of the frame interval, back up after a
+# run of fast sends.
+class StreamSession:
+
+    def __init__(self, hub, loop: asyncio.AbstractEventLoop, settings: StreamSettings):
+
+        self.hub = hub
+        self.loop = loop
+        self.event = asyncio.Event()
+
+        self.sent_frames = 0
+        self.skipped_frames = 0
+        self.throughput = None     # bytes/s, moving average over the sends
+        self._last_index = None
+        self._last_sent = None
+        self._fast_sends = 0
+        self.configure(settings)
+
+    def configure(self, settings: StreamSettings):
+
+        self.settings = settings
+        self.ladder = quality_ladder(settings)
+        # a renegotiated session restarts from the top of its new ladder
+        self.level = len(self.ladder) - 1
+        self._fast_sends = 0
+
+    @property
+    def variant(self):
+        return self.ladder[self.level]
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # event loop already closed, handler will unsubscribe on its way out
+            pass
+
+    async def next_frame(self) -> EncodedFrame:
+
+        if self._last_sent is not None:
+            remaining = self._last_sent + 1.0 / self.settings.fps - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+        await self.event.wait()
+        self.event.clear()
+
+        encoded = self.hub.frame_for(self.variant)
+        if encoded is not None and self._last_index is not None and encoded.index > self._last_index + 1:
+            skipped = encoded.index - self._last_index - 1
+            self.skipped_frames += skipped
+            SKIPPED_FRAMES.inc(skipped)
+        return encoded
+
+    # called after every send with its size and how long the await took
+    def frame_sent(self, encoded: EncodedFrame, size, seconds):
+
+        self._last_index = encoded.index
+        self._last_sent = time.monotonic()
+        self.sent_frames += 1
+        SENT_FRAMES.inc()
+
+        if seconds > 0:
+            rate = size / seconds
+            self.throughput = rate if self.throughput is None else 0.8 * self.throughput + 0.2 * rate
+
+        if not self.settings.adaptive:
+            return
+
+        interval = 1.0 / self.settings.fps
+        if seconds > interval:
+            # the link is far behind, halve the way down instead of stepping
+            self.level //= 2
+            self._fast_sends = 0
+        elif seconds > CONGESTED_SEND * interval:
+            self.level = max(0, self.level - 1)
+            self._fast_sends = 0
+        elif seconds < FAST_SEND * interval:
+            self._fast_sends += 1
+            if self._fast_sends >= UPGRADE_AFTER:
+                self.level = min(len(self.ladder) - 1, self.level + 1)
+                self._fast_sends = 0
+        else:
+            self._fast_sends = 0
+
+    def stats(self):
+
+        width, quality = self.variant
+        return {'fps': self.settings.fps, 'width': width, 'quality': quality, 'sent': self.sent_frames,
+                'skipped': self.skipped_frames, 'throughput': self.throughput}
+
+
+# Thread responsible for encoding each new frame from shared_data and fanning the bytes out to
+# all connected video sessions. Every (width, quality) variant the sessions currently use is
+# encoded once per frame and shared by all of them. Encoding is skipped entirely when nobody is
+# watching, and the hub runs at the highest frame rate any session asked for.
+class FrameHub(threading.Thread):
+
+    def __init__(self, quality=JPEG_QUALITY, max_fps=MAX_FPS):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.running = False
+        self.default_settings = StreamSettings(fps=max_fps, quality=quality)
+        self.latest = {}
+        self.published = 0
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._has_subscribers = threading.Event()
+
+    def subscribe(self, settings: StreamSettings = None) -> StreamSession:
+
+        session = StreamSession(self, asyncio.get_running_loop(), settings or self.default_settings)
+        with self._lock:
+            self._subscribers.add(session)
+            self._has_subscribers.set()
+
+        # new session gets the last encoded frame straight away
+        if self.latest:
+            session.event.set()
+        return session
+
+    def unsubscribe(self, session: StreamSession):
+
+        with self._lock:
+            self._subscribers.discard(session)
+            if not self._subscribers:
+                self._has_subscribers.clear()
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    # newest frame in "variant", another variant of it when that one is not encoded yet
+    # (the session has just switched), the next frame will have it
+    def frame_for(self, variant):
+
+        latest = self.latest
+        encoded = latest.get(variant)
+        if encoded is None and latest:
+            encoded = min(latest.values(), key=lambda frame: abs(frame.width - variant[0]) + abs(frame.quality - variant[1]))
+        return encoded
+
+    @metrics.timed(ENCODE_SECONDS)
+    def encode(self, frame, seq, width=None, quality=JPEG_QUALITY):
+
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return None
+        ENCODED_BYTES.inc(len(buffer))
+        return EncodedFrame(seq, buffer.tobytes(), width or frame.shape[1], quality)
+
+    # every variant of "frame" the sessions need, each size is scaled only once
+    def encode_variants(self, frame, seq, variants):
+
+        scaled = {}
+        encoded = {}
+        for width, quality in variants:
+            image = scaled.get(width)
+            if image is None:
+                if frame.shape[1] > width:
+                    height = round(frame.shape[0] * width / frame.shape[1])
+                    image = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                else:
+                    image = frame
+                scaled[width] = image
+
+            result = self.encode(image, seq, width, quality)
+            if result is not None:
+                encoded[(width, quality)] = result
+        return encoded
+
+    def run(self):
+
+        self.running = True
+        last_seq = 0
+
+        while self.running:
+            try:
+                if not self._has_subscribers.wait(timeout=0.5):
+                    continue
+
+                if shared_data.wait_for_frame(last_seq, timeout=0.5) == last_seq:
+                    continue
+
+                started = time.monotonic()
+                frame, seq = shared_data.get_frame_with_seq()
+                last_seq = seq
+                if frame is None:
+                    continue
+
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                if not subscribers:
+                    continue
+
+                encoded = self.encode_variants(frame, seq, {subscriber.variant for subscriber in subscribers})
+                if not encoded:
+                    continue
+                self.published += 1
+                for variant in encoded.values():
+                    variant.index = self.published
+                self.latest = encoded
+
+                for subscriber in subscribers:
+                    subscriber.notify()
+
+                # keep the stream at the fastest session rate, frames published in between are dropped
+                fps = min(HUB_MAX_FPS, max(subscriber.settings.fps for subscriber in subscribers))
+                remaining = 1.0 / fps - (time.monotonic() - started)
+                if remaining > 0:
+                    time.sleep(remaining)
+
+            except Exception as e:
+                print(f"FrameHub error: {e}")
+
+    def stop(self):
+        self.running = False
+
+
+# Create a singleton instance
+frame_hub = FrameHub()
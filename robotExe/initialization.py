@@ -1,12 +1,26 @@
 from ArucoDetection.poseEstimator import PoseEstimator
+from ArucoDetection.visionProcess import VisionBridge, vision_process_enabled
 from sharedData import shared_data
+from frameHub import frame_hub
 from RobotControl.exeRobotControl import ExeRobotControl
+from telemetryLog import telemetry_log
 
 def initialize_all():
     
-    estimator = PoseEstimator()
-    estimator.start()
-    print("PoseEstimator thread started.")
+    telemetry_log.start()
+    print("TelemetryLog thread started.")
+
+    if vision_process_enabled():
+        vision = VisionBridge()
+        vision.start()
+        print("Vision process started.")
+    else:
+        estimator = PoseEstimator()
+        estimator.start()
+        print("PoseEstimator thread started.")
+
+    frame_hub.start()
+    print("FrameHub thread started.")
 
     robot_control = ExeRobotControl()
     robot_control.start()
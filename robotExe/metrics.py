@@ -0,0 +1,225 @@
+# metrics.py
+#
+# Counters and fixed bucket histograms for the robot, exported in the Prometheus
+# text format by the backend (GET /metrics).
+#
+#   FRAMES = metrics.counter('camera_frames_total', "Frames read from the camera")
+#   FRAMES.inc()
+#
+#   DETECT = metrics.histogram('vision_stage_seconds', "Vision stage time", labels={'stage': 'detect'})
+#   with DETECT.time():
+#       ...
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# Per thread cells of a metric. Every thread only ever writes its own cell, so updates
+# need no lock, the reader adds the cells up (a scrape may miss an update in flight).
+class _Cells:
+
+    def __init__(self, size):
+
+        self._size = size
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def mine(self):
+
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self._size
+            # only taken once per thread
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def totals(self):
+
+        with self._lock:
+            cells = list(self._cells)
+        return [sum(values) for values in zip(*cells)] if cells else [0] * self._size
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=None):
+
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self._cells = _Cells(1)
+
+    def inc(self, amount=1):
+        self._cells.mine()[0] += amount
+
+    def value(self):
+        return self._cells.totals()[0]
+
+    def samples(self):
+        return [(self.name, self.labels, self.value())]
+
+
+# Value set by its owner, or read from "source" at scrape time
+class Gauge:
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=None, source=None):
+
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.source = source
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self.source() if self.source is not None else self._value
+
+    def samples(self):
+        return [(self.name, self.labels, self.value())]
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        # one count per bucket, the +Inf one, then the sum
+        self._cells = _Cells(len(self.buckets) + 2)
+
+    def observe(self, value):
+
+        cell = self._cells.mine()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self):
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def count(self):
+        return sum(self._cells.totals()[:-1])
+
+    def samples(self):
+
+        totals = self._cells.totals()
+        counts, total_sum = totals[:-1], totals[-1]
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            samples.append((self.name + '_bucket', dict(self.labels, le=le), cumulative))
+        samples.append((self.name + '_sum', self.labels, total_sum))
+        samples.append((self.name + '_count', self.labels, cumulative))
+        return samples
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+# decorator recording the run time of every call into "histogram"
+def timed(histogram: Histogram):
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+# All metrics of the process, the same name with different labels makes one metric family
+class Registry:
+
+    def __init__(self):
+
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, labels, **kwargs):
+
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = cls(name, help, labels=labels, **kwargs)
+                self._metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help, labels=None):
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None, source=None):
+        return self._get_or_create(Gauge, name, help, labels, source=source)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+
+        lines = []
+        family = None
+        for (name, _), metric in metrics:
+            if name != family:
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                family = name
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+# Create a singleton instance
+registry = Registry()
+
+counter = registry.counter
+gauge = registry.gauge
+histogram = registry.histogram
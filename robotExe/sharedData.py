@@ -1,86 +1,210 @@
 # sharedData.py
 
+import asyncio
+import threading
+from ArucoDetection.poseData import PoseTable, empty_pose_records
+from telemetryLog import telemetry_log
+
+
+FORKLIFT_FIELDS = ('forklift_command_up', 'forklift_command_down', 'forklift_status', 'forklift_zero')
+PICKING_FIELDS = ('picking_status', 'start_picking_process')
+# order of the forklift fields in a telemetry record
+FORKLIFT_STATE = ('forklift_status', 'forklift_command_up', 'forklift_command_down', 'forklift_zero')
+
+
+# wakes up a single asyncio waiter, called on the waiter's own event loop
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Versioned store shared between the vision thread, the robot control thread and the backend.
+# Every setter bumps a per-field sequence number and signals waiters, so consumers can
+# block (threads) or await (asyncio handlers) changes instead of polling.
 class SharedData:
     def __init__(self):
-        
-        self._frame = None
-        self._pose_data = []
-        
-        
-        self._mode = "manul" # 'manual', 'auto' ws:mode
-        
-        self._start_picking_process = False
-        self._picking_status = '-'
-
-        self._forklift_zero = True
-        self._forklift_command_up = False
-        self._forklift_command_down = False
-        self._forklift_status = '-' # 'going up', 'going down', 'steady up', 'steady down'
-
-        
-        
-        
-    
+
+        self._values = {
+            'frame': None,
+            'pose_data': empty_pose_records(),
+
+            'mode': "manul", # 'manual', 'auto' ws:mode
+
+            'start_picking_process': False,
+            'picking_status': '-',
+
+            'forklift_zero': True,
+            'forklift_command_up': False,
+            'forklift_command_down': False,
+            'forklift_status': '-', # '-' (position unknown), 'Going up', 'Going down', 'Steady up', 'Steady down', 'Stopped', 'Fault'
+        }
+
+        self._versions = dict.fromkeys(self._values, 0)
+        # marker indexed view of the latest pose data
+        self.pose_table = PoseTable()
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+
+
+    # sets several fields at once, readers never see only a part of the update
+    def update(self, **fields):
+
+        with self._cond:
+            for name, value in fields.items():
+                if name not in self._values:
+                    raise KeyError(f"Unknown shared data field: {name}")
+                self._values[name] = value
+                self._versions[name] += 1
+            self._cond.notify_all()
+
+            woken = [w for w in self._async_waiters if not w[2].isdisjoint(fields)]
+            if woken:
+                self._async_waiters = [w for w in self._async_waiters if w[2].isdisjoint(fields)]
+
+            if not set(FORKLIFT_FIELDS).isdisjoint(fields):
+                telemetry_log.forklift(*(self._values[name] for name in FORKLIFT_STATE))
+
+        for loop, future, _ in woken:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # event loop already closed
+                pass
+
+    def get_version(self, name):
+        return self._versions[name]
+
+    def get_versions(self, fields):
+        with self._cond:
+            return self._versions_of(fields)
+
+    # consistent copy of the requested fields and their versions
+    def snapshot(self, fields):
+        with self._cond:
+            return {name: self._values[name] for name in fields}, self._versions_of(fields)
+
+    # blocks until any of "fields" changes after "since" (versions returned by a previous call,
+    # current versions by default) or timeout expires, returns versions of the fields
+    def wait_for_change(self, fields, timeout=None, since=None):
+
+        with self._cond:
+            if since is None:
+                since = self._versions_of(fields)
+            self._cond.wait_for(lambda: self._changed(since), timeout)
+            return self._versions_of(fields)
+
+    # asyncio equivalent of "wait_for_change", never blocks the event loop
+    async def wait_for_change_async(self, fields, timeout=None, since=None):
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future, frozenset(fields))
+
+        with self._cond:
+            if since is None:
+                since = self._versions_of(fields)
+            if self._changed(since):
+                return self._versions_of(fields)
+            self._async_waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+
+        return self.get_versions(fields)
+
+    def _versions_of(self, fields):
+        return {name: self._versions[name] for name in fields}
+
+    def _changed(self, since):
+        return any(self._versions[name] != version for name, version in since.items())
+
+
     def set_frame(self, frame):
-        self._frame = frame
-    
+        self.update(frame=frame)
+
     def get_frame(self):
-        return self._frame
-    
+        return self._values['frame']
+
+    # returns frame together with its sequence number, so consumers can tell
+    # a new frame from the one they have already processed
+    def get_frame_with_seq(self):
+        with self._cond:
+            return self._values['frame'], self._versions['frame']
+
+    # blocks until a frame newer than "last_seq" is published or timeout expires,
+    # returns the current frame sequence number
+    def wait_for_frame(self, last_seq, timeout=None):
+        return self.wait_for_change(('frame',), timeout, since={'frame': last_seq})['frame']
+
+    # the pose table is filled before the version bump, so whoever wakes up on it reads the new poses
     def set_pose_data(self, pose_data):
-        self._pose_data = pose_data
-    
+        self.pose_table.update(pose_data)
+        telemetry_log.pose(pose_data)
+        self.update(pose_data=pose_data)
+
     def get_pose_data(self):
-        return self._pose_data
-    
+        return self._values['pose_data']
+
     def set_mode(self, mode):
-        self._mode = mode
-    
+        self.update(mode=mode)
+
     def get_mode(self):
-        return self._mode
-    
-    
+        return self._values['mode']
+
+
 
     def set_start_picking_process(self, value):
-        self._start_picking_process = value
-        
+        self.update(start_picking_process=value)
+
     def get_start_picking_process(self):
-        return self._start_picking_process
-    
+        return self._values['start_picking_process']
+
     def set_picking_status(self, value):
-        self._start_picking_status = value
-        
+        self.update(picking_status=value)
+
     def get_picking_status(self):
-        return self._start_picking_status
-    
-    
-    
-    
+        return self._values['picking_status']
+
+
+
+
     def get_forklift_command_up(self):
-        return self._forklift_command_up
+        return self._values['forklift_command_up']
 
     def get_forklift_command_down(self):
-        return self._forklift_command_down
-    
+        return self._values['forklift_command_down']
+
     def set_forklift_command_up(self, command: bool):
-        self._forklift_command_up = command
+        self.update(forklift_command_up=command)
 
     def set_forklift_command_down(self, command: bool):
-        self._forklift_command_down = command
-        
+        self.update(forklift_command_down=command)
+
     def get_forklift_status(self):
-        return self._forklift_status
-    
+        return self._values['forklift_status']
+
     def set_forklift_status(self, status: str):
-        self._forklift_status = status
-        
+        self.update(forklift_status=status)
+
     def get_forklift_zero(self):
-        return self._forklift_zero
-    
+        return self._values['forklift_zero']
+
     def set_forklift_zero(self, stat: bool):
-        self._forklift_zero = stat
-        
-        
+        self.update(forklift_zero=stat)
+
+    # whole forklift state taken under one lock
+    def get_forklift_state(self):
+        values, _ = self.snapshot(FORKLIFT_FIELDS)
+        return values
+
+
 
 
 
@@ -0,0 +1,295 @@
+# telemetryLog.py
+#
+# Append only binary log of what the robot saw and did: pose samples, wheel setpoints,
+# motor telemetry, forklift state and mission state transitions. Every record has the same
+# fixed 32 byte layout, so a log file is a plain array that numpy maps straight from disk:
+#
+#   log = TelemetryFile('telemetry/telemetry-20260101-120000.tlog')
+#   poses = log.of_kind(POSE)
+#   poses['timestamp'], poses['values'][:, 0]
+#
+# Summary of a recorded directory:
+#   python -m telemetryLog telemetry/
+
+import argparse
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+from clock import clock
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'RBTLM1\n'
+HEADER_LENGTH = struct.Struct('<I')
+
+LOG_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry')
+# a new file is started once the current one reaches this size, the oldest are deleted
+MAX_FILE_BYTES = 64 * 1024 * 1024
+MAX_FILES = 20
+# records waiting for the writer, beyond that new records are dropped
+MAX_PENDING = 65536
+# seconds between writes
+FLUSH_INTERVAL = 0.2
+
+# record kinds and the meaning of "id", "seq" and "values" for each of them
+LABEL = 0       # id: label code, values: up to 16 bytes of ASCII text
+POSE = 1        # id: marker, seq: frame, values: x_cm, z_cm, roll
+SETPOINT = 2    # values: fl, fr, rl, rr target RPM
+MOTOR = 3       # id: motor, values: current_rpm, target_rpm, error_pid, pwm_value
+FORKLIFT = 4    # id: status label, values: command_up, command_down, zero
+MISSION = 5     # id: state label, seq: leg label, values: seconds spent in the previous state
+
+KIND_NAMES = {LABEL: 'label', POSE: 'pose', SETPOINT: 'setpoint', MOTOR: 'motor',
+              FORKLIFT: 'forklift', MISSION: 'mission'}
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', np.float64),      # host monotonic clock [s]
+    ('kind', np.uint8),
+    ('flags', np.uint8),
+    ('id', np.int16),
+    ('seq', np.uint32),
+    ('values', np.float32, (4,)),
+])
+
+LABEL_BYTES = RECORD_DTYPE['values'].itemsize
+
+NAN = float('nan')
+
+
+# Background writer of the telemetry log. "record" only appends a tuple to a queue, the
+# writer thread turns the queue into one numpy block per interval and appends it to the file.
+# Strings (forklift status, mission states) are interned as label codes, every file starts
+# with the label records it needs, so each file can be read on its own.
+class TelemetryLog(threading.Thread):
+
+    def __init__(self, directory=LOG_DIRECTORY, max_file_bytes=MAX_FILE_BYTES, max_files=MAX_FILES):
+        threading.Thread.__init__(self, daemon=True)
+
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.running = False
+
+        self.path = None
+        self.written_records = 0
+        self.dropped_records = 0
+
+        self._pending = deque()
+        self._labels = {}
+        self._labels_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._file = None
+        self._file_bytes = 0
+
+    # nothing is queued before the writer runs, so the log costs nothing when it is off
+    def start(self):
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.running = True
+        threading.Thread.start(self)
+
+    def run(self):
+
+        self._open_file()
+        while self.running:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self._write_pending()
+
+        self._write_pending()
+        self._file.close()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+    def record(self, kind, id=0, seq=0, values=(NAN, NAN, NAN, NAN), timestamp=None, flags=0):
+
+        if not self.running:
+            return
+        if len(self._pending) >= MAX_PENDING:
+            self.dropped_records += 1
+            return
+        self._pending.append((clock.monotonic() if timestamp is None else timestamp, kind, flags, id, seq, values))
+
+    # code of "text", new labels are logged the first time they are used
+    def label(self, text):
+
+        code = self._labels.get(text)
+        if code is not None:
+            return code
+
+        with self._labels_lock:
+            code = self._labels.get(text)
+            if code is None:
+                code = len(self._labels)
+                self._labels[text] = code
+                self.record(LABEL, code, values=_pack_label(text))
+        return code
+
+    def pose(self, records):
+
+        for marker_id, x_cm, z_cm, roll, timestamp, seq in records.tolist():
+            self.record(POSE, marker_id, seq, (x_cm, z_cm, roll, NAN), timestamp)
+
+    def setpoint(self, speeds):
+        self.record(SETPOINT, values=tuple(speeds))
+
+    def motor(self, data):
+        self.record(MOTOR, data.motor, values=(data.current_rpm, data.target_rpm, data.error_pid, data.pwm_value),
+                    timestamp=data.timestamp)
+
+    def forklift(self, status, command_up, command_down, zero):
+        self.record(FORKLIFT, self.label(status), values=(command_up, command_down, zero, NAN))
+
+    def mission(self, state, leg, previous_duration=None):
+        self.record(MISSION, self.label(state), self.label(leg or '-'),
+                    (NAN if previous_duration is None else previous_duration, NAN, NAN, NAN))
+
+    def _open_file(self):
+
+        name = time.strftime('telemetry-%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'{name}.tlog')
+        index = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f'{name}-{index}.tlog')
+            index += 1
+
+        header = json.dumps({
+            'dtype': RECORD_DTYPE.descr,
+            'kinds': KIND_NAMES,
+            'wall_time': time.time(),
+            'monotonic': clock.monotonic(),
+        }).encode('utf-8')
+
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(HEADER_LENGTH.pack(len(header)))
+        self._file.write(header)
+        self._file_bytes = self._file.tell()
+        self.path = path
+
+        with self._labels_lock:
+            labels = [(LABEL, code, _pack_label(text)) for text, code in self._labels.items()]
+        if labels:
+            self._write_block(np.array([(0.0, kind, 0, code, 0, values) for kind, code, values in labels],
+                                       dtype=RECORD_DTYPE))
+
+        self._remove_old_files()
+
+    def _remove_old_files(self):
+
+        files = sorted(glob.glob(os.path.join(self.directory, '*.tlog')), key=os.path.getmtime)
+        for path in files[:-self.max_files]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Telemetry log %s could not be removed: %s", path, e)
+
+    def _write_pending(self):
+
+        count = len(self._pending)
+        if count == 0:
+            return
+        rows = [self._pending.popleft() for _ in range(count)]
+
+        try:
+            self._write_block(np.array(rows, dtype=RECORD_DTYPE))
+        except Exception as e:
+            logger.error("Telemetry log write error: %s", e)
+            return
+
+        if self._file_bytes >= self.max_file_bytes:
+            self._file.close()
+            self._open_file()
+
+    def _write_block(self, block):
+
+        data = block.tobytes()
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
+        self.written_records += len(block)
+
+
+# label text stored in the float values of a record, ASCII only: its bytes never
+# form a NaN, so they survive the conversion to python floats unchanged
+def _pack_label(text):
+
+    raw = text.encode('ascii', errors='replace')[:LABEL_BYTES].ljust(LABEL_BYTES, b'\0')
+    return tuple(np.frombuffer(raw, dtype=np.float32).tolist())
+
+
+# Read only view of one log file. The records are memory mapped, so files of hours of
+# runs open instantly and only the pages that are used are read. A record cut short by
+# a crash at the end of the file is ignored.
+class TelemetryFile:
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a telemetry log")
+            (length,) = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+            self.header = json.loads(file.read(length))
+            data_start = file.tell()
+
+        count = (os.path.getsize(path) - data_start) // RECORD_DTYPE.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=data_start, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+        label_records = self.of_kind(LABEL)
+        texts = label_records['values'].copy().view(f'S{LABEL_BYTES}').ravel()
+        self.labels = {int(code): text.decode('ascii', errors='replace')
+                       for code, text in zip(label_records['id'], texts)}
+
+    def __len__(self):
+        return len(self.records)
+
+    def of_kind(self, kind):
+        return self.records[self.records['kind'] == kind]
+
+    def label(self, code):
+        return self.labels.get(int(code), f'#{code}')
+
+    # (time, state, leg, seconds in the previous state) of every mission transition
+    def mission_transitions(self):
+
+        return [(float(record['timestamp']), self.label(record['id']), self.label(record['seq']),
+                 float(record['values'][0]))
+                for record in self.of_kind(MISSION)]
+
+
+# log files of "directory", oldest first
+def open_logs(directory=LOG_DIRECTORY):
+    return [TelemetryFile(path) for path in sorted(glob.glob(os.path.join(directory, '*.tlog')), key=os.path.getmtime)]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Summary of recorded telemetry logs")
+    parser.add_argument('directory', nargs='?', default=LOG_DIRECTORY)
+    args = parser.parse_args()
+
+    for log in open_logs(args.directory):
+        timestamps = log.records['timestamp'][log.records['kind'] != LABEL]
+        span = float(timestamps.max() - timestamps.min()) if len(timestamps) else 0.0
+        counts = ", ".join(f"{name} {int((log.records['kind'] == kind).sum())}" for kind, name in KIND_NAMES.items())
+        print(f"{os.path.basename(log.path)}: {len(log)} records over {span:.1f} s ({counts})")
+
+
+# Create a singleton instance
+telemetry_log = TelemetryLog()
+
+
+if __name__ == "__main__":
+    main()
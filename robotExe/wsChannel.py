@@ -0,0 +1,274 @@
+# wsChannel.py
+#
+# Protocol of the multiplexed /ws endpoint. One socket per operator screen carries every
+# control topic, the server only sends the fields that changed:
+#
+#   -> {"type": "subscribe", "topics": ["mode", "forklift"]}
+#   <- {"type": "snapshot", "topic": "mode", "data": {"mode": "manual"}}
+#   -> {"type": "command", "id": 7, "name": "set_mode", "args": {"mode": "auto"}}
+#   <- {"type": "ack", "id": 7, "ok": true}
+#   <- {"type": "patch", "topic": "mode", "data": {"mode": "auto"}}
+#
+# Messages are JSON text frames, or msgpack binary frames with /ws?codec=msgpack.
+# Video keeps its own /video socket, large frames would hold up the control messages.
+
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable
+from sharedData import shared_data, FORKLIFT_FIELDS, PICKING_FIELDS
+from ArucoDetection.poseData import pose_records_to_dicts, PoseThrottle
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_JSON = 'json'
+CODEC_MSGPACK = 'msgpack'
+
+MODES = ('manual', 'auto')
+
+# pose updates per second for operator screens
+POSE_TOPIC_RATE = 10.0
+
+
+# Shared data fields a topic is built from and how its message is built from them.
+# "throttle" creates the per subscription filter of a high rate topic (see PoseThrottle),
+# it looks at the first field of the topic.
+@dataclass
+class Topic:
+    fields: tuple
+    build: Callable
+    throttle: Callable = None
+
+
+TOPICS = {
+    'mode': Topic(('mode',), lambda values: {'mode': values['mode']}),
+    'picking': Topic(PICKING_FIELDS, lambda values: {
+        'status': values['picking_status'],
+        'start_picking_process': values['start_picking_process'],
+    }),
+    'forklift': Topic(FORKLIFT_FIELDS, lambda values: {
+        'command_up': values['forklift_command_up'],
+        'command_down': values['forklift_command_down'],
+        'status': values['forklift_status'],
+        'zero': values['forklift_zero'],
+    }),
+    'pose': Topic(('pose_data',), lambda values: {'markers': pose_records_to_dicts(values['pose_data'])},
+                  throttle=lambda: PoseThrottle(max_rate=POSE_TOPIC_RATE)),
+}
+
+
+class CommandError(Exception):
+    pass
+
+
+def set_mode(mode):
+
+    if mode not in MODES:
+        raise CommandError(f"Unknown mode: {mode}")
+    shared_data.set_mode(mode)
+
+
+def set_picking(start):
+    shared_data.set_start_picking_process(bool(start))
+
+
+# manual forklift moves are only taken when the forklift stands at the other end or was
+# stopped on the way, a lift at fault only takes a zero
+def forklift_command(command_up=False, command_down=False, zero=False):
+
+    status = shared_data.get_forklift_status()
+    manual = shared_data.get_mode() == 'manual'
+
+    if command_up or command_down:
+        if not manual:
+            raise CommandError("Forklift can only be moved in manual mode")
+        if command_down and status in ('Steady up', 'Stopped'):
+            shared_data.set_forklift_command_down(True)
+        elif command_up and status in ('Steady down', 'Stopped'):
+            shared_data.set_forklift_command_up(True)
+        else:
+            raise CommandError(f"Forklift is '{status}'")
+
+    if zero:
+        shared_data.set_forklift_zero(True)
+
+
+COMMANDS = {
+    'set_mode': set_mode,
+    'picking': set_picking,
+    'forklift': forklift_command,
+}
+
+
+def encoder(codec):
+
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        return msgpack.packb
+    if orjson is not None:
+        return lambda message: orjson.dumps(message).decode('utf-8')
+    return lambda message: json.dumps(message, separators=(',', ':'))
+
+
+def decoder(codec):
+
+    if codec == CODEC_MSGPACK:
+        return msgpack.unpackb
+    return orjson.loads if orjson is not None else json.loads
+
+
+# State of one /ws connection. "send" and "receive" are the socket coroutines, sending and
+# receiving the encoded messages. "push_updates" waits for changes of every subscribed field
+# at once and sends patches, "handle_messages" takes subscriptions and commands, the two
+# coroutines are all a connection costs.
+class Channel:
+
+    def __init__(self, send, receive, codec=CODEC_JSON):
+
+        self._send = send
+        self._receive = receive
+        self._encode = encoder(codec)
+        self._decode = decoder(codec)
+        self._send_lock = asyncio.Lock()
+
+        # topic -> message last sent for it, None until its snapshot went out
+        self.subscriptions = {}
+        self._throttles = {}
+        self._versions = {}
+        # seconds until a throttled topic may be sent, None when nothing is held back
+        self._retry = None
+        self._resubscribed = asyncio.Event()
+
+    async def send(self, message):
+
+        data = self._encode(message)
+        async with self._send_lock:
+            await self._send(data)
+
+    def _fields(self):
+        return {field for topic in self.subscriptions for field in TOPICS[topic].fields}
+
+    async def push_updates(self):
+
+        while True:
+            self._resubscribed.clear()
+            fields = self._fields()
+            if fields:
+                await self._push_changes(fields)
+
+            waits = [asyncio.create_task(self._resubscribed.wait())]
+            if fields:
+                waits.append(asyncio.create_task(
+                    shared_data.wait_for_change_async(fields, since=self._versions)))
+            try:
+                await asyncio.wait(waits, timeout=self._retry, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for wait in waits:
+                    wait.cancel()
+
+    async def _push_changes(self, fields):
+
+        values, self._versions = shared_data.snapshot(fields)
+        now = time.monotonic()
+        self._retry = None
+
+        for topic, last in list(self.subscriptions.items()):
+            throttle = self._throttles.get(topic)
+            if throttle is not None and last is not None:
+                source = values[TOPICS[topic].fields[0]]
+                delay = throttle.delay(source, now)
+                if delay is None:
+                    continue
+                if delay > 0:
+                    self._retry = delay if self._retry is None else min(self._retry, delay)
+                    continue
+
+            message = TOPICS[topic].build(values)
+            if last is None:
+                await self.send({'type': 'snapshot', 'topic': topic, 'data': message})
+            else:
+                patch = {key: value for key, value in message.items() if last.get(key) != value}
+                if not patch:
+                    continue
+                await self.send({'type': 'patch', 'topic': topic, 'data': patch})
+
+            if throttle is not None:
+                throttle.sent(values[TOPICS[topic].fields[0]], now)
+
+            # unless it was unsubscribed or subscribed again in the meantime
+            if topic in self.subscriptions and self.subscriptions[topic] is last:
+                self.subscriptions[topic] = message
+
+    async def handle_messages(self):
+
+        while True:
+            data = await self._receive()
+            try:
+                message = self._decode(data)
+            except ValueError as e:
+                await self.send({'type': 'error', 'error': f"Invalid message: {e}"})
+                continue
+
+            if not isinstance(message, dict):
+                await self.send({'type': 'error', 'error': "Message must be an object"})
+                continue
+
+            kind = message.get('type')
+            if kind == 'subscribe':
+                self.subscribe(message.get('topics', ()))
+            elif kind == 'unsubscribe':
+                self.unsubscribe(message.get('topics', ()))
+            elif kind == 'command':
+                await self.send(self.execute(message))
+            else:
+                await self.send({'type': 'error', 'error': f"Unknown message type: {kind}"})
+
+    def subscribe(self, topics):
+
+        for topic in topics:
+            if topic in TOPICS:
+                # a repeated subscription gets a fresh snapshot
+                self.subscriptions[topic] = None
+                if TOPICS[topic].throttle is not None:
+                    self._throttles[topic] = TOPICS[topic].throttle()
+            else:
+                logger.debug("Unknown topic: %s", topic)
+        self._resubscribed.set()
+
+    def unsubscribe(self, topics):
+
+        for topic in topics:
+            self.subscriptions.pop(topic, None)
+            self._throttles.pop(topic, None)
+        self._resubscribed.set()
+
+    def execute(self, message):
+
+        ack = {'type': 'ack', 'id': message.get('id'), 'ok': True}
+
+        command = COMMANDS.get(message.get('name'))
+        args = message.get('args') or {}
+        try:
+            if command is None:
+                raise CommandError(f"Unknown command: {message.get('name')}")
+            if not isinstance(args, dict):
+                raise CommandError("Command args must be an object")
+            command(**args)
+        except (CommandError, TypeError) as e:
+            ack.update(ok=False, error=str(e))
+
+        logger.debug("Command %s: %s", message, ack)
+        return ack